@@ -13,7 +13,7 @@ from typing import Dict, Tuple, Optional
 from src.template import Template
 from src.evaluation import EvaluationConfig
 from src.utils.parsing import get_concatenated_response, open_config_with_defaults
-from src.core import ImageInstanceOps
+from src.core import ImageInstanceOps, ProcessingContext
 
 from backend.config import TEMPLATE_JSON, ANSWER_KEY_JSON, CONFIG_JSON
 
@@ -81,13 +81,13 @@ class OMRProcessor:
             if in_omr is None:
                 raise ValueError(f"Could not read image: {image_path}")
             
-            # Reset save images
-            self.template.image_instance_ops.reset_all_save_img()
-            self.template.image_instance_ops.append_save_img(1, in_omr)
+            # Per-request state, the shared template stays untouched
+            context = ProcessingContext(image_path)
+            self.template.image_instance_ops.append_save_img(1, in_omr, context)
             
 
             processed_omr = self.template.image_instance_ops.apply_preprocessors(
-                str(image_path), in_omr, self.template
+                str(image_path), in_omr, self.template, context
             )
             
             if processed_omr is None:
@@ -110,7 +110,8 @@ class OMRProcessor:
                 self.template,
                 image=processed_omr,
                 name=file_id,
-                save_dir=save_dir if save_marked_image else None
+                save_dir=save_dir if save_marked_image else None,
+                context=context
             )
             
             # Get concatenated responses
@@ -130,7 +131,8 @@ class OMRProcessor:
                     omr_response,
                     self.evaluation_config,
                     image_path,
-                    save_dir
+                    save_dir,
+                    context
                 )
                 
                 # Get max score from evaluation config
@@ -69,6 +69,54 @@ def parse_args():
         run again until the template is set.",
     )
 
+    argparser.add_argument(
+        "-t",
+        "--threads",
+        default=1,
+        required=False,
+        type=int,
+        dest="threads",
+        help="Number of threads reading the OMR sheets of a directory in parallel.",
+    )
+
+    argparser.add_argument(
+        "-w",
+        "--workers",
+        default=1,
+        required=False,
+        type=int,
+        dest="workers",
+        help="Number of processes reading the OMR sheets of a directory in parallel.",
+    )
+
+    argparser.add_argument(
+        "-p",
+        "--pipeline",
+        required=False,
+        dest="pipeline",
+        action="store_true",
+        help="Overlap decoding, reading and writing of the OMR sheets in separate \
+        stages (reading runs on --threads threads).",
+    )
+
+    argparser.add_argument(
+        "--outputFormats",
+        default=["csv"],
+        nargs="+",
+        choices=["csv", "jsonl", "parquet"],
+        required=False,
+        dest="output_formats",
+        help="Formats of the Results, MultiMarked and Errors files.",
+    )
+
+    argparser.add_argument(
+        "--timingsFile",
+        default=None,
+        required=False,
+        dest="timings_file",
+        help="Append the per-stage timings of each OMR sheet to this JSON Lines file.",
+    )
+
     (
         args,
         unknown,
@@ -80,6 +128,14 @@ def parse_args():
         logger.warning(f"\nError: Unknown arguments: {unknown}", unknown)
         argparser.print_help()
         exit(11)
+    if args["threads"] < 1:
+        logger.warning(f"\nError: --threads must be at least 1, got {args['threads']}")
+        argparser.print_help()
+        exit(11)
+    if args["workers"] < 1:
+        logger.warning(f"\nError: --workers must be at least 1, got {args['workers']}")
+        argparser.print_help()
+        exit(11)
     return args
 
 
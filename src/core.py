@@ -1,5 +1,8 @@
 import os
 from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import perf_counter
 from typing import Any
 
 import cv2
@@ -8,22 +11,131 @@ import numpy as np
 
 import src.constants as constants
 from src.logger import logger
-from src.utils.image import CLAHE_HELPER, ImageUtils
+from src.utils.image import (
+    REDUCED_GRAYSCALE_FLAGS,
+    ImageUtils,
+    get_clahe_helper,
+    get_gamma_table,
+    get_jpeg_size,
+)
 from src.utils.interaction import InteractionUtils
 
+# Upper bound on the summed-area tables held at once by read_omr_response_batch
+BATCH_INTEGRAL_MAX_BYTES = 256 * 1024 * 1024
+
+# Maps pixel values to their THRESH_TRUNC at 200
+TRUNCATE_200_TABLE = np.minimum(np.arange(256), 200).astype(np.uint8)
+
+
+@dataclass
+class BubbleStats:
+    """Per-sheet bubble statistics, arrays follow the CompiledTemplate layout"""
+
+    block_shifts: list
+    bubble_x: np.ndarray
+    bubble_means: np.ndarray
+    bubbles_marked: np.ndarray
+    field_std_devs: np.ndarray
+    field_thresholds: np.ndarray
+    # Distance from each field threshold to its nearest bubble mean
+    field_confidences: np.ndarray
+    global_thr: float
+    global_std_thresh: float
+
+
+@dataclass
+class ProcessingContext:
+    """
+    Mutable state of processing a single sheet. The Template, its processors and
+    the EvaluationConfig stay read-only, so one of each can serve many threads as
+    long as every call gets its own context.
+    """
+
+    file_path: Any = None
+    save_img_list: Any = field(default_factory=lambda: defaultdict(list))
+    # Horizontal shift of each field block found by auto alignment
+    field_block_shifts: Any = None
+    # Average marker match of each CropOnMarkers pass (analysis data)
+    threshold_circles: list = field(default_factory=list)
+    explanation_table: Any = None
+    # BubbleStats of the pass that produced the response
+    bubble_stats: Any = None
+    # (path, image) of the images to save, None to save them right away
+    deferred_image_writes: Any = None
+    # Seconds spent in each stage of processing the sheet
+    stage_timings: dict = field(default_factory=dict)
+    running_stages: set = field(default_factory=set)
+
+    def add_stage_time(self, stage, seconds):
+        self.stage_timings[stage] = self.stage_timings.get(stage, 0) + seconds
+
+    @contextmanager
+    def time_stage(self, stage):
+        # Note: nested calls of a running stage are already being timed
+        if stage in self.running_stages:
+            yield
+            return
+        self.running_stages.add(stage)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage, perf_counter() - start)
+            self.running_stages.discard(stage)
+
 
 class ImageInstanceOps:
     """Class to hold fine-tuned utilities for a group of images. One instance for each processing directory."""
 
-    save_img_list: Any = defaultdict(list)
-
     def __init__(self, tuning_config):
         super().__init__()
         self.tuning_config = tuning_config
         self.save_image_level = tuning_config.outputs.save_image_level
 
-    def apply_preprocessors(self, file_path, in_omr, template):
+    @staticmethod
+    def get_context(context=None):
+        # Note: calls without a context get their own, nothing is shared between them
+        return ProcessingContext() if context is None else context
+
+    def read_image(self, file_path, template):
+        """
+        Decodes a sheet in grayscale. With preprocessing_params.reduced_decode, JPEGs
+        are decoded at 1/2, 1/4 or 1/8 of their size when that still leaves
+        min_decode_oversampling pixels per pixel of the processing dimensions (and
+        of the page dimensions, which compose_warps warps the decoded image to)
+        """
         tuning_config = self.tuning_config
+        preprocessing_params = tuning_config.preprocessing_params
+        image_size = (
+            get_jpeg_size(file_path) if preprocessing_params.reduced_decode else None
+        )
+        if image_size is not None:
+            dimensions = tuning_config.dimensions
+            target_sizes = [(dimensions.processing_width, dimensions.processing_height)]
+            if preprocessing_params.compose_warps:
+                target_sizes.append(tuple(template.page_dimensions))
+            downscale = ImageUtils.get_decode_downscale(
+                image_size,
+                target_sizes,
+                preprocessing_params.min_decode_oversampling,
+            )
+            if downscale > 1:
+                image = cv2.imread(str(file_path), REDUCED_GRAYSCALE_FLAGS[downscale])
+                if image is not None:
+                    return image
+        return cv2.imread(str(file_path), cv2.IMREAD_GRAYSCALE)
+
+    def apply_preprocessors(self, file_path, in_omr, template, context=None):
+        context = self.get_context(context)
+        tuning_config = self.tuning_config
+        if tuning_config.preprocessing_params.compose_warps and any(
+            pre_processor.supports_transform()
+            for pre_processor in template.pre_processors
+        ):
+            return self.apply_composed_preprocessors(
+                file_path, in_omr, template, context
+            )
+
         # resize to conform to template
         in_omr = ImageUtils.resize_util(
             in_omr,
@@ -33,47 +145,179 @@ class ImageInstanceOps:
 
         # run pre_processors in sequence
         for pre_processor in template.pre_processors:
-            in_omr = pre_processor.apply_filter(in_omr, file_path)
+            in_omr = pre_processor.apply_filter(in_omr, file_path, context)
         return in_omr
 
-    def read_omr_response(self, template, image, name, save_dir=None):
+    def apply_composed_preprocessors(self, file_path, in_omr, template, context):
+        """
+        Composes the transforms of the geometric preprocessors into one homography
+        that warps the decoded image straight to the page dimensions. Intermediate
+        images are only resampled for the detections of later preprocessors.
+        Pixel preprocessors run on the intermediate images for those detections
+        and again, in order, on the warped page.
+        """
+        dimensions = self.tuning_config.dimensions
+        pre_processors = template.pre_processors
+        image = ImageUtils.resize_util(
+            in_omr, dimensions.processing_width, dimensions.processing_height
+        )
+        size = (image.shape[1], image.shape[0])
+        transform = ImageUtils.get_resize_transform(
+            (in_omr.shape[1], in_omr.shape[0]), size
+        )
+        last_geometric = max(
+            index
+            for index, pre_processor in enumerate(pre_processors)
+            if pre_processor.supports_transform()
+        )
+        for index, pre_processor in enumerate(pre_processors[: last_geometric + 1]):
+            if not pre_processor.supports_transform():
+                image = pre_processor.apply_filter(image, file_path, context)
+                continue
+            found = pre_processor.get_transform(image, file_path, context)
+            if found is None:
+                return None
+            step, size = found
+            transform = step @ transform
+            if index < last_geometric:
+                image = cv2.warpPerspective(image, step, size)
+
+        page_width, page_height = template.page_dimensions
+        transform = (
+            ImageUtils.get_resize_transform(size, (page_width, page_height)) @ transform
+        )
+        image = cv2.warpPerspective(in_omr, transform, (page_width, page_height))
+        for pre_processor in pre_processors:
+            if not pre_processor.supports_transform():
+                image = pre_processor.apply_filter(image, file_path, context)
+        return image
+
+    @property
+    def headless(self):
+        # Scoring-only runs: nothing is shown, saved or annotated
+        outputs = self.tuning_config.outputs
+        return (
+            not outputs.save_detections
+            and outputs.show_image_level <= 0
+            and outputs.save_image_level <= 0
+        )
+
+    def get_page_image(self, template, image):
+        page_width, page_height = template.page_dimensions
+        img = image
+        if img.shape[:2] != (page_height, page_width):
+            img = ImageUtils.resize_util(img, page_width, page_height)
+        if img.max() > img.min():
+            img = ImageUtils.normalize_util(img)
+        # Note: img may still be the caller's image here, it is never written to
+        return img
+
+    def read_omr_response_headless(self, template, image, context=None):
+        """
+        Fast path of read_omr_response: allocates no overlay buffers, renders nothing
+        and copies nothing. Returns (omr_response, multi_marked, bubble_stats)
+        With cascade_params.enabled, a reduced resolution pass without auto alignment
+        is tried first and the sheet is only read again in full when one of its
+        fields is below cascade_params.min_confidence.
+        """
+        context = self.get_context(context)
+        cascade_params = self.tuning_config.cascade_params
+        if cascade_params.enabled:
+            omr_response, multi_marked, bubble_stats = self.read_bubbles_reduced(
+                template, image, context
+            )
+            min_confidence = float(bubble_stats.field_confidences.min(initial=np.inf))
+            if min_confidence >= cascade_params.min_confidence:
+                return omr_response, multi_marked, bubble_stats
+            logger.info(
+                f"Cascade: escalating to a full read, lowest field confidence {round(min_confidence, 2)} < {cascade_params.min_confidence}"
+            )
+
+        img, roi_origin = self.get_roi_image(template, image)
+        return self.read_bubbles(template, img, context, roi_origin)
+
+    def get_roi_image(self, template, image):
+        """
+        Resizes and normalizes only the template ROI of the page (CompiledTemplate.roi)
+        Returns the ROI image and its origin (x0, y0) in page coordinates
+        """
+        page_width, page_height = template.page_dimensions
+        x0, y0, x1, y1 = template.compiled.roi
+        if (x0, y0, x1, y1) == (0, 0, page_width, page_height):
+            return self.get_page_image(template, image), (0, 0)
+
+        h, w = image.shape[:2]
+        if (h, w) == (page_height, page_width):
+            img = image[y0:y1, x0:x1]
+        else:
+            # Samples the same positions as cv2.resize to page_dimensions would
+            scale_x, scale_y = w / page_width, h / page_height
+            transform = np.array(
+                [
+                    [scale_x, 0, (x0 + 0.5) * scale_x - 0.5],
+                    [0, scale_y, (y0 + 0.5) * scale_y - 0.5],
+                ]
+            )
+            img = cv2.warpAffine(
+                image,
+                transform,
+                (x1 - x0, y1 - y0),
+                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                borderMode=cv2.BORDER_REPLICATE,
+            )
+        if img.max() > img.min():
+            img = ImageUtils.normalize_util(img)
+        return img, (x0, y0)
+
+    def read_omr_response(self, template, image, name, save_dir=None, context=None):
         config = self.tuning_config
         auto_align = config.alignment_params.auto_align
+        context = self.get_context(context)
         try:
-            img = image.copy()
-            # origDim = img.shape[:2]
-            img = ImageUtils.resize_util(
-                img, template.page_dimensions[0], template.page_dimensions[1]
-            )
-            if img.max() > img.min():
-                img = ImageUtils.normalize_util(img)
+            if self.headless:
+                omr_response, multi_marked, _ = self.read_omr_response_headless(
+                    template, image, context
+                )
+                return omr_response, None, multi_marked, 0
+
+            img = self.get_page_image(template, image)
             # Processing copies
             transp_layer = img.copy()
             final_marked = img.copy()
 
-            morph = img.copy()
-            self.append_save_img(3, morph)
-
-            if auto_align:
-                # Note: clahe is good for morphology, bad for thresholding
-                morph = CLAHE_HELPER.apply(morph)
-                self.append_save_img(3, morph)
-                # Remove shadows further, make columns/boxes darker (less gamma)
-                morph = ImageUtils.adjust_gamma(
-                    morph, config.threshold_params.GAMMA_LOW
-                )
-                # TODO: all numbers should come from either constants or config
-                _, morph = cv2.threshold(morph, 220, 220, cv2.THRESH_TRUNC)
-                morph = ImageUtils.normalize_util(morph)
-                self.append_save_img(3, morph)
-                if config.outputs.show_image_level >= 4:
-                    InteractionUtils.show("morph1", morph, 0, 1, config)
-
             # Move them to data class if needed
             # Overlay Transparencies
             alpha = 0.65
-            omr_response = {}
-            multi_marked, multi_roll = 0, 0
+            multi_roll = 0
+
+            omr_response, multi_marked, bubble_stats = self.read_bubbles(
+                template, img, context
+            )
+            annotation_start = perf_counter()
+
+            final_align = None
+            if config.outputs.show_image_level >= 2:
+                initial_align = self.draw_template_layout(img, template, shifted=False)
+                final_align = self.draw_template_layout(
+                    img,
+                    template,
+                    shifted=True,
+                    draw_qvals=True,
+                    block_shifts=bubble_stats.block_shifts,
+                )
+                # appendSaveImg(4,mean_vals)
+                self.append_save_img(2, initial_align, context)
+                self.append_save_img(2, final_align, context)
+
+                if auto_align:
+                    final_align = np.hstack((initial_align, final_align))
+            self.append_save_img(5, img, context)
+
+            compiled = template.compiled
+            global_thr = bubble_stats.global_thr
+            global_std_thresh = bubble_stats.global_std_thresh
+            all_q_strip_arrs = compiled.split_by_field(bubble_stats.bubble_means)
+            all_q_std_vals = bubble_stats.field_std_devs
 
             # TODO Make this part useful for visualizing status checks
             # blackVals=[0]
@@ -83,293 +327,68 @@ class ImageInstanceOps:
                 all_c_box_vals = {"int": [], "mcq": []}
                 # TODO: simplify this logic
                 q_nums = {"int": [], "mcq": []}
-
-            # Find Shifts for the field_blocks --> Before calculating threshold!
-            if auto_align:
-                # print("Begin Alignment")
-                # Open : erode then dilate
-                v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 10))
-                morph_v = cv2.morphologyEx(
-                    morph, cv2.MORPH_OPEN, v_kernel, iterations=3
-                )
-                _, morph_v = cv2.threshold(morph_v, 200, 200, cv2.THRESH_TRUNC)
-                morph_v = 255 - ImageUtils.normalize_util(morph_v)
-
-                if config.outputs.show_image_level >= 3:
-                    InteractionUtils.show(
-                        "morphed_vertical", morph_v, 0, 1, config=config
+                for total_q_strip_no, field_label in enumerate(compiled.field_labels):
+                    block_index = compiled.field_block_index[total_q_strip_no]
+                    key = compiled.block_names[block_index][:3]
+                    block_q_strip_no = (
+                        total_q_strip_no - compiled.block_field_offsets[block_index] + 1
                     )
-
-                # InteractionUtils.show("morph1",morph,0,1,config=config)
-                # InteractionUtils.show("morphed_vertical",morph_v,0,1,config=config)
-
-                self.append_save_img(3, morph_v)
-
-                morph_thr = 60  # for Mobile images, 40 for scanned Images
-                _, morph_v = cv2.threshold(morph_v, morph_thr, 255, cv2.THRESH_BINARY)
-                # kernel best tuned to 5x5 now
-                morph_v = cv2.erode(morph_v, np.ones((5, 5), np.uint8), iterations=2)
-
-                self.append_save_img(3, morph_v)
-                # h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (10, 2))
-                # morph_h = cv2.morphologyEx(morph, cv2.MORPH_OPEN, h_kernel, iterations=3)
-                # ret, morph_h = cv2.threshold(morph_h,200,200,cv2.THRESH_TRUNC)
-                # morph_h = 255 - normalize_util(morph_h)
-                # InteractionUtils.show("morph_h",morph_h,0,1,config=config)
-                # _, morph_h = cv2.threshold(morph_h,morph_thr,255,cv2.THRESH_BINARY)
-                # morph_h = cv2.erode(morph_h,  np.ones((5,5),np.uint8), iterations = 2)
-                if config.outputs.show_image_level >= 3:
-                    InteractionUtils.show(
-                        "morph_thr_eroded", morph_v, 0, 1, config=config
+                    if config.outputs.show_image_level >= 6:
+                        self.get_local_threshold(
+                            all_q_strip_arrs[total_q_strip_no],
+                            global_thr,
+                            all_q_std_vals[total_q_strip_no] < global_std_thresh,
+                            f"Mean Intensity Histogram for {key}.{field_label}.{block_q_strip_no}",
+                            True,
+                        )
+                    if key in all_c_box_vals:
+                        q_nums[key].append(f"{key[:2]}_c{str(block_q_strip_no)}")
+                        all_c_box_vals[key].append(all_q_strip_arrs[total_q_strip_no])
+
+            for x, y, box_w, box_h, field_value, bubble_is_marked in zip(
+                bubble_stats.bubble_x.tolist(),
+                compiled.bubble_y.tolist(),
+                compiled.bubble_w.tolist(),
+                compiled.bubble_h.tolist(),
+                compiled.bubble_values,
+                bubble_stats.bubbles_marked.tolist(),
+            ):
+                if bubble_is_marked:
+                    cv2.rectangle(
+                        final_marked,
+                        (int(x + box_w / 12), int(y + box_h / 12)),
+                        (
+                            int(x + box_w - box_w / 12),
+                            int(y + box_h - box_h / 12),
+                        ),
+                        constants.CLR_DARK_GRAY,
+                        3,
                     )
 
-                self.append_save_img(6, morph_v)
-
-                # template relative alignment code
-                for field_block in template.field_blocks:
-                    s, d = field_block.origin, field_block.dimensions
-
-                    match_col, max_steps, align_stride, thk = map(
-                        config.alignment_params.get,
-                        [
-                            "match_col",
-                            "max_steps",
-                            "stride",
-                            "thickness",
-                        ],
+                    cv2.putText(
+                        final_marked,
+                        str(field_value),
+                        (x, y),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        constants.TEXT_SIZE,
+                        (20, 20, 10),
+                        int(1 + 3.5 * constants.TEXT_SIZE),
+                    )
+                else:
+                    cv2.rectangle(
+                        final_marked,
+                        (int(x + box_w / 10), int(y + box_h / 10)),
+                        (
+                            int(x + box_w - box_w / 10),
+                            int(y + box_h - box_h / 10),
+                        ),
+                        constants.CLR_GRAY,
+                        -1,
                     )
-                    shift, steps = 0, 0
-                    while steps < max_steps:
-                        left_mean = np.mean(
-                            morph_v[
-                                s[1] : s[1] + d[1],
-                                s[0] + shift - thk : -thk + s[0] + shift + match_col,
-                            ]
-                        )
-                        right_mean = np.mean(
-                            morph_v[
-                                s[1] : s[1] + d[1],
-                                s[0]
-                                + shift
-                                - match_col
-                                + d[0]
-                                + thk : thk
-                                + s[0]
-                                + shift
-                                + d[0],
-                            ]
-                        )
-
-                        # For demonstration purposes-
-                        # if(field_block.name == "int1"):
-                        #     ret = morph_v.copy()
-                        #     cv2.rectangle(ret,
-                        #                   (s[0]+shift-thk,s[1]),
-                        #                   (s[0]+shift+thk+d[0],s[1]+d[1]),
-                        #                   constants.CLR_WHITE,
-                        #                   3)
-                        #     appendSaveImg(6,ret)
-                        # print(shift, left_mean, right_mean)
-                        left_shift, right_shift = left_mean > 100, right_mean > 100
-                        if left_shift:
-                            if right_shift:
-                                break
-                            else:
-                                shift -= align_stride
-                        else:
-                            if right_shift:
-                                shift += align_stride
-                            else:
-                                break
-                        steps += 1
-
-                    field_block.shift = shift
-                    # print("Aligned field_block: ",field_block.name,"Corrected Shift:",
-                    #   field_block.shift,", dimensions:", field_block.dimensions,
-                    #   "origin:", field_block.origin,'\n')
-                # print("End Alignment")
-
-            final_align = None
-            if config.outputs.show_image_level >= 2:
-                initial_align = self.draw_template_layout(img, template, shifted=False)
-                final_align = self.draw_template_layout(
-                    img, template, shifted=True, draw_qvals=True
-                )
-                # appendSaveImg(4,mean_vals)
-                self.append_save_img(2, initial_align)
-                self.append_save_img(2, final_align)
-
-                if auto_align:
-                    final_align = np.hstack((initial_align, final_align))
-            self.append_save_img(5, img)
-
-            # Get mean bubbleValues n other stats
-            all_q_vals, all_q_strip_arrs, all_q_std_vals = [], [], []
-            total_q_strip_no = 0
-            for field_block in template.field_blocks:
-                box_w, box_h = field_block.bubble_dimensions
-                q_std_vals = []
-                for field_block_bubbles in field_block.traverse_bubbles:
-                    q_strip_vals = []
-                    for pt in field_block_bubbles:
-                        # shifted
-                        x, y = (pt.x + field_block.shift, pt.y)
-                        rect = [y, y + box_h, x, x + box_w]
-                        q_strip_vals.append(
-                            cv2.mean(img[rect[0] : rect[1], rect[2] : rect[3]])[0]
-                            # detectCross(img, rect) ? 100 : 0
-                        )
-                    q_std_vals.append(round(np.std(q_strip_vals), 2))
-                    all_q_strip_arrs.append(q_strip_vals)
-                    # _, _, _ = get_global_threshold(q_strip_vals, "QStrip Plot",
-                    #   plot_show=False, sort_in_plot=True)
-                    # hist = getPlotImg()
-                    # InteractionUtils.show("QStrip "+field_block_bubbles[0].field_label, hist, 0, 1,config=config)
-                    all_q_vals.extend(q_strip_vals)
-                    # print(total_q_strip_no, field_block_bubbles[0].field_label, q_std_vals[len(q_std_vals)-1])
-                    total_q_strip_no += 1
-                all_q_std_vals.extend(q_std_vals)
-
-            global_std_thresh, _, _ = self.get_global_threshold(
-                all_q_std_vals
-            )  # , "Q-wise Std-dev Plot", plot_show=True, sort_in_plot=True)
-            # plt.show()
-            # hist = getPlotImg()
-            # InteractionUtils.show("StdHist", hist, 0, 1,config=config)
-
-            # Note: Plotting takes Significant times here --> Change Plotting args
-            # to support show_image_level
-            # , "Mean Intensity Histogram",plot_show=True, sort_in_plot=True)
-            global_thr, _, _ = self.get_global_threshold(all_q_vals, looseness=4)
 
-            logger.info(
-                f"Thresholding: \tglobal_thr: {round(global_thr, 2)} \tglobal_std_THR: {round(global_std_thresh, 2)}\t{'(Looks like a Xeroxed OMR)' if (global_thr == 255) else ''}"
+            per_omr_threshold_avg = round(
+                float(np.mean(bubble_stats.field_thresholds)), 2
             )
-            # plt.show()
-            # hist = getPlotImg()
-            # InteractionUtils.show("StdHist", hist, 0, 1,config=config)
-
-            # if(config.outputs.show_image_level>=1):
-            #     hist = getPlotImg()
-            #     InteractionUtils.show("Hist", hist, 0, 1,config=config)
-            #     appendSaveImg(4,hist)
-            #     appendSaveImg(5,hist)
-            #     appendSaveImg(2,hist)
-
-            per_omr_threshold_avg, total_q_strip_no, total_q_box_no = 0, 0, 0
-            for field_block in template.field_blocks:
-                block_q_strip_no = 1
-                box_w, box_h = field_block.bubble_dimensions
-                shift = field_block.shift
-                s, d = field_block.origin, field_block.dimensions
-                key = field_block.name[:3]
-                # cv2.rectangle(final_marked,(s[0]+shift,s[1]),(s[0]+shift+d[0],
-                #   s[1]+d[1]),CLR_BLACK,3)
-                for field_block_bubbles in field_block.traverse_bubbles:
-                    # All Black or All White case
-                    no_outliers = all_q_std_vals[total_q_strip_no] < global_std_thresh
-                    # print(total_q_strip_no, field_block_bubbles[0].field_label,
-                    #   all_q_std_vals[total_q_strip_no], "no_outliers:", no_outliers)
-                    per_q_strip_threshold = self.get_local_threshold(
-                        all_q_strip_arrs[total_q_strip_no],
-                        global_thr,
-                        no_outliers,
-                        f"Mean Intensity Histogram for {key}.{field_block_bubbles[0].field_label}.{block_q_strip_no}",
-                        config.outputs.show_image_level >= 6,
-                    )
-                    # print(field_block_bubbles[0].field_label,key,block_q_strip_no, "THR: ",
-                    #   round(per_q_strip_threshold,2))
-                    per_omr_threshold_avg += per_q_strip_threshold
-
-                    # Note: Little debugging visualization - view the particular Qstrip
-                    # if(
-                    #     0
-                    #     # or "q17" in (field_block_bubbles[0].field_label)
-                    #     # or (field_block_bubbles[0].field_label+str(block_q_strip_no))=="q15"
-                    #  ):
-                    #     st, end = qStrip
-                    #     InteractionUtils.show("QStrip: "+key+"-"+str(block_q_strip_no),
-                    #     img[st[1] : end[1], st[0]+shift : end[0]+shift],0,config=config)
-
-                    # TODO: get rid of total_q_box_no
-                    detected_bubbles = []
-                    for bubble in field_block_bubbles:
-                        bubble_is_marked = (
-                            per_q_strip_threshold > all_q_vals[total_q_box_no]
-                        )
-                        total_q_box_no += 1
-                        if bubble_is_marked:
-                            detected_bubbles.append(bubble)
-                            x, y, field_value = (
-                                bubble.x + field_block.shift,
-                                bubble.y,
-                                bubble.field_value,
-                            )
-                            cv2.rectangle(
-                                final_marked,
-                                (int(x + box_w / 12), int(y + box_h / 12)),
-                                (
-                                    int(x + box_w - box_w / 12),
-                                    int(y + box_h - box_h / 12),
-                                ),
-                                constants.CLR_DARK_GRAY,
-                                3,
-                            )
-
-                            cv2.putText(
-                                final_marked,
-                                str(field_value),
-                                (x, y),
-                                cv2.FONT_HERSHEY_SIMPLEX,
-                                constants.TEXT_SIZE,
-                                (20, 20, 10),
-                                int(1 + 3.5 * constants.TEXT_SIZE),
-                            )
-                        else:
-                            cv2.rectangle(
-                                final_marked,
-                                (int(x + box_w / 10), int(y + box_h / 10)),
-                                (
-                                    int(x + box_w - box_w / 10),
-                                    int(y + box_h - box_h / 10),
-                                ),
-                                constants.CLR_GRAY,
-                                -1,
-                            )
-
-                    for bubble in detected_bubbles:
-                        field_label, field_value = (
-                            bubble.field_label,
-                            bubble.field_value,
-                        )
-                        # Only send rolls multi-marked in the directory
-                        multi_marked_local = field_label in omr_response
-                        omr_response[field_label] = (
-                            (omr_response[field_label] + field_value)
-                            if multi_marked_local
-                            else field_value
-                        )
-                        # TODO: generalize this into identifier
-                        # multi_roll = multi_marked_local and "Roll" in str(q)
-                        multi_marked = multi_marked or multi_marked_local
-
-                    if len(detected_bubbles) == 0:
-                        field_label = field_block_bubbles[0].field_label
-                        omr_response[field_label] = field_block.empty_val
-
-                    if config.outputs.show_image_level >= 5:
-                        if key in all_c_box_vals:
-                            q_nums[key].append(f"{key[:2]}_c{str(block_q_strip_no)}")
-                            all_c_box_vals[key].append(
-                                all_q_strip_arrs[total_q_strip_no]
-                            )
-
-                    block_q_strip_no += 1
-                    total_q_strip_no += 1
-                # /for field_block
-
-            per_omr_threshold_avg /= total_q_strip_no
-            per_omr_threshold_avg = round(per_omr_threshold_avg, 2)
             # Translucent
             cv2.addWeighted(
                 final_marked, alpha, transp_layer, 1 - alpha, 0, final_marked
@@ -412,73 +431,386 @@ class ImageInstanceOps:
                 if multi_roll:
                     save_dir = save_dir.joinpath("_MULTI_")
                 image_path = str(save_dir.joinpath(name))
-                ImageUtils.save_img(image_path, final_marked)
+                self.save_img(image_path, final_marked, context)
 
-            self.append_save_img(2, final_marked)
+            self.append_save_img(2, final_marked, context)
 
             if save_dir is not None:
                 for i in range(config.outputs.save_image_level):
-                    self.save_image_stacks(i + 1, name, save_dir)
+                    self.save_image_stacks(i + 1, name, save_dir, context)
 
+            context.add_stage_time("annotation", perf_counter() - annotation_start)
             return omr_response, final_marked, multi_marked, multi_roll
 
         except Exception as e:
             raise e
 
+    def read_bubbles(self, template, img, context, roi_origin=(0, 0)):
+        """
+        Aligns (if enabled), samples and thresholds the bubbles of a normalized page.
+        img may be just the template ROI of the page, starting at roi_origin.
+        Renders nothing, so it is shared by the annotated and the headless paths.
+        Returns (omr_response, multi_marked, bubble_stats)
+        """
+        config = self.tuning_config
+        self.append_save_img(3, img, context)
+
+        # Find Shifts for the field_blocks --> Before calculating threshold!
+        if config.alignment_params.auto_align:
+            with context.time_stage("alignment"):
+                # Note: clahe is good for morphology, bad for thresholding
+                morph = get_clahe_helper().apply(img)
+                self.append_save_img(3, morph, context)
+                # Remove shadows further, make columns/boxes darker (less gamma)
+                # TODO: all numbers should come from either constants or config
+                # Note: gamma, truncation at 220 and normalization fused in one table
+                morph = ImageUtils.normalize_lut(
+                    morph,
+                    np.minimum(get_gamma_table(config.threshold_params.GAMMA_LOW), 220),
+                )
+                self.append_save_img(3, morph, context)
+                if config.outputs.show_image_level >= 4:
+                    InteractionUtils.show("morph1", morph, 0, 1, config)
+
+                # print("Begin Alignment")
+                morph_v = self.get_vertical_morph(morph, context)
+
+                # template relative alignment code
+                context.field_block_shifts = self.get_field_block_shifts(
+                    template, morph_v, roi_origin
+                )
+                # print("End Alignment")
+
+        # Get mean bubbleValues n other stats
+        compiled = template.compiled
+        block_shifts = context.field_block_shifts
+        if block_shifts is None:
+            block_shifts = [0] * len(template.field_blocks)
+        bubble_x = compiled.get_shifted_bubble_x(block_shifts)
+        with context.time_stage("sampling"):
+            # Note: one summed-area table per sheet, every bubble mean is an O(1) lookup
+            integral = ImageUtils.get_integral_image(img)
+            bubble_means = ImageUtils.get_box_means(
+                integral,
+                bubble_x - roi_origin[0],
+                compiled.bubble_y - roi_origin[1],
+                compiled.bubble_w,
+                compiled.bubble_h,
+            )
+        return self.threshold_bubbles(
+            template, bubble_means, bubble_x, block_shifts, context
+        )
+
+    def read_bubbles_reduced(self, template, image, context):
+        """
+        Cheap pass of the cascade: samples the bubbles on a page reduced by
+        cascade_params.downscale (straight from the input image) and skips auto
+        alignment. Returns the same tuple as read_bubbles, in page coordinates.
+        """
+        downscale = self.tuning_config.cascade_params.downscale
+        page_width, page_height = template.page_dimensions
+        reduced_width = max(1, page_width // downscale)
+        reduced_height = max(1, page_height // downscale)
+        compiled = template.compiled
+        with context.time_stage("sampling"):
+            img = cv2.resize(
+                image, (reduced_width, reduced_height), interpolation=cv2.INTER_AREA
+            )
+            if img.max() > img.min():
+                img = ImageUtils.normalize_util(img)
+            bubble_means = ImageUtils.get_box_means(
+                ImageUtils.get_integral_image(img),
+                *compiled.get_scaled_bubble_boxes(
+                    reduced_width / page_width, reduced_height / page_height
+                ),
+            )
+        block_shifts = [0] * len(template.field_blocks)
+        return self.threshold_bubbles(
+            template, bubble_means, compiled.bubble_x, block_shifts, context
+        )
+
+    def threshold_bubbles(
+        self, template, bubble_means, bubble_x, block_shifts, context
+    ):
+        start = perf_counter()
+        compiled = template.compiled
+        (
+            field_thresholds,
+            global_thr,
+            global_std_thresh,
+            field_std_devs,
+        ) = self.get_field_thresholds(template, bubble_means)
+        global_thr, global_std_thresh = float(global_thr), float(global_std_thresh)
+
+        logger.info(
+            f"Thresholding: \tglobal_thr: {round(global_thr, 2)} \tglobal_std_THR: {round(global_std_thresh, 2)}\t{'(Looks like a Xeroxed OMR)' if (global_thr == 255) else ''}"
+        )
+
+        bubbles_marked = field_thresholds[compiled.bubble_field_index] > bubble_means
+        field_responses, marked_counts = compiled.get_field_responses(bubbles_marked)
+        omr_response = dict(zip(compiled.field_labels, field_responses))
+        multi_marked = bool((marked_counts > 1).any())
+
+        bubble_stats = BubbleStats(
+            block_shifts=block_shifts,
+            bubble_x=bubble_x,
+            bubble_means=bubble_means,
+            bubbles_marked=bubbles_marked,
+            field_std_devs=field_std_devs,
+            field_thresholds=field_thresholds,
+            field_confidences=compiled.get_field_confidences(
+                bubble_means, field_thresholds
+            ),
+            global_thr=global_thr,
+            global_std_thresh=global_std_thresh,
+        )
+        context.bubble_stats = bubble_stats
+        context.add_stage_time("thresholding", perf_counter() - start)
+        return omr_response, multi_marked, bubble_stats
+
+    def get_vertical_morph(self, morph, context=None):
+        """
+        Returns the binary image of vertical column edges used for auto alignment.
+        With alignment_params.morph_downscale > 1 the morphology runs on a reduced
+        copy (with proportionally smaller kernels) and is scaled back up.
+        """
+        config = self.tuning_config
+        morph_downscale = config.alignment_params.get("morph_downscale", 1)
+        full_h, full_w = morph.shape[:2]
+        if morph_downscale > 1:
+            morph = cv2.resize(
+                morph,
+                (full_w // morph_downscale, full_h // morph_downscale),
+                interpolation=cv2.INTER_AREA,
+            )
+
+        def scaled(length):
+            return max(1, round(length / morph_downscale))
+
+        # Open : erode then dilate
+        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (scaled(2), scaled(10)))
+        morph_v = cv2.morphologyEx(morph, cv2.MORPH_OPEN, v_kernel, iterations=3)
+        # Truncation at 200, normalization and inversion fused in one table
+        morph_v = ImageUtils.normalize_lut(morph_v, TRUNCATE_200_TABLE, invert=True)
+
+        if config.outputs.show_image_level >= 3:
+            InteractionUtils.show("morphed_vertical", morph_v, 0, 1, config=config)
+
+        self.append_save_img(3, morph_v, context)
+
+        morph_thr = 60  # for Mobile images, 40 for scanned Images
+        _, morph_v = cv2.threshold(morph_v, morph_thr, 255, cv2.THRESH_BINARY)
+        # kernel best tuned to 5x5 now
+        morph_v = cv2.erode(
+            morph_v, np.ones((scaled(5), scaled(5)), np.uint8), iterations=2
+        )
+        if morph_downscale > 1:
+            morph_v = cv2.resize(
+                morph_v, (full_w, full_h), interpolation=cv2.INTER_NEAREST
+            )
+
+        self.append_save_img(3, morph_v, context)
+        if config.outputs.show_image_level >= 3:
+            InteractionUtils.show("morph_thr_eroded", morph_v, 0, 1, config=config)
+
+        self.append_save_img(6, morph_v, context)
+        return morph_v
+
+    def get_field_block_shifts(self, template, morph_v, roi_origin=(0, 0)):
+        """
+        Finds the horizontal shift of each field block against the column edges.
+        The column profile of a block's rows is reduced to prefix sums once, then the
+        left/right edge means of every reachable shift are evaluated in one pass.
+        The stepping walk then only reads the precomputed decisions, which gives
+        the same shifts as probing one stride at a time.
+        """
+        config = self.tuning_config
+        match_col, max_steps, align_stride, thk = map(
+            config.alignment_params.get,
+            [
+                "match_col",
+                "max_steps",
+                "stride",
+                "thickness",
+            ],
+        )
+        compiled = template.compiled
+        page_w = morph_v.shape[1]
+        # Every shift the walk can reach
+        candidate_shifts = np.arange(-max_steps, max_steps + 1) * align_stride
+        block_shifts = []
+        for s, d in zip(
+            (compiled.block_origins - roi_origin).tolist(),
+            compiled.block_dimensions.tolist(),
+        ):
+            block_rows = morph_v[s[1] : s[1] + d[1]]
+            column_sums = np.zeros(page_w + 1, dtype=np.int64)
+            np.cumsum(block_rows.sum(axis=0, dtype=np.int64), out=column_sums[1:])
+            rows_count = block_rows.shape[0]
+
+            left_means = self.get_column_window_means(
+                column_sums,
+                rows_count,
+                s[0] + candidate_shifts - thk,
+                -thk + s[0] + candidate_shifts + match_col,
+            )
+            right_means = self.get_column_window_means(
+                column_sums,
+                rows_count,
+                s[0] + candidate_shifts - match_col + d[0] + thk,
+                thk + s[0] + candidate_shifts + d[0],
+            )
+            left_shifts, right_shifts = (
+                (left_means > 100).tolist(),
+                (right_means > 100).tolist(),
+            )
+
+            shift, steps = 0, 0
+            while steps < max_steps:
+                candidate_index = shift // align_stride + max_steps
+                left_shift = left_shifts[candidate_index]
+                right_shift = right_shifts[candidate_index]
+                if left_shift:
+                    if right_shift:
+                        break
+                    else:
+                        shift -= align_stride
+                else:
+                    if right_shift:
+                        shift += align_stride
+                    else:
+                        break
+                steps += 1
+            block_shifts.append(shift)
+        return block_shifts
+
+    @staticmethod
+    def get_column_window_means(column_sums, rows_count, starts, ends):
+        # Same as np.mean(block_rows[:, start:end]) for each window,
+        # including Python's slicing rules for negative and overflowing bounds
+        width = len(column_sums) - 1
+        starts, ends = (
+            np.clip(np.where(bounds < 0, bounds + width, bounds), 0, width)
+            for bounds in (starts, ends)
+        )
+        ends = np.maximum(ends, starts)
+        # Note: empty windows give nan, like np.mean of an empty slice
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (column_sums[ends] - column_sums[starts]) / (
+                (ends - starts) * rows_count
+            )
+
+    def read_omr_response_batch(self, template, images):
+        """
+        Reads a stack of already aligned sheets at once.
+        images: (N, H, W) array or a sequence of N grayscale images
+        The bubble sampling and thresholding run over the whole stack with array
+        operations, field block shifts from auto alignment are not applied.
+        Returns (omr_responses, field_thresholds, multi_marked) where omr_responses is
+        a list of N response dicts, field_thresholds is (N, fields) and multi_marked
+        is a boolean array of N flags.
+        """
+        compiled = template.compiled
+        page_width, page_height = template.page_dimensions
+        sheets_count = len(images)
+        stack = np.empty((sheets_count, page_height, page_width), dtype=np.uint8)
+        for sheet_index, image in enumerate(images):
+            if image.shape[:2] != (page_height, page_width):
+                image = ImageUtils.resize_util(image, page_width, page_height)
+            if image.max() > image.min():
+                image = ImageUtils.normalize_util(image)
+            stack[sheet_index] = image
+
+        # Note: summed-area tables are float64, read the stack in bounded chunks
+        chunk_size = max(
+            1, BATCH_INTEGRAL_MAX_BYTES // ((page_height + 1) * (page_width + 1) * 8)
+        )
+        bubble_means = np.empty((sheets_count, compiled.bubbles_count))
+        for start in range(0, sheets_count, chunk_size):
+            bubble_means[start : start + chunk_size] = ImageUtils.get_box_means(
+                ImageUtils.get_integral_image(stack[start : start + chunk_size]),
+                compiled.bubble_x,
+                compiled.bubble_y,
+                compiled.bubble_w,
+                compiled.bubble_h,
+            )
+
+        field_thresholds, _, _, _ = self.get_field_thresholds(template, bubble_means)
+        bubbles_marked = field_thresholds[:, compiled.bubble_field_index] > bubble_means
+
+        omr_responses, multi_marked = [], []
+        for sheet_marked in bubbles_marked:
+            field_responses, marked_counts = compiled.get_field_responses(sheet_marked)
+            omr_responses.append(dict(zip(compiled.field_labels, field_responses)))
+            multi_marked.append(bool((marked_counts > 1).any()))
+
+        return omr_responses, field_thresholds, np.array(multi_marked, dtype=bool)
+
     @staticmethod
-    def draw_template_layout(img, template, shifted=True, draw_qvals=False, border=-1):
+    def draw_template_layout(
+        img, template, shifted=True, draw_qvals=False, border=-1, block_shifts=None
+    ):
         img = ImageUtils.resize_util(
             img, template.page_dimensions[0], template.page_dimensions[1]
         )
         final_align = img.copy()
-        for field_block in template.field_blocks:
-            s, d = field_block.origin, field_block.dimensions
-            box_w, box_h = field_block.bubble_dimensions
-            shift = field_block.shift
-            if shifted:
-                cv2.rectangle(
-                    final_align,
-                    (s[0] + shift, s[1]),
-                    (s[0] + shift + d[0], s[1] + d[1]),
-                    constants.CLR_BLACK,
-                    3,
-                )
-            else:
+        compiled = template.compiled
+        if not shifted or block_shifts is None:
+            block_shifts = [0] * len(template.field_blocks)
+        block_shifts = np.array(block_shifts, dtype=np.int64)
+        bubble_x = compiled.get_shifted_bubble_x(block_shifts)
+        if draw_qvals:
+            bubble_means = ImageUtils.get_box_means(
+                ImageUtils.get_integral_image(img),
+                bubble_x,
+                compiled.bubble_y,
+                compiled.bubble_w,
+                compiled.bubble_h,
+            )
+        for block_index, (block_name, s, d) in enumerate(
+            zip(
+                compiled.block_names,
+                compiled.block_origins.tolist(),
+                compiled.block_dimensions.tolist(),
+            )
+        ):
+            shift = int(block_shifts[block_index])
+            cv2.rectangle(
+                final_align,
+                (s[0] + shift, s[1]),
+                (s[0] + shift + d[0], s[1] + d[1]),
+                constants.CLR_BLACK,
+                3,
+            )
+            start, end = compiled.block_bubble_offsets[block_index : block_index + 2]
+            for bubble_index in range(start, end):
+                x, y = int(bubble_x[bubble_index]), int(compiled.bubble_y[bubble_index])
+                box_w = int(compiled.bubble_w[bubble_index])
+                box_h = int(compiled.bubble_h[bubble_index])
                 cv2.rectangle(
                     final_align,
-                    (s[0], s[1]),
-                    (s[0] + d[0], s[1] + d[1]),
-                    constants.CLR_BLACK,
-                    3,
+                    (int(x + box_w / 10), int(y + box_h / 10)),
+                    (int(x + box_w - box_w / 10), int(y + box_h - box_h / 10)),
+                    constants.CLR_GRAY,
+                    border,
                 )
-            for field_block_bubbles in field_block.traverse_bubbles:
-                for pt in field_block_bubbles:
-                    x, y = (pt.x + field_block.shift, pt.y) if shifted else (pt.x, pt.y)
-                    cv2.rectangle(
+                if draw_qvals:
+                    cv2.putText(
                         final_align,
-                        (int(x + box_w / 10), int(y + box_h / 10)),
-                        (int(x + box_w - box_w / 10), int(y + box_h - box_h / 10)),
-                        constants.CLR_GRAY,
-                        border,
+                        f"{int(bubble_means[bubble_index])}",
+                        (x + 2, y + (box_h * 2) // 3),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        0.6,
+                        constants.CLR_BLACK,
+                        2,
                     )
-                    if draw_qvals:
-                        rect = [y, y + box_h, x, x + box_w]
-                        cv2.putText(
-                            final_align,
-                            f"{int(cv2.mean(img[rect[0] : rect[1], rect[2] : rect[3]])[0])}",
-                            (rect[2] + 2, rect[0] + (box_h * 2) // 3),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.6,
-                            constants.CLR_BLACK,
-                            2,
-                        )
             if shifted:
                 text_in_px = cv2.getTextSize(
-                    field_block.name, cv2.FONT_HERSHEY_SIMPLEX, constants.TEXT_SIZE, 4
+                    block_name, cv2.FONT_HERSHEY_SIMPLEX, constants.TEXT_SIZE, 4
                 )
                 cv2.putText(
                     final_align,
-                    field_block.name,
+                    block_name,
                     (int(s[0] + d[0] - text_in_px[0][0]), int(s[1] - text_in_px[0][1])),
                     cv2.FONT_HERSHEY_SIMPLEX,
                     constants.TEXT_SIZE,
@@ -520,49 +852,11 @@ class ImageInstanceOps:
             gives the smaller one
 
         """
-        config = self.tuning_config
-        PAGE_TYPE_FOR_THRESHOLD, MIN_JUMP, JUMP_DELTA = map(
-            config.threshold_params.get,
-            [
-                "PAGE_TYPE_FOR_THRESHOLD",
-                "MIN_JUMP",
-                "JUMP_DELTA",
-            ],
-        )
-
-        global_default_threshold = (
-            constants.GLOBAL_PAGE_THRESHOLD_WHITE
-            if PAGE_TYPE_FOR_THRESHOLD == "white"
-            else constants.GLOBAL_PAGE_THRESHOLD_BLACK
+        q_vals = np.sort(q_vals_orig)
+        global_thr, j_low, j_high, thr2 = (
+            float(value) for value in self.get_global_thresholds(q_vals, looseness)
         )
 
-        # Sort the Q bubbleValues
-        # TODO: Change var name of q_vals
-        q_vals = sorted(q_vals_orig)
-        # Find the FIRST LARGE GAP and set it as threshold:
-        ls = (looseness + 1) // 2
-        l = len(q_vals) - ls
-        max1, thr1 = MIN_JUMP, global_default_threshold
-        for i in range(ls, l):
-            jump = q_vals[i + ls] - q_vals[i - ls]
-            if jump > max1:
-                max1 = jump
-                thr1 = q_vals[i - ls] + jump / 2
-
-        # NOTE: thr2 is deprecated, thus is JUMP_DELTA
-        # Make use of the fact that the JUMP_DELTA(Vertical gap ofc) between
-        # values at detected jumps would be atleast 20
-        max2, thr2 = MIN_JUMP, global_default_threshold
-        # Requires atleast 1 gray box to be present (Roll field will ensure this)
-        for i in range(ls, l):
-            jump = q_vals[i + ls] - q_vals[i - ls]
-            new_thr = q_vals[i - ls] + jump / 2
-            if jump > max2 and abs(thr1 - new_thr) > JUMP_DELTA:
-                max2 = jump
-                thr2 = new_thr
-        # global_thr = min(thr1,thr2)
-        global_thr, j_low, j_high = thr1, thr1 - max1 // 2, thr1 + max1 // 2
-
         # # For normal images
         # thresholdRead =  116
         # if(thr1 > thr2 and thr2 > thresholdRead):
@@ -590,6 +884,143 @@ class ImageInstanceOps:
 
         return global_thr, j_low, j_high
 
+    def get_field_thresholds(self, template, bubble_means):
+        """
+        Thresholds the bubble means of one sheet (bubbles,) or a stack (sheets, bubbles)
+        Returns (field_thresholds, global_thr, global_std_thresh, field_std_devs)
+        """
+        compiled = template.compiled
+        field_std_devs = compiled.get_field_std_devs(bubble_means)
+        global_std_thresh, _, _, _ = self.get_global_thresholds(field_std_devs)
+        global_thr, _, _, _ = self.get_global_thresholds(bubble_means, looseness=4)
+        # All Black or All White case
+        no_outliers = field_std_devs < global_std_thresh[..., np.newaxis]
+        # Note: every strip of every sheet is thresholded in one call
+        field_thresholds = self.get_local_thresholds(
+            compiled.pad_by_field(bubble_means),
+            compiled.field_lengths,
+            global_thr,
+            no_outliers,
+        )
+        return field_thresholds, global_thr, global_std_thresh, field_std_devs
+
+    def get_global_thresholds(self, q_vals, looseness=1):
+        """
+        Vectorized kernel of get_global_threshold over the last axis of q_vals.
+        Gives bit-identical results to scanning each row in Python:
+        the first largest jump is found with np.diff style slicing and argmax.
+        Returns arrays (global_thr, j_low, j_high, thr2) over the leading axes.
+        """
+        config = self.tuning_config
+        PAGE_TYPE_FOR_THRESHOLD, MIN_JUMP, JUMP_DELTA = map(
+            config.threshold_params.get,
+            [
+                "PAGE_TYPE_FOR_THRESHOLD",
+                "MIN_JUMP",
+                "JUMP_DELTA",
+            ],
+        )
+
+        global_default_threshold = (
+            constants.GLOBAL_PAGE_THRESHOLD_WHITE
+            if PAGE_TYPE_FOR_THRESHOLD == "white"
+            else constants.GLOBAL_PAGE_THRESHOLD_BLACK
+        )
+
+        # Sort the Q bubbleValues
+        q_vals = np.sort(np.asarray(q_vals, dtype=np.float64), axis=-1)
+        leading_shape = q_vals.shape[:-1]
+        # Find the FIRST LARGE GAP and set it as threshold:
+        ls = (looseness + 1) // 2
+        # jumps[..., j] is the jump centered at i = j + ls
+        jumps = q_vals[..., 2 * ls :] - q_vals[..., : max(q_vals.shape[-1] - 2 * ls, 0)]
+        if jumps.shape[-1] == 0:
+            thr1 = np.full(leading_shape, global_default_threshold, dtype=np.float64)
+            max1 = np.full(leading_shape, MIN_JUMP, dtype=np.float64)
+            return thr1, thr1 - max1 // 2, thr1 + max1 // 2, thr1.copy()
+
+        lower_vals = q_vals[..., : jumps.shape[-1]]
+        # argmax returns the first occurrence, same as the strict '>' scan
+        max1, thr1 = self.get_first_largest_jumps(
+            jumps, lower_vals, MIN_JUMP, global_default_threshold
+        )
+
+        # NOTE: thr2 is deprecated, thus is JUMP_DELTA
+        # Make use of the fact that the JUMP_DELTA(Vertical gap ofc) between
+        # values at detected jumps would be atleast 20
+        new_thrs = lower_vals + jumps / 2
+        far_jumps = np.where(
+            np.abs(thr1[..., np.newaxis] - new_thrs) > JUMP_DELTA, jumps, -np.inf
+        )
+        _, thr2 = self.get_first_largest_jumps(
+            far_jumps, lower_vals, MIN_JUMP, global_default_threshold
+        )
+        # global_thr = min(thr1,thr2)
+        return thr1, thr1 - max1 // 2, thr1 + max1 // 2, thr2
+
+    def get_local_thresholds(self, padded_q_vals, q_lengths, global_thr, no_outliers):
+        """
+        Vectorized kernel of get_local_threshold for every question strip in one call.
+        padded_q_vals: (..., strips, max_length) bubble values, padded with np.inf
+        q_lengths: (strips,) actual count of bubbles in each strip
+        global_thr: global threshold, broadcastable to the leading axes
+        no_outliers: (..., strips) result of the std-dev check for each strip
+        Gives bit-identical thresholds to calling get_local_threshold per strip.
+        """
+        config = self.tuning_config
+        MIN_JUMP, MIN_GAP, CONFIDENT_SURPLUS = map(
+            config.threshold_params.get,
+            ["MIN_JUMP", "MIN_GAP", "CONFIDENT_SURPLUS"],
+        )
+        # Sort the Q bubbleValues, padding stays at the end
+        q_vals = np.sort(padded_q_vals, axis=-1)
+        q_lengths = np.asarray(q_lengths)
+        global_thr = np.asarray(global_thr, dtype=np.float64)[..., np.newaxis]
+        max_length = q_vals.shape[-1]
+
+        # Find the LARGEST GAP and set it as threshold: //(FIRST LARGE GAP)
+        with np.errstate(invalid="ignore"):
+            jumps = q_vals[..., 2:] - q_vals[..., : max(max_length - 2, 0)]
+        valid_jumps = np.arange(jumps.shape[-1]) < (q_lengths[:, np.newaxis] - 2)
+        jumps = np.where(valid_jumps, jumps, -np.inf)
+        if jumps.shape[-1] > 0:
+            max1, thr1 = self.get_first_largest_jumps(
+                jumps, q_vals[..., : jumps.shape[-1]], MIN_JUMP, 255
+            )
+        else:
+            max1 = np.full(q_vals.shape[:-1], MIN_JUMP, dtype=np.float64)
+            thr1 = np.full(q_vals.shape[:-1], 255, dtype=np.float64)
+
+        confident_jump = MIN_JUMP + CONFIDENT_SURPLUS
+        # If not confident, then only take help of global_thr
+        # All Black or All White case
+        thr1 = np.where((max1 < confident_jump) & no_outliers, global_thr, thr1)
+
+        # Small no of pts cases:
+        # base case: 1 or 2 pts
+        first_vals = q_vals[..., 0]
+        last_indices = np.broadcast_to(
+            (np.maximum(q_lengths, 1) - 1)[:, np.newaxis], q_vals.shape[:-1] + (1,)
+        )
+        last_vals = np.take_along_axis(q_vals, last_indices, axis=-1)[..., 0]
+        small_thr = np.where(
+            last_vals - first_vals < MIN_GAP,
+            global_thr,
+            (first_vals + last_vals) / 2,
+        )
+        return np.where(q_lengths < 3, small_thr, thr1)
+
+    @staticmethod
+    def get_first_largest_jumps(jumps, lower_vals, min_jump, default_threshold):
+        # Equivalent of the loop: 'if jump > max1: max1, thr1 = jump, low + jump / 2'
+        first_max_index = np.argmax(jumps, axis=-1)[..., np.newaxis]
+        max_jump = np.take_along_axis(jumps, first_max_index, axis=-1)[..., 0]
+        lower_val = np.take_along_axis(lower_vals, first_max_index, axis=-1)[..., 0]
+        has_jump = max_jump > min_jump
+        max1 = np.where(has_jump, max_jump, min_jump)
+        thr1 = np.where(has_jump, lower_val + max1 / 2, default_threshold)
+        return max1.astype(np.float64), thr1.astype(np.float64)
+
     def get_local_threshold(
         self, q_vals, global_thr, no_outliers, plot_title=None, plot_show=True
     ):
@@ -617,61 +1048,16 @@ class ImageInstanceOps:
             ||||||||||
 
         """
-        config = self.tuning_config
         # Sort the Q bubbleValues
         q_vals = sorted(q_vals)
-
-        # Small no of pts cases:
-        # base case: 1 or 2 pts
-        if len(q_vals) < 3:
-            thr1 = (
-                global_thr
-                if np.max(q_vals) - np.min(q_vals) < config.threshold_params.MIN_GAP
-                else np.mean(q_vals)
-            )
-        else:
-            # qmin, qmax, qmean, qstd = round(np.min(q_vals),2), round(np.max(q_vals),2),
-            #   round(np.mean(q_vals),2), round(np.std(q_vals),2)
-            # GVals = [round(abs(q-qmean),2) for q in q_vals]
-            # gmean, gstd = round(np.mean(GVals),2), round(np.std(GVals),2)
-            # # DISCRETION: Pretty critical factor in reading response
-            # # Doesn't work well for small number of values.
-            # DISCRETION = 2.7 # 2.59 was closest hit, 3.0 is too far
-            # L2MaxGap = round(max([abs(g-gmean) for g in GVals]),2)
-            # if(L2MaxGap > DISCRETION*gstd):
-            #     no_outliers = False
-
-            # # ^Stackoverflow method
-            # print(field_label, no_outliers,"qstd",round(np.std(q_vals),2), "gstd", gstd,
-            #   "Gaps in gvals",sorted([round(abs(g-gmean),2) for g in GVals],reverse=True),
-            #   '\t',round(DISCRETION*gstd,2), L2MaxGap)
-
-            # else:
-            # Find the LARGEST GAP and set it as threshold: //(FIRST LARGE GAP)
-            l = len(q_vals) - 1
-            max1, thr1 = config.threshold_params.MIN_JUMP, 255
-            for i in range(1, l):
-                jump = q_vals[i + 1] - q_vals[i - 1]
-                if jump > max1:
-                    max1 = jump
-                    thr1 = q_vals[i - 1] + jump / 2
-            # print(field_label,q_vals,max1)
-
-            confident_jump = (
-                config.threshold_params.MIN_JUMP
-                + config.threshold_params.CONFIDENT_SURPLUS
-            )
-            # If not confident, then only take help of global_thr
-            if max1 < confident_jump:
-                if no_outliers:
-                    # All Black or All White case
-                    thr1 = global_thr
-                else:
-                    # TODO: Low confidence parameters here
-                    pass
-
-            # if(thr1 == 255):
-            #     print("Warning: threshold is unexpectedly 255! (Outlier Delta issue?)",plot_title)
+        thr1 = float(
+            self.get_local_thresholds(
+                np.array([q_vals], dtype=np.float64),
+                [len(q_vals)],
+                global_thr,
+                np.array([no_outliers]),
+            )[0]
+        )
 
         # Make a common plot function to show local and global thresholds
         if plot_show and plot_title is not None:
@@ -691,31 +1077,42 @@ class ImageInstanceOps:
                 plt.show()
         return thr1
 
-    def append_save_img(self, key, img):
+    def append_save_img(self, key, img, context=None):
         if self.save_image_level >= int(key):
-            self.save_img_list[key].append(img.copy())
+            self.get_context(context).save_img_list[key].append(img.copy())
+
+    def save_img(self, path, img, context=None):
+        deferred_image_writes = self.get_context(context).deferred_image_writes
+        if deferred_image_writes is None:
+            ImageUtils.save_img(path, img)
+        else:
+            deferred_image_writes.append((path, img))
 
-    def save_image_stacks(self, key, filename, save_dir):
+    def save_image_stacks(self, key, filename, save_dir, context=None):
         config = self.tuning_config
-        if self.save_image_level >= int(key) and self.save_img_list[key] != []:
+        save_img_list = self.get_context(context).save_img_list
+        if self.save_image_level >= int(key) and save_img_list[key] != []:
             name = os.path.splitext(filename)[0]
             result = np.hstack(
                 tuple(
                     [
                         ImageUtils.resize_util_h(img, config.dimensions.display_height)
-                        for img in self.save_img_list[key]
+                        for img in save_img_list[key]
                     ]
                 )
             )
             result = ImageUtils.resize_util(
                 result,
                 min(
-                    len(self.save_img_list[key]) * config.dimensions.display_width // 3,
+                    len(save_img_list[key]) * config.dimensions.display_width // 3,
                     int(config.dimensions.display_width * 2.5),
                 ),
             )
-            ImageUtils.save_img(f"{save_dir}stack/{name}_{str(key)}_stack.jpg", result)
+            self.save_img(
+                f"{save_dir}stack/{name}_{str(key)}_stack.jpg", result, context
+            )
 
-    def reset_all_save_img(self):
+    def reset_all_save_img(self, context=None):
+        save_img_list = self.get_context(context).save_img_list
         for i in range(self.save_image_level):
-            self.save_img_list[i + 1] = []
+            save_img_list[i + 1] = []
@@ -23,6 +23,24 @@ CONFIG_DEFAULTS = DotMap(
             "max_steps": 20,
             "stride": 1,
             "thickness": 3,
+            # Run the alignment morphology on a copy reduced by this factor
+            "morph_downscale": 1,
+        },
+        "cascade_params": {
+            # Note: 'enabled' reads headless runs at reduced resolution first and
+            # escalates a sheet to the full read when any field is less confident.
+            "enabled": False,
+            "downscale": 2,
+            "min_confidence": 12,
+        },
+        "preprocessing_params": {
+            # Note: 'compose_warps' lets the geometric preprocessors contribute transforms
+            # that warp the decoded image to the page in a single resample.
+            "compose_warps": False,
+            # Note: 'reduced_decode' decodes big JPEGs at 1/2, 1/4 or 1/8 scale, keeping
+            # 'min_decode_oversampling' pixels per pixel of the processed image.
+            "reduced_decode": False,
+            "min_decode_oversampling": 1.5,
         },
         "outputs": {
             "show_image_level": 0,
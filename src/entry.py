@@ -6,27 +6,39 @@
  Github: https://github.com/Udayraj123
 
 """
+import multiprocessing
 import os
-from csv import QUOTE_NONNUMERIC
+import queue
+import threading
+from argparse import Namespace
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from time import time
+from time import perf_counter
 
-import cv2
-import pandas as pd
 from rich.table import Table
 
 from src import constants
+from src.core import ProcessingContext
 from src.defaults import CONFIG_DEFAULTS
 from src.evaluation import EvaluationConfig, evaluate_concatenated_response
 from src.logger import console, logger
 from src.template import Template
-from src.utils.file import Paths, setup_dirs_for_paths, setup_outputs_for_template
+from src.utils.file import (
+    Paths,
+    close_outputs_for_template,
+    setup_dirs_for_paths,
+    setup_outputs_for_template,
+)
 from src.utils.image import ImageUtils
 from src.utils.interaction import InteractionUtils, Stats
 from src.utils.parsing import get_concatenated_response, open_config_with_defaults
+from src.utils.timing import TimingReport
 
 # Load processors
 STATS = Stats()
+# Template, EvaluationConfig and outputs of a worker process, set by init_worker
+WORKER_STATE = Namespace()
 
 
 def entry_point(input_dir, args):
@@ -129,17 +141,17 @@ def process_dir(
 
     if omr_files:
         if not template:
-            logger.error(
-                f"Found images, but no template in the directory tree \
+            logger.error(f"Found images, but no template in the directory tree \
                 of '{curr_dir}'. \nPlace {constants.TEMPLATE_FILENAME} in the \
-                appropriate directory."
-            )
+                appropriate directory.")
             raise Exception(
                 f"No template file found in the directory tree of {curr_dir}"
             )
 
         setup_dirs_for_paths(paths)
-        outputs_namespace = setup_outputs_for_template(paths, template)
+        outputs_namespace = setup_outputs_for_template(
+            paths, template, args.get("output_formats", ["csv"])
+        )
 
         print_config_summary(
             curr_dir,
@@ -150,23 +162,28 @@ def process_dir(
             evaluation_config,
             args,
         )
-        if args["setLayout"]:
-            show_template_layouts(omr_files, template, tuning_config)
-        else:
-            process_files(
-                omr_files,
-                template,
-                tuning_config,
-                evaluation_config,
-                outputs_namespace,
-            )
+        try:
+            if args["setLayout"]:
+                show_template_layouts(omr_files, template, tuning_config)
+            else:
+                process_files(
+                    omr_files,
+                    template,
+                    tuning_config,
+                    evaluation_config,
+                    outputs_namespace,
+                    args.get("threads", 1),
+                    args.get("timings_file"),
+                    args.get("workers", 1),
+                    args.get("pipeline", False),
+                )
+        finally:
+            close_outputs_for_template(outputs_namespace)
 
     elif not subdirs:
         # Each subdirectory should have images or should be non-leaf
-        logger.info(
-            f"No valid images or sub-folders found in {curr_dir}.\
-            Empty directories not allowed."
-        )
+        logger.info(f"No valid images or sub-folders found in {curr_dir}.\
+            Empty directories not allowed.")
 
     # recursively process sub-folders
     for d in subdirs:
@@ -184,7 +201,7 @@ def show_template_layouts(omr_files, template, tuning_config):
     for file_path in omr_files:
         file_name = file_path.name
         file_path = str(file_path)
-        in_omr = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+        in_omr = template.image_instance_ops.read_image(file_path, template)
         in_omr = template.image_instance_ops.apply_preprocessors(
             file_path, in_omr, template
         )
@@ -202,137 +219,397 @@ def process_files(
     tuning_config,
     evaluation_config,
     outputs_namespace,
+    threads=1,
+    timings_file=None,
+    workers=1,
+    pipeline=False,
 ):
-    start_time = int(time())
+    start_time = perf_counter()
     files_counter = 0
+    timing_report = TimingReport(timings_file)
     STATS.files_not_moved = 0
 
-    for file_path in omr_files:
-        files_counter += 1
-        file_name = file_path.name
+    if threads > 1 and tuning_config.outputs.show_image_level > 0:
+        logger.warning(
+            f"Running on a single thread: show_image_level must be 0 to use {threads} threads"
+        )
+        threads = 1
+    if workers > 1 and tuning_config.outputs.show_image_level > 0:
+        logger.warning(
+            f"Running in a single process: show_image_level must be 0 to use {workers} workers"
+        )
+        workers = 1
+    if pipeline and tuning_config.outputs.show_image_level > 0:
+        logger.warning(
+            "Running without the pipeline: show_image_level must be 0 to use it"
+        )
+        pipeline = False
+    if workers > 1 and threads > 1:
+        logger.warning(f"Ignoring {threads} threads: running {workers} workers")
+    if workers > 1 and pipeline:
+        logger.warning(f"Ignoring the pipeline: running {workers} workers")
+
+    def read_file(counter_and_path):
+        return read_omr_file(
+            *counter_and_path,
+            template,
+            tuning_config,
+            evaluation_config,
+            outputs_namespace,
+        )
 
-        in_omr = cv2.imread(str(file_path), cv2.IMREAD_GRAYSCALE)
+    def read_decoded_file(decoded_file):
+        files_counter, file_path, in_omr, context = decoded_file
+        return read_omr_file(
+            files_counter,
+            file_path,
+            template,
+            tuning_config,
+            evaluation_config,
+            outputs_namespace,
+            in_omr,
+            context,
+        )
 
-        logger.info("")
-        logger.info(
-            f"({files_counter}) Opening image: \t'{file_path}'\tResolution: {in_omr.shape}"
+    numbered_files = enumerate(omr_files, start=1)
+    if workers > 1:
+        # Note: spawned workers build their own Template, forking would copy the
+        # locks and thread pools of this process
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(
+                get_template_args(template),
+                tuning_config,
+                get_evaluation_args(evaluation_config, template),
+                outputs_namespace.paths,
+            ),
+        )
+        results = map_in_order(
+            executor, read_omr_file_in_worker, numbered_files, 2 * workers
         )
+    elif pipeline:
+        # Reader thread -> compute threads -> writer (this thread), each stage at
+        # most 2 * threads sheets ahead of the next one
+        executor = ThreadPoolExecutor(max_workers=threads)
+        decoded_files = decode_in_background(numbered_files, template, 2 * threads)
+        results = map_in_order(executor, read_decoded_file, decoded_files, 2 * threads)
+    elif threads > 1:
+        executor = ThreadPoolExecutor(max_workers=threads)
+        results = map_in_order(executor, read_file, numbered_files, 2 * threads)
+    else:
+        executor = None
+        results = map(read_file, numbered_files)
+
+    try:
+        # Note: sheets may be read concurrently, outputs are still written in order
+        for files_counter, result in enumerate(results, start=1):
+            write_start = perf_counter()
+            for image_path, image in result.deferred_image_writes or []:
+                ImageUtils.save_img(image_path, image)
+            write_omr_result(
+                result, files_counter, template, tuning_config, outputs_namespace
+            )
+            stage_timings = result.stage_timings
+            stage_timings["write"] = perf_counter() - write_start
+            stage_timings["total"] = stage_timings.pop("total") + stage_timings["write"]
+            timing_report.add(result.file_path, stage_timings)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        timing_report.close()
 
-        template.image_instance_ops.reset_all_save_img()
+    print_stats(start_time, files_counter, tuning_config)
+    timing_report.print_summary()
 
-        template.image_instance_ops.append_save_img(1, in_omr)
 
-        in_omr = template.image_instance_ops.apply_preprocessors(
-            file_path, in_omr, template
-        )
+def get_template_args(template):
+    # Note: the template keeps the config of the directory it was found in
+    return template.path, template.image_instance_ops.tuning_config
 
-        if in_omr is None:
-            # Error OMR case
-            new_file_path = outputs_namespace.paths.errors_dir.joinpath(file_name)
-            outputs_namespace.OUTPUT_SET.append(
-                [file_name] + outputs_namespace.empty_resp
-            )
-            if check_and_move(
-                constants.ERROR_CODES.NO_MARKER_ERR, file_path, new_file_path
-            ):
-                err_line = [
-                    file_name,
-                    file_path,
-                    new_file_path,
-                    "NA",
-                ] + outputs_namespace.empty_resp
-                pd.DataFrame(err_line, dtype=str).T.to_csv(
-                    outputs_namespace.files_obj["Errors"],
-                    mode="a",
-                    quoting=QUOTE_NONNUMERIC,
-                    header=False,
-                    index=False,
-                )
-            continue
 
-        # uniquify
-        file_id = str(file_name)
-        save_dir = outputs_namespace.paths.save_marked_dir
+def get_evaluation_args(evaluation_config, template):
+    if evaluation_config is None:
+        return None
+    # Note: an inherited evaluation keeps the template it was built with
+    evaluation_template_args = (
+        None
+        if evaluation_config.template is template
+        else get_template_args(evaluation_config.template)
+    )
+    return (
+        evaluation_config.curr_dir,
+        evaluation_config.path,
+        evaluation_template_args,
+        evaluation_config.tuning_config,
+    )
+
+
+def init_worker(template_args, tuning_config, evaluation_args, paths):
+    """Builds the Template and EvaluationConfig once per worker process"""
+    template = Template(*template_args)
+    WORKER_STATE.template = template
+    WORKER_STATE.tuning_config = tuning_config
+    WORKER_STATE.evaluation_config = None
+    if evaluation_args is not None:
         (
-            response_dict,
-            final_marked,
-            multi_marked,
-            _,
-        ) = template.image_instance_ops.read_omr_response(
-            template, image=in_omr, name=file_id, save_dir=save_dir
+            curr_dir,
+            evaluation_path,
+            evaluation_template_args,
+            evaluation_tuning_config,
+        ) = evaluation_args
+        WORKER_STATE.evaluation_config = EvaluationConfig(
+            curr_dir,
+            evaluation_path,
+            (
+                template
+                if evaluation_template_args is None
+                else Template(*evaluation_template_args)
+            ),
+            evaluation_tuning_config,
         )
+    # Note: only the paths are needed to read a sheet, result files stay with the parent
+    WORKER_STATE.outputs_namespace = Namespace(paths=paths)
 
-        # TODO: move inner try catch here
-        # concatenate roll nos, set unmarked responses, etc
-        omr_response = get_concatenated_response(response_dict, template)
 
-        if (
-            evaluation_config is None
-            or not evaluation_config.get_should_explain_scoring()
-        ):
-            logger.info(f"Read Response: \n{omr_response}")
+def read_omr_file_in_worker(counter_and_path):
+    result = read_omr_file(
+        *counter_and_path,
+        WORKER_STATE.template,
+        WORKER_STATE.tuning_config,
+        WORKER_STATE.evaluation_config,
+        WORKER_STATE.outputs_namespace,
+    )
+    # The marked image is only shown with show_image_level > 0, don't send it back
+    result.final_marked = None
+    return result
+
+
+def decode_in_background(numbered_files, template, max_decoded):
+    """
+    Yields (files_counter, file_path, in_omr, context) of the sheets, decoded by a
+    reader thread that stays at most max_decoded sheets ahead. The contexts defer
+    their image writes to the consumer.
+    """
+    decoded_files = queue.Queue(maxsize=max_decoded)
+    stopped = threading.Event()
+    end_of_files = object()
+
+    def put(item):
+        # Note: gives up once the consumer stops, instead of blocking forever
+        while not stopped.is_set():
+            try:
+                decoded_files.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decode_files():
+        try:
+            for files_counter, file_path in numbered_files:
+                context = ProcessingContext(file_path, deferred_image_writes=[])
+                with context.time_stage("decode"):
+                    in_omr = template.image_instance_ops.read_image(file_path, template)
+                if not put((files_counter, file_path, in_omr, context)):
+                    return
+        except Exception as e:
+            # Note: raised again by the consumer, like the serial path would
+            put(e)
+            return
+        put(end_of_files)
+
+    threading.Thread(target=decode_files, daemon=True).start()
+    try:
+        while (item := decoded_files.get()) is not end_of_files:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def map_in_order(executor, fn, items, max_pending):
+    """Like executor.map, but keeps at most max_pending results in memory"""
+    pending = deque()
+    for item in items:
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def read_omr_file(
+    files_counter,
+    file_path,
+    template,
+    tuning_config,
+    evaluation_config,
+    outputs_namespace,
+    in_omr=None,
+    context=None,
+):
+    """
+    Reads and grades one sheet, all mutable state stays in its ProcessingContext.
+    The sheet is decoded here unless its in_omr is given (with its context).
+    """
+    if context is None:
+        context = ProcessingContext(file_path)
+    # Note: the total includes the decode of sheets decoded before
+    start = perf_counter() - context.stage_timings.get("decode", 0)
+    result = read_omr_file_in_context(
+        files_counter,
+        file_path,
+        template,
+        evaluation_config,
+        outputs_namespace,
+        in_omr,
+        context,
+    )
+    context.add_stage_time("total", perf_counter() - start)
+    result.stage_timings = context.stage_timings
+    result.deferred_image_writes = context.deferred_image_writes
+    return result
 
-        score = 0
-        if evaluation_config is not None:
+
+def read_omr_file_in_context(
+    files_counter,
+    file_path,
+    template,
+    evaluation_config,
+    outputs_namespace,
+    in_omr,
+    context,
+):
+    file_name = file_path.name
+    image_instance_ops = template.image_instance_ops
+    result = Namespace(file_path=file_path, file_name=file_name)
+
+    if in_omr is None:
+        with context.time_stage("decode"):
+            in_omr = image_instance_ops.read_image(file_path, template)
+
+    logger.info("")
+    logger.info(
+        f"({files_counter}) Opening image: \t'{file_path}'\tResolution: {in_omr.shape}"
+    )
+
+    image_instance_ops.append_save_img(1, in_omr, context)
+
+    in_omr = image_instance_ops.apply_preprocessors(
+        file_path, in_omr, template, context
+    )
+
+    result.is_error = in_omr is None
+    if result.is_error:
+        return result
+
+    # uniquify
+    file_id = str(file_name)
+    save_dir = outputs_namespace.paths.save_marked_dir
+    (
+        response_dict,
+        final_marked,
+        multi_marked,
+        _,
+    ) = image_instance_ops.read_omr_response(
+        template, image=in_omr, name=file_id, save_dir=save_dir, context=context
+    )
+
+    # TODO: move inner try catch here
+    # concatenate roll nos, set unmarked responses, etc
+    omr_response = get_concatenated_response(response_dict, template)
+
+    if evaluation_config is None or not evaluation_config.get_should_explain_scoring():
+        logger.info(f"Read Response: \n{omr_response}")
+
+    score = 0
+    if evaluation_config is not None:
+        with context.time_stage("evaluation"):
             score = evaluate_concatenated_response(
-                omr_response, evaluation_config, file_path, outputs_namespace.paths.evaluation_dir
-            )
-            logger.info(
-                f"(/{files_counter}) Graded with score: {round(score, 2)}\t for file: '{file_id}'"
-            )
-        else:
-            logger.info(f"(/{files_counter}) Processed file: '{file_id}'")
-
-        if tuning_config.outputs.show_image_level >= 2:
-            InteractionUtils.show(
-                f"Final Marked Bubbles : '{file_id}'",
-                ImageUtils.resize_util_h(
-                    final_marked, int(tuning_config.dimensions.display_height * 1.3)
-                ),
-                1,
-                1,
-                config=tuning_config,
+                omr_response,
+                evaluation_config,
+                file_path,
+                outputs_namespace.paths.evaluation_dir,
+                context,
             )
+        logger.info(
+            f"(/{files_counter}) Graded with score: {round(score, 2)}\t for file: '{file_id}'"
+        )
+    else:
+        logger.info(f"(/{files_counter}) Processed file: '{file_id}'")
+
+    result.file_id = file_id
+    result.save_dir = save_dir
+    result.omr_response = omr_response
+    result.final_marked = final_marked
+    result.multi_marked = multi_marked
+    result.score = score
+    return result
+
+
+def write_omr_result(result, files_counter, template, tuning_config, outputs_namespace):
+    file_path, file_name = result.file_path, result.file_name
+    if result.is_error:
+        # Error OMR case
+        new_file_path = outputs_namespace.paths.errors_dir.joinpath(file_name)
+        outputs_namespace.OUTPUT_SET.append([file_name] + outputs_namespace.empty_resp)
+        if check_and_move(
+            constants.ERROR_CODES.NO_MARKER_ERR, file_path, new_file_path
+        ):
+            err_line = [
+                file_name,
+                file_path,
+                new_file_path,
+                "NA",
+            ] + outputs_namespace.empty_resp
+            outputs_namespace.result_sinks["Errors"].write_row(err_line)
+        return
+
+    file_id, save_dir = result.file_id, result.save_dir
+    omr_response, multi_marked, score = (
+        result.omr_response,
+        result.multi_marked,
+        result.score,
+    )
+    if tuning_config.outputs.show_image_level >= 2:
+        InteractionUtils.show(
+            f"Final Marked Bubbles : '{file_id}'",
+            ImageUtils.resize_util_h(
+                result.final_marked,
+                int(tuning_config.dimensions.display_height * 1.3),
+            ),
+            1,
+            1,
+            config=tuning_config,
+        )
 
-        resp_array = []
-        for k in template.output_columns:
-            resp_array.append(omr_response[k])
-
-        outputs_namespace.OUTPUT_SET.append([file_name] + resp_array)
-
-        if multi_marked == 0 or not tuning_config.outputs.filter_out_multimarked_files:
-            STATS.files_not_moved += 1
-            new_file_path = save_dir.joinpath(file_id)
-            # Enter into Results sheet-
-            results_line = [file_name, file_path, new_file_path, score] + resp_array
-            # Write/Append to results_line file(opened in append mode)
-            pd.DataFrame(results_line, dtype=str).T.to_csv(
-                outputs_namespace.files_obj["Results"],
-                mode="a",
-                quoting=QUOTE_NONNUMERIC,
-                header=False,
-                index=False,
-            )
-        else:
-            # multi_marked file
-            logger.info(f"[{files_counter}] Found multi-marked file: '{file_id}'")
-            new_file_path = outputs_namespace.paths.multi_marked_dir.joinpath(file_name)
-            if check_and_move(
-                constants.ERROR_CODES.MULTI_BUBBLE_WARN, file_path, new_file_path
-            ):
-                mm_line = [file_name, file_path, new_file_path, "NA"] + resp_array
-                pd.DataFrame(mm_line, dtype=str).T.to_csv(
-                    outputs_namespace.files_obj["MultiMarked"],
-                    mode="a",
-                    quoting=QUOTE_NONNUMERIC,
-                    header=False,
-                    index=False,
-                )
-            # else:
-            #     TODO:  Add appropriate record handling here
-            #     pass
+    resp_array = []
+    for k in template.output_columns:
+        resp_array.append(omr_response[k])
 
-    print_stats(start_time, files_counter, tuning_config)
+    outputs_namespace.OUTPUT_SET.append([file_name] + resp_array)
+
+    if multi_marked == 0 or not tuning_config.outputs.filter_out_multimarked_files:
+        STATS.files_not_moved += 1
+        new_file_path = save_dir.joinpath(file_id)
+        # Enter into Results sheet-
+        results_line = [file_name, file_path, new_file_path, score] + resp_array
+        outputs_namespace.result_sinks["Results"].write_row(results_line)
+    else:
+        # multi_marked file
+        logger.info(f"[{files_counter}] Found multi-marked file: '{file_id}'")
+        new_file_path = outputs_namespace.paths.multi_marked_dir.joinpath(file_name)
+        if check_and_move(
+            constants.ERROR_CODES.MULTI_BUBBLE_WARN, file_path, new_file_path
+        ):
+            mm_line = [file_name, file_path, new_file_path, "NA"] + resp_array
+            outputs_namespace.result_sinks["MultiMarked"].write_row(mm_line)
+        # else:
+        #     TODO:  Add appropriate record handling here
+        #     pass
 
 
 def check_and_move(error_code, file_path, filepath2):
@@ -342,7 +619,7 @@ def check_and_move(error_code, file_path, filepath2):
 
 
 def print_stats(start_time, files_counter, tuning_config):
-    time_checking = max(1, round(time() - start_time, 2))
+    time_checking = perf_counter() - start_time
     log = logger.info
     log("")
     log(f"{'Total file(s) moved': <27}: {STATS.files_moved}")
@@ -356,14 +633,16 @@ def print_stats(start_time, files_counter, tuning_config):
         log(
             f"\nFinished Checking {files_counter} file(s) in {round(time_checking, 1)} seconds i.e. ~{round(time_checking / 60, 1)} minute(s)."
         )
-        log(
-            f"{'OMR Processing Rate': <27}: \t ~ {round(time_checking / files_counter, 2)} seconds/OMR"
-        )
-        log(
-            f"{'OMR Processing Speed': <27}: \t ~ {round((files_counter * 60) / time_checking, 2)} OMRs/minute"
-        )
+        if files_counter > 0:
+            log(
+                f"{'OMR Processing Rate': <27}: \t ~ {round(time_checking / files_counter, 2)} seconds/OMR"
+            )
+        if time_checking > 0:
+            log(
+                f"{'OMR Processing Speed': <27}: \t ~ {round((files_counter * 60) / time_checking, 2)} OMRs/minute"
+            )
     else:
-        log(f"\n{'Total script time': <27}: {time_checking} seconds")
+        log(f"\n{'Total script time': <27}: {round(time_checking, 2)} seconds")
 
     if tuning_config.outputs.show_image_level <= 1:
         log(
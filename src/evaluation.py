@@ -4,10 +4,10 @@ import re
 from copy import deepcopy
 from csv import QUOTE_NONNUMERIC
 
-import cv2
 import pandas as pd
 from rich.table import Table
 
+from src.core import ProcessingContext
 from src.logger import console, logger
 from src.schemas.constants import (
     BONUS_SECTION_PREFIX,
@@ -191,6 +191,12 @@ class EvaluationConfig:
 
     def __init__(self, curr_dir, evaluation_path, template, tuning_config):
         self.path = evaluation_path
+        # Note: kept to rebuild this instance in worker processes
+        self.curr_dir, self.template, self.tuning_config = (
+            curr_dir,
+            template,
+            tuning_config,
+        )
         evaluation_json = open_evaluation_with_validation(evaluation_path)
         options, marking_schemes, source_type = map(
             evaluation_json.get, ["options", "marking_schemes", "source_type"]
@@ -232,9 +238,10 @@ class EvaluationConfig:
                     f"Attempting to generate answer key from image: '{image_path}'"
                 )
                 # TODO: use a common function for below changes?
-                in_omr = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+                context = ProcessingContext(image_path)
+                in_omr = template.image_instance_ops.read_image(image_path, template)
                 in_omr = template.image_instance_ops.apply_preprocessors(
-                    image_path, in_omr, template
+                    image_path, in_omr, template, context
                 )
                 if in_omr is None:
                     raise Exception(
@@ -250,6 +257,7 @@ class EvaluationConfig:
                     image=in_omr,
                     name=image_path,
                     save_dir=None,
+                    context=context,
                 )
                 omr_response = get_concatenated_response(response_dict, template)
 
@@ -321,7 +329,8 @@ class EvaluationConfig:
 
     # Externally called methods have higher abstraction level.
     def prepare_and_validate_omr_response(self, omr_response):
-        self.reset_explanation_table()
+        # Note: the table is per response, the config itself stays read-only
+        explanation_table = self.prepare_explanation_table()
 
         omr_response_questions = set(omr_response.keys())
         all_questions = set(self.questions_in_order)
@@ -342,8 +351,11 @@ class EvaluationConfig:
             logger.warning(
                 f"No answer given for potential questions in OMR response: {missing_prefixed_questions}"
             )
+        return explanation_table
 
-    def match_answer_for_question(self, current_score, question, marked_answer):
+    def match_answer_for_question(
+        self, current_score, question, marked_answer, explanation_table
+    ):
         answer_matcher = self.question_to_answer_matcher[question]
         question_verdict, delta = answer_matcher.get_verdict_marking(marked_answer)
         self.conditionally_add_explanation(
@@ -353,17 +365,20 @@ class EvaluationConfig:
             question_verdict,
             question,
             current_score,
+            explanation_table,
         )
         return delta
 
-    def conditionally_print_explanation(self):
+    def conditionally_print_explanation(self, explanation_table):
         if self.should_explain_scoring:
-            console.print(self.explanation_table, justify="center")
+            console.print(explanation_table, justify="center")
 
     # Explanation Table to CSV
-    def conditionally_save_explanation_csv(self, file_path, evaluation_output_dir):
+    def conditionally_save_explanation_csv(
+        self, file_path, evaluation_output_dir, explanation_table
+    ):
         if self.enable_evaluation_table_to_csv:
-            data = {col.header: col._cells for col in self.explanation_table.columns}
+            data = {col.header: col._cells for col in explanation_table.columns}
 
             output_path = os.path.join(
                 evaluation_output_dir,
@@ -473,14 +488,10 @@ class EvaluationConfig:
         return question_to_answer_matcher
 
     # Then unfolding lower abstraction levels
-    def reset_explanation_table(self):
-        self.explanation_table = None
-        self.prepare_explanation_table()
-
     def prepare_explanation_table(self):
         # TODO: provide a way to export this as csv/pdf
         if not self.should_explain_scoring:
-            return
+            return None
         table = Table(title="Evaluation Explanation Table", show_lines=True)
         table.add_column("Question")
         table.add_column("Marked")
@@ -491,7 +502,7 @@ class EvaluationConfig:
         # TODO: Add max and min score in explanation (row-wise and total)
         if self.has_non_default_section:
             table.add_column("Section")
-        self.explanation_table = table
+        return table
 
     def get_marking_scheme_for_question(self, question):
         return self.question_to_scheme.get(question, self.default_marking_scheme)
@@ -504,6 +515,7 @@ class EvaluationConfig:
         question_verdict,
         question,
         current_score,
+        explanation_table,
     ):
         if self.should_explain_scoring:
             next_score = current_score + delta
@@ -525,22 +537,32 @@ class EvaluationConfig:
                 ]
                 if item is not None
             ]
-            self.explanation_table.add_row(*row)
+            explanation_table.add_row(*row)
 
 
 def evaluate_concatenated_response(
-    concatenated_response, evaluation_config, file_path, evaluation_output_dir
+    concatenated_response,
+    evaluation_config,
+    file_path,
+    evaluation_output_dir,
+    context=None,
 ):
-    evaluation_config.prepare_and_validate_omr_response(concatenated_response)
+    explanation_table = evaluation_config.prepare_and_validate_omr_response(
+        concatenated_response
+    )
+    if context is not None:
+        context.explanation_table = explanation_table
     current_score = 0.0
     for question in evaluation_config.questions_in_order:
         marked_answer = concatenated_response[question]
         delta = evaluation_config.match_answer_for_question(
-            current_score, question, marked_answer
+            current_score, question, marked_answer, explanation_table
         )
         current_score += delta
 
-    evaluation_config.conditionally_print_explanation()
-    evaluation_config.conditionally_save_explanation_csv(file_path, evaluation_output_dir)
+    evaluation_config.conditionally_print_explanation(explanation_table)
+    evaluation_config.conditionally_save_explanation_csv(
+        file_path, evaluation_output_dir, explanation_table
+    )
 
     return current_score
@@ -1,20 +1,58 @@
+import atexit
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from time import time
 
 import cv2
 import numpy as np
 
 from src.logger import logger
+from src.processors.CropPage import CropPage
 from src.processors.interfaces.ImagePreprocessor import ImagePreprocessor
 from src.utils.image import ImageUtils
 from src.utils.interaction import InteractionUtils
 
+# How far below the learned match norm a warm started match may fall
+WARM_START_TOLERANCE = 0.05
+# Successful sheets to see before searching only the learned corner windows
+CORNER_WINDOW_WARMUP = 3
+# How far a marker may move between sheets in fixed geometry mode
+FIXED_GEOMETRY_PADDING = 8
+
+
+@lru_cache(maxsize=None)
+def get_quad_executor():
+    # Note: cv2.matchTemplate releases the GIL, quadrants are matched in parallel.
+    # One pool shared by every CropOnMarkers, created on first use.
+    quad_executor = ThreadPoolExecutor(max_workers=4)
+    atexit.register(quad_executor.shutdown)
+    return quad_executor
+
+
+@dataclass
+class MarkerSearch:
+    name: str
+    apply_erode_subtract: bool
+    # (scale, marker) pairs in sweep order, and their coarse pyramid level
+    rescaled_markers: list
+    coarse_markers: list
+    # The configured search, the only one using the warm start, the pyramid,
+    # the corner windows and updating what was learned over the batch
+    is_narrow: bool = False
+    # Crop the page by its contour before searching
+    crop_page: bool = False
+    # Check only the marker positions accepted on the previous sheet
+    fixed_geometry: bool = False
+
 
 class CropOnMarkers(ImagePreprocessor):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         config = self.tuning_config
         marker_ops = self.options
-        self.threshold_circles = []
         # img_utils = ImageUtils()
 
         # options with defaults
@@ -28,7 +66,46 @@ class CropOnMarkers(ImagePreprocessor):
         )
         self.marker_rescale_steps = int(marker_ops.get("marker_rescale_steps", 10))
         self.apply_erode_subtract = marker_ops.get("apply_erode_subtract", True)
-        self.marker = self.load_marker(marker_ops, config)
+        # Note: off by default, the scale learned from earlier sheets makes results
+        # depend on the order the sheets are read in
+        self.marker_warm_start = marker_ops.get("marker_warm_start", False)
+        self.pyramid_downscale = int(marker_ops.get("marker_pyramid_downscale", 1))
+        self.corner_window = marker_ops.get("marker_corner_window", None)
+        self.learn_corner_windows = marker_ops.get("learn_corner_windows", False)
+        # Fallbacks tried in order when the configured marker search fails
+        self.fallback_ladder = marker_ops.get("fallback_ladder", [])
+        self.fixed_geometry = marker_ops.get("fixed_geometry", False)
+        self.marker = self.load_marker(marker_ops, config, self.apply_erode_subtract)
+        self.rescaled_markers = self.get_rescaled_markers(
+            self.marker,
+            self.marker_rescale_range,
+            (self.marker_rescale_range[1] - self.marker_rescale_range[0])
+            // self.marker_rescale_steps,
+        )
+        # Coarse level of the pyramid search, markers reduced like the image
+        self.coarse_markers = [
+            (s, self.get_coarse_image(rescaled_marker))
+            for s, rescaled_marker in self.rescaled_markers
+        ]
+
+        # Learned over the batch: index of the last best scale, the running mean of
+        # the best match scores and the box of marker positions seen per quadrant.
+        # Shared by all threads reading this batch.
+        self.learned_lock = threading.Lock()
+        self.last_best_index = None
+        self.match_norm, self.matches_count = 0.0, 0
+        self.marker_boxes, self.marker_boxes_count = [None] * 4, 0
+        # (search, best_scale, quad matches) accepted on the last sheet
+        self.cached_markers = None
+
+        self.marker_searches = self.get_marker_searches(marker_ops, config)
+        self.crop_page = None
+        if "crop_page" in self.fallback_ladder:
+            self.crop_page = CropPage(
+                options={},
+                relative_dir=self.relative_dir,
+                image_instance_ops=self.image_instance_ops,
+            )
 
     def __str__(self):
         return self.marker_path
@@ -36,106 +113,17 @@ class CropOnMarkers(ImagePreprocessor):
     def exclude_files(self):
         return [self.marker_path]
 
-    def apply_filter(self, image, file_path):
+    def apply_filter(self, image, file_path, context):
         config = self.tuning_config
-        image_instance_ops = self.image_instance_ops
-        image_eroded_sub = ImageUtils.normalize_util(
-            image
-            if self.apply_erode_subtract
-            else (image - cv2.erode(image, kernel=np.ones((5, 5)), iterations=5))
-        )
-        # Quads on warped image
-        quads = {}
-        h1, w1 = image_eroded_sub.shape[:2]
-        midh, midw = h1 // 3, w1 // 2
-        origins = [[0, 0], [midw, 0], [0, midh], [midw, midh]]
-        quads[0] = image_eroded_sub[0:midh, 0:midw]
-        quads[1] = image_eroded_sub[0:midh, midw:w1]
-        quads[2] = image_eroded_sub[midh:h1, 0:midw]
-        quads[3] = image_eroded_sub[midh:h1, midw:w1]
-
-        # Draw Quadlines
-        image_eroded_sub[:, midw : midw + 2] = 255
-        image_eroded_sub[midh : midh + 2, :] = 255
-
-        best_scale, all_max_t = self.getBestMatch(image_eroded_sub)
-        if best_scale is None:
-            if config.outputs.show_image_level >= 1:
-                InteractionUtils.show("Quads", image_eroded_sub, config=config)
+        located = self.locate_markers(image, file_path, context)
+        if located is None:
             return None
 
-        optimal_marker = ImageUtils.resize_util_h(
-            self.marker, u_height=int(self.marker.shape[0] * best_scale)
-        )
-        _h, w = optimal_marker.shape[:2]
-        centres = []
-        sum_t, max_t = 0, 0
-        quarter_match_log = "Matching Marker:  "
-        for k in range(0, 4):
-            res = cv2.matchTemplate(quads[k], optimal_marker, cv2.TM_CCOEFF_NORMED)
-            max_t = res.max()
-            quarter_match_log += f"Quarter{str(k + 1)}: {str(round(max_t, 3))}\t"
-            if (
-                max_t < self.min_matching_threshold
-                or abs(all_max_t - max_t) >= self.max_matching_variation
-            ):
-                logger.error(
-                    file_path,
-                    "\nError: No circle found in Quad",
-                    k + 1,
-                    "\n\t min_matching_threshold",
-                    self.min_matching_threshold,
-                    "\t max_matching_variation",
-                    self.max_matching_variation,
-                    "\t max_t",
-                    max_t,
-                    "\t all_max_t",
-                    all_max_t,
-                )
-                if config.outputs.show_image_level >= 1:
-                    InteractionUtils.show(
-                        f"No markers: {file_path}",
-                        image_eroded_sub,
-                        0,
-                        config=config,
-                    )
-                    InteractionUtils.show(
-                        f"res_Q{str(k + 1)} ({str(max_t)})",
-                        res,
-                        1,
-                        config=config,
-                    )
-                return None
-
-            pt = np.argwhere(res == max_t)[0]
-            pt = [pt[1], pt[0]]
-            pt[0] += origins[k][0]
-            pt[1] += origins[k][1]
-            # print(">>",pt)
-            image = cv2.rectangle(
-                image, tuple(pt), (pt[0] + w, pt[1] + _h), (150, 150, 150), 2
-            )
-            # display:
-            image_eroded_sub = cv2.rectangle(
-                image_eroded_sub,
-                tuple(pt),
-                (pt[0] + w, pt[1] + _h),
-                (50, 50, 50) if self.apply_erode_subtract else (155, 155, 155),
-                4,
-            )
-            centres.append([pt[0] + w / 2, pt[1] + _h / 2])
-            sum_t += max_t
-
-        logger.info(quarter_match_log)
-        logger.info(f"Optimal Scale: {best_scale}")
-        # analysis data
-        self.threshold_circles.append(sum_t / 4)
-
+        image, centres, image_eroded_sub, _pre_transform = located
         image = ImageUtils.four_point_transform(image, np.array(centres))
         # appendSaveImg(1,image_eroded_sub)
         # appendSaveImg(1,image_norm)
 
-        image_instance_ops.append_save_img(2, image_eroded_sub)
         # Debugging image -
         # res = cv2.matchTemplate(image_eroded_sub,optimal_marker,cv2.TM_CCOEFF_NORMED)
         # res[ : , midw:midw+2] = 255
@@ -161,7 +149,313 @@ class CropOnMarkers(ImagePreprocessor):
         # image_eroded_sub = image_norm - cv2.erode(image_norm, kernel=np.ones((5,5)),iterations=2)
         return image
 
-    def load_marker(self, marker_ops, config):
+    def get_transform(self, image, file_path, context):
+        located = self.locate_markers(image, file_path, context)
+        if located is None:
+            return None
+        _image, centres, _image_eroded_sub, pre_transform = located
+        transform, dimensions = ImageUtils.get_four_point_transform(np.array(centres))
+        return transform @ pre_transform, dimensions
+
+    def locate_markers(self, image, file_path, context):
+        """
+        Finds the four markers, returns (search_image, marker centres,
+        image_eroded_sub, pre_transform) with the centres in search_image, which
+        pre_transform takes the image to. Returns None if no search finds them.
+        """
+        image_instance_ops = self.image_instance_ops
+        h1, w1 = image.shape[:2]
+
+        # Escalate from the configured search to the costlier fallbacks until all
+        # four markers are found. Failed searches leave the input image untouched.
+        found = None
+        for search in self.marker_searches:
+            start_time = time()
+            search_image, pre_transform = image, np.eye(3)
+            if search.crop_page:
+                search_image = None
+                page = self.crop_page.get_transform(image, file_path, context)
+                if page is not None:
+                    # Marker scales are relative to the processing dimensions
+                    page_transform, page_dimensions = page
+                    pre_transform = (
+                        ImageUtils.get_resize_transform(page_dimensions, (w1, h1))
+                        @ page_transform
+                    )
+                    search_image = cv2.warpPerspective(image, pre_transform, (w1, h1))
+            if search.fixed_geometry:
+                found = self.find_cached_markers(search_image)
+            elif search_image is not None:
+                found = self.find_markers(search_image, file_path, search)
+            logger.info(
+                f"Marker search '{search.name}':",
+                "found" if found is not None else "failed",
+                f"in {round((time() - start_time) * 1000, 1)} ms",
+            )
+            if found is not None:
+                break
+
+        if found is None:
+            logger.error(
+                file_path,
+                f"\nError: Markers not found after {len(self.marker_searches)}",
+                "search(es)",
+            )
+            return None
+
+        search, image_eroded_sub, quad_matches, optimal_marker, best_scale = found
+        _h, w = optimal_marker.shape[:2]
+        centres = []
+        sum_t = 0
+        quarter_match_log = "Matching Marker:  "
+        for k, (max_t, pt, _res) in enumerate(quad_matches):
+            quarter_match_log += f"Quarter{str(k + 1)}: {str(round(max_t, 3))}\t"
+            # print(">>",pt)
+            search_image = cv2.rectangle(
+                search_image, tuple(pt), (pt[0] + w, pt[1] + _h), (150, 150, 150), 2
+            )
+            # display:
+            image_eroded_sub = cv2.rectangle(
+                image_eroded_sub,
+                tuple(pt),
+                (pt[0] + w, pt[1] + _h),
+                (50, 50, 50) if search.apply_erode_subtract else (155, 155, 155),
+                4,
+            )
+            centres.append([pt[0] + w / 2, pt[1] + _h / 2])
+            sum_t += max_t
+
+        logger.info(quarter_match_log)
+        logger.info(f"Optimal Scale: {best_scale}")
+        # analysis data
+        context.threshold_circles.append(sum_t / 4)
+        if search.is_narrow and self.learn_corner_windows:
+            self.update_marker_boxes([match[1] for match in quad_matches])
+        if self.fixed_geometry and not search.crop_page:
+            with self.learned_lock:
+                self.cached_markers = (search, best_scale, quad_matches)
+
+        image_instance_ops.append_save_img(2, image_eroded_sub, context)
+        return search_image, centres, image_eroded_sub, pre_transform
+
+    def get_marker_searches(self, marker_ops, config):
+        """
+        The configured search followed by the rungs of the fallback ladder,
+        in the order they are tried.
+        """
+        marker_searches = []
+        if self.fixed_geometry:
+            marker_searches.append(
+                MarkerSearch(
+                    "fixed_geometry",
+                    self.apply_erode_subtract,
+                    self.rescaled_markers,
+                    self.coarse_markers,
+                    fixed_geometry=True,
+                )
+            )
+        marker_searches.append(
+            MarkerSearch(
+                "narrow",
+                self.apply_erode_subtract,
+                self.rescaled_markers,
+                self.coarse_markers,
+                is_narrow=True,
+            )
+        )
+        if not self.fallback_ladder:
+            return marker_searches
+
+        # Twice the span of the configured range at half the step
+        low, high = self.marker_rescale_range
+        wider_range = (max(1, low // 2), high + (high - low) // 2)
+        wider_descent = max(1, (high - low) // self.marker_rescale_steps // 2)
+        wider_markers = self.get_rescaled_markers(
+            self.marker, wider_range, wider_descent
+        )
+        for rung in self.fallback_ladder:
+            if rung == "wider_scales":
+                marker_searches.append(
+                    MarkerSearch(
+                        rung, self.apply_erode_subtract, wider_markers, wider_markers
+                    )
+                )
+            elif rung == "toggle_erode_subtract":
+                toggled_markers = self.get_rescaled_markers(
+                    self.load_marker(marker_ops, config, not self.apply_erode_subtract),
+                    wider_range,
+                    wider_descent,
+                )
+                marker_searches.append(
+                    MarkerSearch(
+                        rung,
+                        not self.apply_erode_subtract,
+                        toggled_markers,
+                        toggled_markers,
+                    )
+                )
+            elif rung == "crop_page":
+                marker_searches.append(
+                    MarkerSearch(
+                        rung,
+                        self.apply_erode_subtract,
+                        wider_markers,
+                        wider_markers,
+                        crop_page=True,
+                    )
+                )
+        return marker_searches
+
+    def find_markers(self, image, file_path, search):
+        """
+        Runs one marker search on the image, returns (image_eroded_sub,
+        quad_matches, optimal_marker, best_scale) or None if any quad misses.
+        Only the narrow search uses the pyramid, the corner windows and the
+        learned scale, the fallbacks sweep the whole quads.
+        """
+        config = self.tuning_config
+        image_eroded_sub, quads = self.get_eroded_sub_and_quads(
+            image, search.apply_erode_subtract
+        )
+
+        coarse_image = None
+        if search.is_narrow and self.pyramid_downscale > 1:
+            # Scale sweep and quadrant hits on the coarse level, refined afterwards
+            coarse_image = self.get_coarse_image(image_eroded_sub)
+            best_scale, all_max_t = self.getBestMatch(
+                coarse_image, search.coarse_markers
+            )
+        else:
+            best_scale, all_max_t = self.getBestMatch(
+                image_eroded_sub, search.rescaled_markers, search.is_narrow
+            )
+        if best_scale is None:
+            if config.outputs.show_image_level >= 1:
+                InteractionUtils.show("Quads", image_eroded_sub, config=config)
+            return None
+
+        optimal_marker = dict(search.rescaled_markers)[best_scale]
+        coarse_marker = dict(search.coarse_markers)[best_scale]
+        quad_regions = [[quad] for quad in quads]
+        if search.is_narrow:
+            quad_regions = [
+                self.get_search_regions(
+                    k, quad, optimal_marker.shape, image_eroded_sub.shape
+                )
+                for k, quad in enumerate(quads)
+            ]
+        quad_matches = list(
+            get_quad_executor().map(
+                lambda k: self.search_quad(
+                    image_eroded_sub,
+                    quad_regions[k],
+                    optimal_marker,
+                    coarse_image,
+                    coarse_marker,
+                    all_max_t,
+                ),
+                range(4),
+            )
+        )
+        if coarse_image is not None:
+            # Compare the quadrants against their best full resolution match
+            all_max_t = max(max_t for max_t, _, _ in quad_matches)
+
+        for k, (max_t, _pt, res) in enumerate(quad_matches):
+            if self.is_marker_match(max_t, all_max_t):
+                continue
+            logger.warning(
+                file_path,
+                f"\nNo circle found in Quad {k + 1} by the '{search.name}' search",
+                "\n\t min_matching_threshold",
+                self.min_matching_threshold,
+                "\t max_matching_variation",
+                self.max_matching_variation,
+                "\t max_t",
+                max_t,
+                "\t all_max_t",
+                all_max_t,
+            )
+            if config.outputs.show_image_level >= 1:
+                InteractionUtils.show(
+                    f"No markers: {file_path}",
+                    image_eroded_sub,
+                    0,
+                    config=config,
+                )
+                InteractionUtils.show(
+                    f"res_Q{str(k + 1)} ({str(max_t)})",
+                    res,
+                    1,
+                    config=config,
+                )
+            return None
+
+        return search, image_eroded_sub, quad_matches, optimal_marker, best_scale
+
+    def find_cached_markers(self, image):
+        """
+        Matches the marker of the last accepted sheet in small windows around
+        its positions, returns None when there is no cache or a marker moved.
+        """
+        with self.learned_lock:
+            cached_markers = self.cached_markers
+        if cached_markers is None:
+            return None
+        search, best_scale, cached_matches = cached_markers
+        image_eroded_sub, _quads = self.get_eroded_sub_and_quads(
+            image, search.apply_erode_subtract
+        )
+        optimal_marker = dict(search.rescaled_markers)[best_scale]
+        _h, w = optimal_marker.shape[:2]
+        h1, w1 = image_eroded_sub.shape[:2]
+        pad = FIXED_GEOMETRY_PADDING
+        quad_matches = []
+        for _max_t, (x, y), _res in cached_matches:
+            region = (
+                max(x - pad, 0),
+                max(y - pad, 0),
+                min(x + w + pad, w1),
+                min(y + _h + pad, h1),
+            )
+            if region[3] - region[1] < _h or region[2] - region[0] < w:
+                return None
+            quad_matches.append(
+                self.find_marker(image_eroded_sub, region, optimal_marker)
+            )
+
+        all_max_t = max(max_t for max_t, _, _ in quad_matches)
+        for (max_t, _, _), (cached_max_t, _, _) in zip(quad_matches, cached_matches):
+            # Each marker should match about as well as it did on the last sheet
+            dropped = max_t < cached_max_t - WARM_START_TOLERANCE
+            if dropped or not self.is_marker_match(max_t, all_max_t):
+                return None
+        return search, image_eroded_sub, quad_matches, optimal_marker, best_scale
+
+    @staticmethod
+    def get_eroded_sub_and_quads(image, apply_erode_subtract):
+        image_eroded_sub = ImageUtils.normalize_util(
+            image
+            if apply_erode_subtract
+            else (image - cv2.erode(image, kernel=np.ones((5, 5)), iterations=5))
+        )
+        # Quads on warped image
+        h1, w1 = image_eroded_sub.shape[:2]
+        midh, midw = h1 // 3, w1 // 2
+        # (x0, y0, x1, y1) of each quad
+        quads = [
+            (0, 0, midw, midh),
+            (midw, 0, w1, midh),
+            (0, midh, midw, h1),
+            (midw, midh, w1, h1),
+        ]
+
+        # Draw Quadlines
+        image_eroded_sub[:, midw : midw + 2] = 255
+        image_eroded_sub[midh : midh + 2, :] = 255
+        return image_eroded_sub, quads
+
+    def load_marker(self, marker_ops, config, apply_erode_subtract):
         if not os.path.exists(self.marker_path):
             logger.error(
                 "Marker not found at path provided in template:",
@@ -182,42 +476,226 @@ class CropOnMarkers(ImagePreprocessor):
             marker, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX
         )
 
-        if self.apply_erode_subtract:
+        if apply_erode_subtract:
             marker -= cv2.erode(marker, kernel=np.ones((5, 5)), iterations=5)
 
         return marker
 
-    # Resizing the marker within scaleRange at rate of descent_per_step to
-    # find the best match.
-    def getBestMatch(self, image_eroded_sub):
-        config = self.tuning_config
-        descent_per_step = (
-            self.marker_rescale_range[1] - self.marker_rescale_range[0]
-        ) // self.marker_rescale_steps
-        _h, _w = self.marker.shape[:2]
-        res, best_scale = None, None
-        all_max_t = 0
+    def get_coarse_image(self, image):
+        if self.pyramid_downscale <= 1:
+            return image
+        h, w = image.shape[:2]
+        return cv2.resize(
+            image,
+            (max(1, w // self.pyramid_downscale), max(1, h // self.pyramid_downscale)),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    def is_marker_match(self, max_t, all_max_t):
+        return (
+            max_t >= self.min_matching_threshold
+            and abs(all_max_t - max_t) < self.max_matching_variation
+        )
+
+    def search_quad(
+        self, image, regions, marker, coarse_image, coarse_marker, all_max_t
+    ):
+        # Regions go from narrow to the whole quad, widen while the match fails
+        for region in regions:
+            max_t, pt, res = self.find_marker(
+                image, region, marker, coarse_image, coarse_marker
+            )
+            if self.is_marker_match(max_t, all_max_t):
+                break
+        return max_t, pt, res
+
+    def get_search_regions(self, k, quad, marker_shape, image_shape):
+        """
+        Regions to search quad k in: the expected corner window if one is known
+        (learned from earlier sheets, else declared by marker_corner_window),
+        then the whole quad.
+        """
+        x0, y0, x1, y1 = quad
+        window = None
+        with self.learned_lock:
+            marker_box = self.marker_boxes[k]
+            learned = self.marker_boxes_count >= CORNER_WINDOW_WARMUP
+        if learned and marker_box is not None:
+            # Seen marker positions, padded by one marker size
+            _h, w = marker_shape[:2]
+            min_x, min_y, max_x, max_y = marker_box
+            window = (min_x - w, min_y - _h, max_x + 2 * w, max_y + 2 * _h)
+        elif self.corner_window is not None:
+            # The corner of the page that lies in this quad
+            h1, w1 = image_shape[:2]
+            window_w = int(w1 * self.corner_window)
+            window_h = int(h1 * self.corner_window)
+            left = 0 if k in (0, 2) else w1 - window_w
+            top = 0 if k in (0, 1) else h1 - window_h
+            window = (left, top, left + window_w, top + window_h)
+
+        if window is None:
+            return [quad]
+        window = (
+            max(window[0], x0),
+            max(window[1], y0),
+            min(window[2], x1),
+            min(window[3], y1),
+        )
+        if (
+            window[3] - window[1] < marker_shape[0]
+            or window[2] - window[0] < marker_shape[1]
+        ):
+            return [quad]
+        return [window, quad]
 
+    def update_marker_boxes(self, marker_points):
+        with self.learned_lock:
+            for k, (x, y) in enumerate(marker_points):
+                min_x, min_y, max_x, max_y = self.marker_boxes[k] or (x, y, x, y)
+                self.marker_boxes[k] = (
+                    min(min_x, x),
+                    min(min_y, y),
+                    max(max_x, x),
+                    max(max_y, y),
+                )
+            self.marker_boxes_count += 1
+
+    def find_marker(self, image, region, marker, coarse_image=None, coarse_marker=None):
+        """
+        Best match of the marker in region (x0, y0, x1, y1) of the image,
+        returns (max_t, [x, y], res) with [x, y] in image coordinates.
+        With a coarse image, the hit found there is refined by matching the full
+        resolution marker in a small window around it.
+        """
+        x0, y0, x1, y1 = region
+        _h, w = marker.shape[:2]
+        window = region
+        if coarse_image is not None:
+            downscale = self.pyramid_downscale
+            coarse_x0, coarse_y0 = x0 // downscale, y0 // downscale
+            coarse_region = coarse_image[
+                coarse_y0 : y1 // downscale, coarse_x0 : x1 // downscale
+            ]
+            if all(c >= m for c, m in zip(coarse_region.shape, coarse_marker.shape)):
+                coarse_res = cv2.matchTemplate(
+                    coarse_region, coarse_marker, cv2.TM_CCOEFF_NORMED
+                )
+                _, _, _, (coarse_x, coarse_y) = cv2.minMaxLoc(coarse_res)
+                hit_x = (coarse_x0 + coarse_x) * downscale
+                hit_y = (coarse_y0 + coarse_y) * downscale
+                # Covers the rounding of both the image and the marker reductions
+                pad = 2 * downscale
+                refined = (
+                    max(hit_x - pad, x0),
+                    max(hit_y - pad, y0),
+                    min(hit_x + w + pad, x1),
+                    min(hit_y + _h + pad, y1),
+                )
+                if refined[3] - refined[1] >= _h and refined[2] - refined[0] >= w:
+                    window = refined
+
+        window_x0, window_y0, window_x1, window_y1 = window
+        res = cv2.matchTemplate(
+            image[window_y0:window_y1, window_x0:window_x1],
+            marker,
+            cv2.TM_CCOEFF_NORMED,
+        )
+        max_t = res.max()
+        if max_t < self.min_matching_threshold and window != region:
+            # Note: a small coarse marker can hit a decoy, rescan the whole region
+            return self.find_marker(image, region, marker)
+        pt = np.argwhere(res == max_t)[0]
+        return max_t, [pt[1] + window_x0, pt[0] + window_y0], res
+
+    # Resizing the marker within rescale_range at rate of descent_per_step
+    @staticmethod
+    def get_rescaled_markers(marker, rescale_range, descent_per_step):
+        _h, _w = marker.shape[:2]
+        rescaled_markers = []
         for r0 in np.arange(
-            self.marker_rescale_range[1],
-            self.marker_rescale_range[0],
+            rescale_range[1],
+            rescale_range[0],
             -1 * descent_per_step,
         ):  # reverse order
             s = float(r0 * 1 / 100)
             if s == 0.0:
                 continue
-            rescaled_marker = ImageUtils.resize_util_h(
-                self.marker, u_height=int(_h * s)
+            rescaled_markers.append(
+                (s, ImageUtils.resize_util_h(marker, u_height=int(_h * s)))
             )
+        return rescaled_markers
+
+    def match_scales(self, image_eroded_sub, rescaled_markers, scale_indices):
+        res, best_index = None, None
+        all_max_t = 0
+        for scale_index in scale_indices:
+            marker = rescaled_markers[scale_index][1]
+            if any(m > i for m, i in zip(marker.shape, image_eroded_sub.shape)):
+                # Wider fallback scales may outgrow a small image
+                continue
             # res is the black image with white dots
-            res = cv2.matchTemplate(
-                image_eroded_sub, rescaled_marker, cv2.TM_CCOEFF_NORMED
-            )
+            res = cv2.matchTemplate(image_eroded_sub, marker, cv2.TM_CCOEFF_NORMED)
 
             max_t = res.max()
             if all_max_t < max_t:
                 # print('Scale: '+str(s)+', Circle Match: '+str(round(max_t*100,2))+'%')
-                best_scale, all_max_t = s, max_t
+                best_index, all_max_t = scale_index, max_t
+        return res, best_index, all_max_t
+
+    def get_warm_start_indices(self):
+        # The last best scale first, then its neighbours
+        with self.learned_lock:
+            last_best_index = self.last_best_index
+        if not self.marker_warm_start or last_best_index is None:
+            return None
+        return [
+            scale_index
+            for scale_index in [
+                last_best_index,
+                last_best_index - 1,
+                last_best_index + 1,
+            ]
+            if 0 <= scale_index < len(self.rescaled_markers)
+        ]
+
+    def update_learned_scale(self, best_index, all_max_t):
+        with self.learned_lock:
+            self.last_best_index = best_index
+            self.matches_count += 1
+            self.match_norm += (all_max_t - self.match_norm) / self.matches_count
+
+    # Find the best match among the cached rescaled markers. Sheets of a batch
+    # usually share the scale, so the last best scale is tried first and the full
+    # sweep only runs when that match falls below the learned norm.
+    def getBestMatch(self, image_eroded_sub, rescaled_markers=None, learn=True):
+        config = self.tuning_config
+        if rescaled_markers is None:
+            rescaled_markers = self.rescaled_markers
+        res, best_index, all_max_t = None, None, 0
+        warm_start_indices = self.get_warm_start_indices() if learn else None
+        if warm_start_indices:
+            res, best_index, all_max_t = self.match_scales(
+                image_eroded_sub, rescaled_markers, warm_start_indices
+            )
+            with self.learned_lock:
+                min_warm_match = max(
+                    self.min_matching_threshold,
+                    self.match_norm - WARM_START_TOLERANCE,
+                )
+            if all_max_t < min_warm_match:
+                best_index = None
+
+        if best_index is None:
+            res, best_index, all_max_t = self.match_scales(
+                image_eroded_sub, rescaled_markers, range(len(rescaled_markers))
+            )
+
+        best_scale = None
+        if best_index is not None:
+            best_scale = rescaled_markers[best_index][0]
+            if learn and all_max_t >= self.min_matching_threshold:
+                self.update_learned_scale(best_index, all_max_t)
 
         if all_max_t < self.min_matching_threshold:
             logger.warning(
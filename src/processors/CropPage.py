@@ -1,6 +1,9 @@
 """
 https://www.pyimagesearch.com/2015/04/06/zero-parameter-automatic-canny-edge-detection-with-python-and-opencv/
 """
+import heapq
+import threading
+
 import cv2
 import numpy as np
 
@@ -10,6 +13,15 @@ from src.utils.image import ImageUtils
 from src.utils.interaction import InteractionUtils
 
 MIN_PAGE_AREA = 80000
+# The page is searched on a copy reduced to no less than this width. Note: CropPage
+# gets the image resized to processing_width, the reduction only applies from a
+# processing_width of 2 * MIN_DETECTION_WIDTH (not at the default of 666)
+MIN_DETECTION_WIDTH = 500
+# Half size of the patches kept around the page corners in fixed geometry mode
+CORNER_PATCH_RADIUS = 20
+# How far a page corner may move between sheets in fixed geometry mode
+CORNER_SEARCH_PADDING = 8
+MIN_CORNER_CORRELATION = 0.8
 
 
 def normalize(image):
@@ -35,6 +47,25 @@ def validate_rect(approx):
     return len(approx) == 4 and check_max_cosine(approx.reshape(4, 2))
 
 
+def bounding_box_area(contour):
+    _x, _y, w, h = cv2.boundingRect(contour)
+    return w * h
+
+
+def reduce_image(image, downscale):
+    # Note: cv2 area resizes are much faster by halves than by larger factors
+    while downscale % 2 == 0:
+        h, w = image.shape[:2]
+        image = cv2.resize(image, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        downscale //= 2
+    if downscale > 1:
+        h, w = image.shape[:2]
+        image = cv2.resize(
+            image, (w // downscale, h // downscale), interpolation=cv2.INTER_AREA
+        )
+    return image
+
+
 def angle(p_1, p_2, p_0):
     dx1 = float(p_1[0] - p_0[0])
     dy1 = float(p_1[1] - p_0[1])
@@ -52,35 +83,129 @@ class CropPage(ImagePreprocessor):
         self.morph_kernel = tuple(
             int(x) for x in cropping_ops.get("morphKernel", [10, 10])
         )
+        self.fixed_geometry = cropping_ops.get("fixed_geometry", False)
+        self.detection_downscale = int(cropping_ops.get("detectionDownscale", 4))
+        # (corners, patches around them) of the last detected page
+        self.cache_lock = threading.Lock()
+        self.cached_page = None
 
-    def apply_filter(self, image, file_path):
+    def apply_filter(self, image, file_path, _context):
         image = normalize(cv2.GaussianBlur(image, (3, 3), 0))
 
-        # Resize should be done with another preprocessor is needed
-        sheet = self.find_page(image, file_path)
-        if len(sheet) == 0:
-            logger.error(
-                f"\tError: Paper boundary not found for: '{file_path}'\nHave you accidentally included CropPage preprocessor?"
-            )
+        sheet = self.get_sheet(image, file_path)
+        if sheet is None:
             return None
 
-        logger.info(f"Found page corners: \t {sheet.tolist()}")
-
         # Warp layer 1
         image = ImageUtils.four_point_transform(image, sheet)
 
         # Return preprocessed image
         return image
 
+    def get_transform(self, image, file_path, _context):
+        image = normalize(cv2.GaussianBlur(image, (3, 3), 0))
+        sheet = self.get_sheet(image, file_path)
+        if sheet is None:
+            return None
+        return ImageUtils.get_four_point_transform(sheet)
+
+    def get_sheet(self, image, file_path):
+        sheet = self.find_cached_page(image) if self.fixed_geometry else None
+        if sheet is not None:
+            logger.info(f"Reused cached page corners: \t {sheet.tolist()}")
+        else:
+            # Resize should be done with another preprocessor is needed
+            sheet = self.find_page(image, file_path)
+            if len(sheet) == 0:
+                logger.error(
+                    f"\tError: Paper boundary not found for: '{file_path}'\nHave you accidentally included CropPage preprocessor?"
+                )
+                return None
+
+            logger.info(f"Found page corners: \t {sheet.tolist()}")
+            if self.fixed_geometry:
+                self.cache_page(image, sheet)
+        return sheet
+
+    def cache_page(self, image, sheet):
+        patches = []
+        sheet = np.rint(sheet).astype(int)
+        for x, y in sheet:
+            patch_x0 = max(x - CORNER_PATCH_RADIUS, 0)
+            patch_y0 = max(y - CORNER_PATCH_RADIUS, 0)
+            patch = image[
+                patch_y0 : y + CORNER_PATCH_RADIUS, patch_x0 : x + CORNER_PATCH_RADIUS
+            ].copy()
+            patches.append((patch, (x - patch_x0, y - patch_y0)))
+        with self.cache_lock:
+            self.cached_page = (sheet, patches)
+
+    def find_cached_page(self, image):
+        """
+        Correlates the patches kept around the last detected page corners with
+        small windows of the image, returns the moved corners or None when any
+        of them is lost.
+        """
+        with self.cache_lock:
+            cached_page = self.cached_page
+        if cached_page is None:
+            return None
+        sheet, patches = cached_page
+        radius = CORNER_PATCH_RADIUS + CORNER_SEARCH_PADDING
+        corners = []
+        for (x, y), (patch, (offset_x, offset_y)) in zip(sheet, patches):
+            window_x0, window_y0 = max(x - radius, 0), max(y - radius, 0)
+            window = image[window_y0 : y + radius, window_x0 : x + radius]
+            if any(w < p for w, p in zip(window.shape, patch.shape)):
+                return None
+            res = cv2.matchTemplate(window, patch, cv2.TM_CCOEFF_NORMED)
+            _, max_t, _, (match_x, match_y) = cv2.minMaxLoc(res)
+            # Note: flat patches correlate to nan, which fails this check too
+            if not max_t >= MIN_CORNER_CORRELATION:
+                return None
+            corners.append(
+                [window_x0 + match_x + offset_x, window_y0 + match_y + offset_y]
+            )
+        return np.array(corners)
+
+    def get_detection_downscale(self, image):
+        """
+        Reduction of the image for the contour search: detectionDownscale, capped
+        so that the reduced copy stays at least MIN_DETECTION_WIDTH wide.
+        """
+        return max(
+            1, min(self.detection_downscale, image.shape[1] // MIN_DETECTION_WIDTH)
+        )
+
+    @staticmethod
+    def refine_corners(image, sheet, downscale):
+        """
+        Scales the corners found on the reduced copy back up and refines them
+        within a window of the reduction's uncertainty on the full image.
+        """
+        corners = (sheet.astype(np.float32) * downscale).reshape(-1, 1, 2)
+        window = (2 * downscale, 2 * downscale)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.1)
+        cv2.cornerSubPix(image, corners, window, (-1, -1), criteria)
+        return corners.reshape(4, 2)
+
     def find_page(self, image, file_path):
         config = self.tuning_config
 
+        full_image = image
+        # Note: the contour search is costly on high resolution scans, it runs on
+        # a reduced copy and only the corners go back to full resolution
+        downscale = self.get_detection_downscale(image)
+        if downscale > 1:
+            image = reduce_image(image, downscale)
         image = normalize(image)
 
         _ret, image = cv2.threshold(image, 200, 255, cv2.THRESH_TRUNC)
         image = normalize(image)
 
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, self.morph_kernel)
+        kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT, tuple(max(1, k // downscale) for k in self.morph_kernel)
+        )
 
         # Close the small holes, i.e. Complete the edges on canny image
         closed = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
@@ -94,12 +219,16 @@ class CropPage(ImagePreprocessor):
         cnts = ImageUtils.grab_contours(
             cv2.findContours(edge, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
         )
+        # Note: a hull is never larger than its bounding box, small contours
+        # can be dropped before taking the hulls
+        min_page_area = MIN_PAGE_AREA / downscale**2
+        cnts = [c for c in cnts if bounding_box_area(c) >= min_page_area]
         # convexHull to resolve disordered curves due to noise
         cnts = [cv2.convexHull(c) for c in cnts]
-        cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:5]
+        cnts = heapq.nlargest(5, cnts, key=cv2.contourArea)
         sheet = []
         for c in cnts:
-            if cv2.contourArea(c) < MIN_PAGE_AREA:
+            if cv2.contourArea(c) < min_page_area:
                 continue
             peri = cv2.arcLength(c, True)
             approx = cv2.approxPolyDP(c, epsilon=0.025 * peri, closed=True)
@@ -109,4 +238,6 @@ class CropPage(ImagePreprocessor):
                 cv2.drawContours(edge, [approx], -1, (255, 255, 255), 10)
                 break
 
+        if len(sheet) != 0 and downscale > 1:
+            sheet = self.refine_corners(full_image, sheet, downscale)
         return sheet
@@ -2,6 +2,8 @@
 Image based feature alignment
 Credits: https://www.learnopencv.com/image-alignment-feature-based-using-opencv-c-python/
 """
+import threading
+
 import cv2
 import numpy as np
 
@@ -9,6 +11,17 @@ from src.processors.interfaces.ImagePreprocessor import ImagePreprocessor
 from src.utils.image import ImageUtils
 from src.utils.interaction import InteractionUtils
 
+# FLANN index for binary descriptors like ORB's
+FLANN_INDEX_LSH = 6
+FLANN_INDEX_PARAMS = {
+    "algorithm": FLANN_INDEX_LSH,
+    "table_number": 6,
+    "key_size": 12,
+    "multi_probe_level": 1,
+}
+# Matches a transform must fit, chance matches can fit the few points it needs
+MIN_INLIERS = 10
+
 
 class FeatureBasedAlignment(ImagePreprocessor):
     def __init__(self, *args, **kwargs):
@@ -27,12 +40,18 @@ class FeatureBasedAlignment(ImagePreprocessor):
         # get options with defaults
         self.max_features = int(options.get("maxFeatures", 500))
         self.good_match_percent = options.get("goodMatchPercent", 0.15)
+        self.ratio_test = options.get("ratioTest", 0.75)
+        self.orb_downscale = int(options.get("orbDownscale", 1))
         self.transform_2_d = options.get("2d", False)
         # Extract keypoints and description of source image
-        self.orb = cv2.ORB_create(self.max_features)
-        self.to_keypoints, self.to_descriptors = self.orb.detectAndCompute(
-            self.ref_img, None
-        )
+        self.ref_detect_img = self.get_detect_image(self.ref_img)
+        self.to_keypoints, self.to_descriptors = cv2.ORB_create(
+            self.max_features
+        ).detectAndCompute(self.ref_detect_img, None)
+        self.to_points = self.get_points(self.to_keypoints)
+        # Note: cv2 matchers are not safe to share, each thread trains its own
+        # index over the reference descriptors once
+        self.thread_local = threading.local()
 
     def __str__(self):
         return self.ref_path.name
@@ -40,55 +59,108 @@ class FeatureBasedAlignment(ImagePreprocessor):
     def exclude_files(self):
         return [self.ref_path]
 
-    def apply_filter(self, image, _file_path):
-        config = self.tuning_config
+    def apply_filter(self, image, _file_path, _context):
         # Convert images to grayscale
         # im1Gray = cv2.cvtColor(im1, cv2.COLOR_BGR2GRAY)
         # im2Gray = cv2.cvtColor(im2, cv2.COLOR_BGR2GRAY)
 
         image = cv2.normalize(image, 0, 255, norm_type=cv2.NORM_MINMAX)
+        found = self.find_transform(image)
+        if found is None:
+            return None
+        transform, dimensions = found
+        if self.transform_2_d:
+            return cv2.warpAffine(image, transform[:2], dimensions)
+        return cv2.warpPerspective(image, transform, dimensions)
 
-        # Detect ORB features and compute descriptors.
-        from_keypoints, from_descriptors = self.orb.detectAndCompute(image, None)
-
-        # Match features.
-        matcher = cv2.DescriptorMatcher_create(
-            cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING
+    def get_transform(self, image, _file_path, _context):
+        return self.find_transform(
+            cv2.normalize(image, 0, 255, norm_type=cv2.NORM_MINMAX)
         )
 
-        # create BFMatcher object (alternate matcher)
-        # matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-
-        matches = np.array(matcher.match(from_descriptors, self.to_descriptors, None))
+    def get_detect_image(self, image):
+        if self.orb_downscale <= 1:
+            return image
+        h, w = image.shape[:2]
+        return cv2.resize(
+            image,
+            (w // self.orb_downscale, h // self.orb_downscale),
+            interpolation=cv2.INTER_AREA,
+        )
 
-        # Sort matches by score
-        matches = sorted(matches, key=lambda x: x.distance, reverse=False)
+    def get_points(self, keypoints):
+        # Keypoint positions on the (possibly reduced) image, scaled back up
+        points = cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+        return (points + 0.5) * self.orb_downscale - 0.5
+
+    def get_matcher(self):
+        if not hasattr(self.thread_local, "matcher"):
+            matcher = cv2.FlannBasedMatcher(FLANN_INDEX_PARAMS, {"checks": 50})
+            matcher.add([self.to_descriptors])
+            matcher.train()
+            self.thread_local.matcher = matcher
+        return self.thread_local.matcher
+
+    def find_transform(self, image):
+        """
+        Returns the 3x3 transform aligning the image to the reference and the
+        reference (width, height), or None if no transform was found
+        """
+        config = self.tuning_config
+        detect_image = self.get_detect_image(image)
+        # Detect ORB features and compute descriptors.
+        # Note: a detector per call, cv2 feature detectors are not safe to share
+        orb = cv2.ORB_create(self.max_features)
+        from_keypoints, from_descriptors = orb.detectAndCompute(detect_image, None)
+        if from_descriptors is None:
+            return None
+
+        # Match features, keeping those clearly closer than their second match
+        # Note: the LSH index may find less than two neighbours for a descriptor
+        knn_matches = self.get_matcher().knnMatch(from_descriptors, k=2)
+        matches = [
+            pair[0]
+            for pair in knn_matches
+            if len(pair) == 2 and pair[0].distance < self.ratio_test * pair[1].distance
+        ]
 
         # Remove not so good matches
-        num_good_matches = int(len(matches) * self.good_match_percent)
-        matches = matches[:num_good_matches]
+        num_good_matches = int(len(knn_matches) * self.good_match_percent)
+        distances = np.array([match.distance for match in matches])
+        matches = [
+            matches[i] for i in np.argsort(distances, kind="stable")[:num_good_matches]
+        ]
+        if len(matches) < 4:
+            return None
 
         # Draw top matches
         if config.outputs.show_image_level > 2:
             im_matches = cv2.drawMatches(
-                image, from_keypoints, self.ref_img, self.to_keypoints, matches, None
+                detect_image,
+                from_keypoints,
+                self.ref_detect_img,
+                self.to_keypoints,
+                matches,
+                None,
             )
             InteractionUtils.show("Aligning", im_matches, resize=True, config=config)
 
         # Extract location of good matches
-        points1 = np.zeros((len(matches), 2), dtype=np.float32)
-        points2 = np.zeros((len(matches), 2), dtype=np.float32)
-
-        for i, match in enumerate(matches):
-            points1[i, :] = from_keypoints[match.queryIdx].pt
-            points2[i, :] = self.to_keypoints[match.trainIdx].pt
+        query_indices = [match.queryIdx for match in matches]
+        train_indices = [match.trainIdx for match in matches]
+        points1 = self.get_points(from_keypoints)[query_indices]
+        points2 = self.to_points[train_indices]
 
         # Find homography
         height, width = self.ref_img.shape
         if self.transform_2_d:
-            m, _inliers = cv2.estimateAffine2D(points1, points2)
-            return cv2.warpAffine(image, m, (width, height))
+            m, inliers = cv2.estimateAffine2D(points1, points2)
+            if m is None or inliers.sum() < MIN_INLIERS:
+                return None
+            return np.vstack([m, [0, 0, 1]]), (width, height)
 
         # Use homography
-        h, _mask = cv2.findHomography(points1, points2, cv2.RANSAC)
-        return cv2.warpPerspective(image, h, (width, height))
+        h, mask = cv2.findHomography(points1, points2, cv2.RANSAC)
+        if h is None or mask.sum() < MIN_INLIERS:
+            return None
+        return h, (width, height)
@@ -0,0 +1,190 @@
+"""
+Image alignment by phase correlation against a reference image
+Credits: https://en.wikipedia.org/wiki/Phase_correlation
+"""
+import math
+
+import cv2
+import numpy as np
+
+from src.logger import logger
+from src.processors.interfaces.ImagePreprocessor import ImagePreprocessor
+from src.utils.image import ImageUtils
+
+# Rows of the log-polar magnitude, i.e. the angular resolution over 360 degrees
+LOG_POLAR_ANGLES = 1024
+# Correlation peak below which the sheet is taken as not matching the reference.
+# Matching sheets peak around 0.5, unrelated images around 0.01
+DEFAULT_MIN_RESPONSE = 0.05
+
+
+def get_spectrum(image, window):
+    return cv2.dft(np.float32(image) * window, flags=cv2.DFT_COMPLEX_OUTPUT)
+
+
+def get_high_pass_filter(shape):
+    # Damps the low frequencies that dominate the magnitude spectrum of any page
+    h, w = shape
+    x = np.outer(
+        np.cos(np.pi * (np.arange(h) / h - 0.5)),
+        np.cos(np.pi * (np.arange(w) / w - 0.5)),
+    )
+    return np.float32((1 - x) * (2 - x))
+
+
+def get_log_polar_magnitude(spectrum, high_pass_filter):
+    # The magnitude spectrum ignores translation, in log-polar coordinates the
+    # rotation and scale of the image become shifts along its rows and columns
+    magnitude = high_pass_filter * np.fft.fftshift(
+        np.log1p(cv2.magnitude(spectrum[..., 0], spectrum[..., 1]))
+    )
+    h, w = magnitude.shape
+    return cv2.warpPolar(
+        magnitude,
+        (w, LOG_POLAR_ANGLES),
+        (w / 2, h / 2),
+        min(w, h) / 2,
+        cv2.WARP_POLAR_LOG | cv2.INTER_LINEAR,
+    )
+
+
+def phase_correlate(ref_spectrum, spectrum):
+    """
+    Returns the shift (dx, dy) of the image of spectrum relative to the image of
+    ref_spectrum with sub-pixel precision, and the correlation peak response
+    """
+    cross = cv2.mulSpectrums(spectrum, ref_spectrum, 0, conjB=True)
+    cross /= cv2.magnitude(cross[..., 0], cross[..., 1])[..., None] + 1e-9
+    correlation = cv2.idft(cross, flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)
+    _, response, _, (peak_x, peak_y) = cv2.minMaxLoc(correlation)
+
+    # Weighted centroid of the peak's neighbourhood, which wraps around
+    h, w = correlation.shape
+    offsets = np.arange(-1, 2)
+    patch = np.clip(
+        correlation[np.ix_((peak_y + offsets) % h, (peak_x + offsets) % w)], 0, None
+    )
+    total = max(patch.sum(), 1e-9)
+    shift_x = peak_x + patch.sum(axis=0) @ offsets / total
+    shift_y = peak_y + patch.sum(axis=1) @ offsets / total
+    if shift_x > w / 2:
+        shift_x -= w
+    if shift_y > h / 2:
+        shift_y -= h
+    return (shift_x, shift_y), response
+
+
+class PhaseCorrelationAlignment(ImagePreprocessor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.options
+        config = self.tuning_config
+
+        # process reference image
+        self.ref_path = self.relative_dir.joinpath(options["reference"])
+        ref_img = cv2.imread(str(self.ref_path), cv2.IMREAD_GRAYSCALE)
+        self.ref_img = ImageUtils.resize_util(
+            ref_img,
+            config.dimensions.processing_width,
+            config.dimensions.processing_height,
+        )
+        # get options with defaults
+        self.downscale = int(options.get("downscale", 2))
+        self.correct_rotation = options.get("rotation", False)
+        self.min_response = options.get("minResponse", DEFAULT_MIN_RESPONSE)
+
+        # Correlations run on copies reduced by downscale, padded to a square the
+        # DFT is fast for. Spectra of squares rotate along with the image.
+        height, width = self.ref_img.shape
+        self.reduced_size = (width // self.downscale, height // self.downscale)
+        side = cv2.getOptimalDFTSize(max(self.reduced_size))
+        self.padded_size = (side, side)
+        self.window = cv2.createHanningWindow(self.padded_size, cv2.CV_32F)
+        self.high_pass_filter = get_high_pass_filter(self.window.shape)
+        # Spectra of the reference, computed once
+        self.ref_spectrum = get_spectrum(
+            self.get_reduced_image(self.ref_img), self.window
+        )
+        self.ref_log_polar_spectrum = None
+        if self.correct_rotation:
+            self.ref_log_polar_spectrum = get_spectrum(
+                get_log_polar_magnitude(self.ref_spectrum, self.high_pass_filter), 1
+            )
+
+    def __str__(self):
+        return self.ref_path.name
+
+    def exclude_files(self):
+        return [self.ref_path]
+
+    def apply_filter(self, image, file_path, context):
+        found = self.get_transform(image, file_path, context)
+        if found is None:
+            return None
+        transform, dimensions = found
+        return cv2.warpAffine(image, transform[:2], dimensions)
+
+    def get_reduced_image(self, image):
+        reduced = cv2.resize(image, self.reduced_size, interpolation=cv2.INTER_AREA)
+        return cv2.copyMakeBorder(
+            reduced,
+            0,
+            self.padded_size[1] - self.reduced_size[1],
+            0,
+            self.padded_size[0] - self.reduced_size[0],
+            cv2.BORDER_REPLICATE,
+        )
+
+    def get_transform(self, image, file_path, _context):
+        reduced = self.get_reduced_image(image)
+        reduced_transform = np.eye(3)
+        if self.correct_rotation:
+            # Undo the rotation and scale before measuring the translation
+            w, h = self.padded_size
+            log_polar_magnitude = get_log_polar_magnitude(
+                get_spectrum(reduced, self.window), self.high_pass_filter
+            )
+            (log_radius_shift, angle_shift), _ = phase_correlate(
+                self.ref_log_polar_spectrum, get_spectrum(log_polar_magnitude, 1)
+            )
+            # Rotation and scale of the sheet against the reference
+            # Note: magnitude spectra are symmetric, angles are known up to 180
+            angle = (90 - 360 * angle_shift / LOG_POLAR_ANGLES) % 180 - 90
+            scale = math.exp(-log_radius_shift * math.log(min(w, h) / 2) / w)
+            reduced_transform = np.vstack(
+                [cv2.getRotationMatrix2D((w / 2, h / 2), -angle, 1 / scale), [0, 0, 1]]
+            )
+            reduced = cv2.warpAffine(
+                reduced,
+                reduced_transform[:2],
+                self.padded_size,
+                borderMode=cv2.BORDER_REPLICATE,
+            )
+            logger.info(f"Phase correlation: rotation {angle:.2f}, scale {scale:.3f}")
+
+        (shift_x, shift_y), response = phase_correlate(
+            self.ref_spectrum, get_spectrum(reduced, self.window)
+        )
+        logger.info(
+            f"Phase correlation: shift ({shift_x * self.downscale:.1f}, "
+            f"{shift_y * self.downscale:.1f}), response {response:.3f}"
+        )
+        if response < self.min_response:
+            logger.error(
+                f"\tError: Phase correlation response {response:.3f} is below minResponse {self.min_response} for: '{file_path}'"
+            )
+            return None
+        reduced_transform = (
+            np.array([[1, 0, -shift_x], [0, 1, -shift_y], [0, 0, 1]])
+            @ reduced_transform
+        )
+
+        height, width = self.ref_img.shape
+        transform = (
+            ImageUtils.get_resize_transform(self.reduced_size, (width, height))
+            @ reduced_transform
+            @ ImageUtils.get_resize_transform(
+                (image.shape[1], image.shape[0]), self.reduced_size
+            )
+        )
+        return transform, (width, height)
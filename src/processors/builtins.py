@@ -29,8 +29,54 @@ class Levels(ImagePreprocessor):
             ]
         ).astype("uint8")
 
-    def apply_filter(self, image, _file_path):
-        return cv2.LUT(image, self.gamma)
+    def get_lut(self):
+        return self.gamma
+
+    def apply_filter(self, image, _file_path, _context):
+        # Note: the pipeline only hands over images it owns, so filters write in place
+        return cv2.LUT(image, self.gamma, dst=image)
+
+
+class FusedLookupTable(ImagePreprocessor):
+    """Consecutive pointwise preprocessors composed into a single lookup table"""
+
+    def __init__(self, pre_processors, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pre_processors = pre_processors
+        table = np.arange(0, 256, dtype=np.uint8)
+        for pre_processor in pre_processors:
+            table = pre_processor.get_lut()[table]
+        self.table = table
+
+    def get_lut(self):
+        return self.table
+
+    def apply_filter(self, image, _file_path, _context):
+        return cv2.LUT(image, self.table, dst=image)
+
+
+def fuse_pointwise_pre_processors(pre_processors):
+    """Replaces each run of consecutive pointwise preprocessors by one lookup table"""
+    fused_pre_processors, run = [], []
+    for pre_processor in pre_processors + [None]:
+        if pre_processor is not None and pre_processor.get_lut() is not None:
+            run.append(pre_processor)
+            continue
+        if len(run) > 1:
+            fused_pre_processors.append(
+                FusedLookupTable(
+                    run,
+                    options={},
+                    relative_dir=run[0].relative_dir,
+                    image_instance_ops=run[0].image_instance_ops,
+                )
+            )
+        else:
+            fused_pre_processors.extend(run)
+        run = []
+        if pre_processor is not None:
+            fused_pre_processors.append(pre_processor)
+    return fused_pre_processors
 
 
 class MedianBlur(ImagePreprocessor):
@@ -39,8 +85,8 @@ class MedianBlur(ImagePreprocessor):
         options = self.options
         self.kSize = int(options.get("kSize", 5))
 
-    def apply_filter(self, image, _file_path):
-        return cv2.medianBlur(image, self.kSize)
+    def apply_filter(self, image, _file_path, _context):
+        return cv2.medianBlur(image, self.kSize, dst=image)
 
 
 class GaussianBlur(ImagePreprocessor):
@@ -50,5 +96,5 @@ class GaussianBlur(ImagePreprocessor):
         self.kSize = tuple(int(x) for x in options.get("kSize", (3, 3)))
         self.sigmaX = int(options.get("sigmaX", 0))
 
-    def apply_filter(self, image, _file_path):
-        return cv2.GaussianBlur(image, self.kSize, self.sigmaX)
+    def apply_filter(self, image, _file_path, _context):
+        return cv2.GaussianBlur(image, self.kSize, self.sigmaX, dst=image)
@@ -8,10 +8,25 @@ class ImagePreprocessor(Processor):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def apply_filter(self, image, filename):
+    def apply_filter(self, image, filename, context):
         """Apply filter to the image and returns modified image"""
         raise NotImplementedError
 
+    def get_transform(self, image, filename, context):
+        """Returns the 3x3 transform the filter would warp the image with and the
+        (width, height) of the warped image, or None if it fails. Only implemented
+        by geometric preprocessors"""
+        raise NotImplementedError
+
+    def get_lut(self):
+        """Returns the 256 entry uint8 table the filter maps pixel values with, or
+        None if the filter is not pointwise"""
+        return None
+
+    def supports_transform(self):
+        """Returns whether the preprocessor implements get_transform"""
+        return type(self).get_transform is not ImagePreprocessor.get_transform
+
     @staticmethod
     def exclude_files():
         """Returns a list of file paths that should be excluded from processing"""
@@ -2,10 +2,27 @@
 Processor/Extension framework
 Adapated from https://github.com/gdiepen/python_processor_example
 """
+import importlib
 import inspect
-import pkgutil
+from importlib.metadata import entry_points
 
 from src.logger import logger
+from src.utils.timing import timed_stage
+
+# Module of each builtin processor, imported only once a template uses it
+BUILTIN_PROCESSOR_MODULES = {
+    "CropOnMarkers": "src.processors.CropOnMarkers",
+    "CropPage": "src.processors.CropPage",
+    "FeatureBasedAlignment": "src.processors.FeatureBasedAlignment",
+    "GaussianBlur": "src.processors.builtins",
+    "Levels": "src.processors.builtins",
+    "MedianBlur": "src.processors.builtins",
+    "PhaseCorrelationAlignment": "src.processors.PhaseCorrelationAlignment",
+}
+# Third party processors register their classes under this entry point group
+PROCESSOR_ENTRY_POINT_GROUP = "omrchecker.processors"
+# Processor methods whose running time is added to the stage timings of the sheet
+TIMED_METHODS = ("apply_filter", "get_transform")
 
 
 class Processor:
@@ -23,57 +40,61 @@ class Processor:
         self.tuning_config = image_instance_ops.tuning_config
         self.description = "UNKNOWN"
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method_name in TIMED_METHODS:
+            if method_name in cls.__dict__:
+                setattr(cls, method_name, timed_stage(cls.__dict__[method_name]))
+
 
 class ProcessorManager:
-    """Upon creation, this class will read the processors package for modules
-    that contain a class definition that is inheriting from the Processor class
+    """Resolves processor names to their classes, importing only the modules of
+    the processors asked for. Builtin processors are looked up by module path,
+    others through the PROCESSOR_ENTRY_POINT_GROUP entry points
     """
 
-    def __init__(self, processors_dir="src.processors"):
-        """Constructor that initiates the reading of all available processors
-        when an instance of the ProcessorCollection object is created
-        """
-        self.processors_dir = processors_dir
-        self.reload_processors()
-
-    @staticmethod
-    def get_name_filter(processor_name):
-        def filter_function(member):
-            return inspect.isclass(member) and member.__module__ == processor_name
-
-        return filter_function
-
-    def reload_processors(self):
-        """Reset the list of all processors and initiate the walk over the main
-        provided processor package to load all available processors
-        """
+    def __init__(self, processor_modules=None):
+        self.processor_modules = dict(processor_modules or BUILTIN_PROCESSOR_MODULES)
+        # Classes loaded so far
         self.processors = {}
-        self.seen_paths = []
 
-        logger.info(f'Loading processors from "{self.processors_dir}"...')
-        self.walk_package(self.processors_dir)
+    def get_processor(self, processor_name):
+        if processor_name not in self.processors:
+            self.processors[processor_name] = self.load_processor(processor_name)
+        return self.processors[processor_name]
 
-    def walk_package(self, package):
-        """walk the supplied package to retrieve all processors"""
-        imported_package = __import__(package, fromlist=["blah"])
-        loaded_packages = []
-        for _, processor_name, ispkg in pkgutil.walk_packages(
-            imported_package.__path__, imported_package.__name__ + "."
-        ):
-            if not ispkg and processor_name != __name__:
-                processor_module = __import__(processor_name, fromlist=["blah"])
-                # https://stackoverflow.com/a/46206754/6242649
-                clsmembers = inspect.getmembers(
-                    processor_module,
-                    ProcessorManager.get_name_filter(processor_name),
+    def load_processor(self, processor_name):
+        module_name = self.processor_modules.get(processor_name)
+        if module_name is not None:
+            processor = getattr(importlib.import_module(module_name), processor_name)
+        else:
+            matches = entry_points(
+                group=PROCESSOR_ENTRY_POINT_GROUP, name=processor_name
+            )
+            if len(matches) == 0:
+                raise Exception(
+                    f"Unknown processor '{processor_name}', available processors: {self.get_processor_names()}"
                 )
-                for _, c in clsmembers:
-                    # Only add classes that are a sub class of Processor, but NOT Processor itself
-                    if issubclass(c, Processor) & (c is not Processor):
-                        self.processors[c.__name__] = c
-                        loaded_packages.append(c.__name__)
+            processor = next(iter(matches)).load()
+
+        # Only sub classes of Processor, but NOT Processor itself
+        if not (
+            inspect.isclass(processor)
+            and issubclass(processor, Processor)
+            and processor is not Processor
+        ):
+            raise Exception(f"'{processor_name}' is not a Processor: {processor}")
+        logger.info(f"Loaded processor: {processor_name}")
+        return processor
 
-        logger.info(f"Loaded processors: {loaded_packages}")
+    def get_processor_names(self):
+        return sorted(
+            set(self.processor_modules)
+            | {
+                entry_point.name
+                for entry_point in entry_points(group=PROCESSOR_ENTRY_POINT_GROUP)
+            }
+        )
 
 
 # Singleton export
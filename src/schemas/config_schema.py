@@ -40,6 +40,25 @@ CONFIG_SCHEMA = {
                 "max_steps": {"type": "integer", "minimum": 1, "maximum": 100},
                 "stride": {"type": "integer", "minimum": 1, "maximum": 10},
                 "thickness": {"type": "integer", "minimum": 1, "maximum": 10},
+                "morph_downscale": {"type": "integer", "minimum": 1, "maximum": 8},
+            },
+        },
+        "cascade_params": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "enabled": {"type": "boolean"},
+                "downscale": {"type": "integer", "minimum": 1, "maximum": 8},
+                "min_confidence": {"type": "number", "minimum": 0, "maximum": 255},
+            },
+        },
+        "preprocessing_params": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "compose_warps": {"type": "boolean"},
+                "min_decode_oversampling": {"type": "number", "minimum": 1},
+                "reduced_decode": {"type": "boolean"},
             },
         },
         "outputs": {
@@ -68,15 +68,9 @@ TEMPLATE_SCHEMA = {
                 "type": "object",
                 "properties": {
                     "name": {
+                        # Note: builtin processors are listed in
+                        # src.processors.manager, others come from entry points
                         "type": "string",
-                        "enum": [
-                            "CropOnMarkers",
-                            "CropPage",
-                            "FeatureBasedAlignment",
-                            "GaussianBlur",
-                            "Levels",
-                            "MedianBlur",
-                        ],
                     },
                 },
                 "required": ["name", "options"],
@@ -90,8 +84,36 @@ TEMPLATE_SCHEMA = {
                                     "additionalProperties": False,
                                     "properties": {
                                         "apply_erode_subtract": {"type": "boolean"},
+                                        "fallback_ladder": {
+                                            "description": "Opt-in: searches tried in order when the configured marker search fails, e.g. wider_scales, toggle_erode_subtract, crop_page",
+                                            "type": "array",
+                                            "items": {
+                                                "type": "string",
+                                                "enum": [
+                                                    "wider_scales",
+                                                    "toggle_erode_subtract",
+                                                    "crop_page",
+                                                ],
+                                            },
+                                        },
+                                        "fixed_geometry": {"type": "boolean"},
+                                        "learn_corner_windows": {"type": "boolean"},
+                                        "marker_corner_window": {
+                                            "type": "number",
+                                            "exclusiveMinimum": 0,
+                                            "maximum": 0.5,
+                                        },
+                                        "marker_pyramid_downscale": {
+                                            "type": "integer",
+                                            "minimum": 1,
+                                            "maximum": 8,
+                                        },
                                         "marker_rescale_range": two_positive_numbers,
                                         "marker_rescale_steps": {"type": "number"},
+                                        "marker_warm_start": {
+                                            "description": "Opt-in: try the marker scale of the previous sheet first. Results then depend on the order of the sheets",
+                                            "type": "boolean",
+                                        },
                                         "max_matching_variation": {"type": "number"},
                                         "min_matching_threshold": {"type": "number"},
                                         "relativePath": {"type": "string"},
@@ -115,6 +137,16 @@ TEMPLATE_SCHEMA = {
                                         "2d": {"type": "boolean"},
                                         "goodMatchPercent": {"type": "number"},
                                         "maxFeatures": {"type": "integer"},
+                                        "orbDownscale": {
+                                            "type": "integer",
+                                            "minimum": 1,
+                                            "maximum": 8,
+                                        },
+                                        "ratioTest": {
+                                            "type": "number",
+                                            "exclusiveMinimum": 0,
+                                            "maximum": 1,
+                                        },
                                         "reference": {"type": "string"},
                                     },
                                     "required": ["reference"],
@@ -150,6 +182,36 @@ TEMPLATE_SCHEMA = {
                             }
                         },
                     },
+                    {
+                        "if": {
+                            "properties": {
+                                "name": {"const": "PhaseCorrelationAlignment"}
+                            }
+                        },
+                        "then": {
+                            "properties": {
+                                "options": {
+                                    "type": "object",
+                                    "additionalProperties": False,
+                                    "properties": {
+                                        "downscale": {
+                                            "type": "integer",
+                                            "minimum": 1,
+                                            "maximum": 8,
+                                        },
+                                        "minResponse": {
+                                            "type": "number",
+                                            "minimum": 0,
+                                            "maximum": 1,
+                                        },
+                                        "reference": {"type": "string"},
+                                        "rotation": {"type": "boolean"},
+                                    },
+                                    "required": ["reference"],
+                                }
+                            }
+                        },
+                    },
                     {
                         "if": {"properties": {"name": {"const": "GaussianBlur"}}},
                         "then": {
@@ -173,7 +235,14 @@ TEMPLATE_SCHEMA = {
                                     "type": "object",
                                     "additionalProperties": False,
                                     "properties": {
-                                        "morphKernel": two_positive_integers
+                                        "detectionDownscale": {
+                                            "description": "Reduction of the page contour search, applies to images of at least 1000 px in width i.e. processing_width",
+                                            "type": "integer",
+                                            "minimum": 1,
+                                            "maximum": 8,
+                                        },
+                                        "fixed_geometry": {"type": "boolean"},
+                                        "morphKernel": two_positive_integers,
                                     },
                                 }
                             }
@@ -6,9 +6,12 @@
  Github: https://github.com/Udayraj123
 
 """
+import numpy as np
+
 from src.constants import FIELD_TYPES
 from src.core import ImageInstanceOps
 from src.logger import logger
+from src.processors.builtins import fuse_pointwise_pre_processors
 from src.processors.manager import PROCESSOR_MANAGER
 from src.utils.parsing import (
     custom_sort_output_columns,
@@ -16,6 +19,9 @@ from src.utils.parsing import (
     parse_fields,
 )
 
+# Room left around the template ROI for the edge effects of the alignment morphology
+ROI_MORPH_PADDING = 16
+
 
 class Template:
     def __init__(self, template_path, tuning_config):
@@ -61,6 +67,8 @@ class Template:
 
         self.validate_template_columns(non_custom_columns, all_custom_columns)
 
+        self.compiled = CompiledTemplate(self)
+
     def parse_output_columns(self, output_columns_array):
         self.output_columns = parse_fields(f"Output Columns", output_columns_array)
 
@@ -68,13 +76,14 @@ class Template:
         # load image pre_processors
         self.pre_processors = []
         for pre_processor in pre_processors_object:
-            ProcessorClass = PROCESSOR_MANAGER.processors[pre_processor["name"]]
+            ProcessorClass = PROCESSOR_MANAGER.get_processor(pre_processor["name"])
             pre_processor_instance = ProcessorClass(
                 options=pre_processor["options"],
                 relative_dir=relative_dir,
                 image_instance_ops=self.image_instance_ops,
             )
             self.pre_processors.append(pre_processor_instance)
+        self.pre_processors = fuse_pointwise_pre_processors(self.pre_processors)
 
     def setup_field_blocks(self, field_blocks_object):
         # Add field_blocks
@@ -209,10 +218,218 @@ class Template:
         return str(self.path)
 
 
+class CompiledTemplate:
+    """
+    Struct-of-arrays view of a parsed Template
+
+    Every bubble of the template is one entry in flat NumPy arrays, in the same order
+    as traversing field_blocks -> traverse_bubbles -> bubbles. Fields (question strips)
+    and field blocks are contiguous ranges of these arrays, given by their offsets.
+    This lets the per-sheet stages run as array operations instead of walking the
+    object graph for every sheet.
+    """
+
+    def __init__(self, template):
+        self.page_dimensions = template.page_dimensions
+        field_blocks = template.field_blocks
+
+        bubble_x, bubble_y, bubble_w, bubble_h = [], [], [], []
+        bubble_values, bubble_field_index, bubble_value_index = [], [], []
+        bubble_block_index = []
+        self.field_labels, self.field_empty_values, field_block_index = [], [], []
+        field_offsets, block_field_offsets, self.block_shapes = [0], [0], []
+        for block_index, field_block in enumerate(field_blocks):
+            box_w, box_h = field_block.bubble_dimensions
+            for field_bubbles in field_block.traverse_bubbles:
+                field_index = len(self.field_labels)
+                for value_index, bubble in enumerate(field_bubbles):
+                    bubble_x.append(bubble.x)
+                    bubble_y.append(bubble.y)
+                    bubble_w.append(int(box_w))
+                    bubble_h.append(int(box_h))
+                    bubble_values.append(bubble.field_value)
+                    bubble_field_index.append(field_index)
+                    bubble_value_index.append(value_index)
+                    bubble_block_index.append(block_index)
+                self.field_labels.append(field_bubbles[0].field_label)
+                self.field_empty_values.append(field_block.empty_val)
+                field_block_index.append(block_index)
+                field_offsets.append(len(bubble_x))
+            block_field_offsets.append(len(self.field_labels))
+            fields_count = len(field_block.traverse_bubbles)
+            self.block_shapes.append(
+                (
+                    fields_count,
+                    len(field_block.traverse_bubbles[0]) if fields_count > 0 else 0,
+                )
+            )
+
+        # Per bubble
+        self.bubble_x = np.array(bubble_x, dtype=np.int64)
+        self.bubble_y = np.array(bubble_y, dtype=np.int64)
+        self.bubble_w = np.array(bubble_w, dtype=np.int64)
+        self.bubble_h = np.array(bubble_h, dtype=np.int64)
+        self.bubble_values = np.array(bubble_values, dtype=object)
+        self.bubble_field_index = np.array(bubble_field_index, dtype=np.int64)
+        self.bubble_value_index = np.array(bubble_value_index, dtype=np.int64)
+        self.bubble_block_index = np.array(bubble_block_index, dtype=np.int64)
+
+        # Per field (question strip)
+        self.field_offsets = np.array(field_offsets, dtype=np.int64)
+        self.field_block_index = np.array(field_block_index, dtype=np.int64)
+        self.field_lengths = np.diff(self.field_offsets)
+        # (fields, max_length) layout of bubble indices for strip-wise kernels
+        max_field_length = int(self.field_lengths.max(initial=0))
+        value_positions = np.arange(max_field_length)
+        self.field_padding_mask = value_positions < self.field_lengths[:, np.newaxis]
+        self.field_padded_indices = np.where(
+            self.field_padding_mask,
+            self.field_offsets[:-1, np.newaxis] + value_positions,
+            0,
+        )
+
+        # Per field block
+        self.block_field_offsets = np.array(block_field_offsets, dtype=np.int64)
+        self.block_bubble_offsets = self.field_offsets[self.block_field_offsets]
+        self.block_names = [field_block.name for field_block in field_blocks]
+        self.block_origins = np.array(
+            [field_block.origin for field_block in field_blocks], dtype=np.int64
+        ).reshape(-1, 2)
+        self.block_dimensions = np.array(
+            [field_block.dimensions for field_block in field_blocks], dtype=np.int64
+        ).reshape(-1, 2)
+
+        # Label maps for concatenation and output
+        self.label_to_field_index = {
+            field_label: field_index
+            for field_index, field_label in enumerate(self.field_labels)
+        }
+        self.custom_label_field_indices = {
+            custom_label: np.array(
+                [self.label_to_field_index[label] for label in field_labels],
+                dtype=np.int64,
+            )
+            for custom_label, field_labels in template.custom_labels.items()
+        }
+        self.non_custom_field_indices = [
+            (field_label, self.label_to_field_index[field_label])
+            for field_label in template.non_custom_labels
+        ]
+
+        # Page region that is ever read: (x0, y0, x1, y1)
+        self.roi = self.get_roi(
+            template.image_instance_ops.tuning_config.alignment_params
+        )
+
+    def get_roi(self, alignment_params):
+        """Union box of all field blocks and bubbles, grown by the alignment margin"""
+        page_width, page_height = self.page_dimensions
+        if self.bubbles_count == 0:
+            return 0, 0, page_width, page_height
+        margin = 0
+        if alignment_params.auto_align:
+            # Reach of the shifted edge windows in get_field_block_shifts
+            margin = (
+                alignment_params.max_steps * alignment_params.stride
+                + alignment_params.match_col
+                + alignment_params.thickness
+                + ROI_MORPH_PADDING * alignment_params.get("morph_downscale", 1)
+            )
+        block_ends = self.block_origins + self.block_dimensions
+        x0 = min(self.bubble_x.min(), self.block_origins[:, 0].min()) - margin
+        y0 = min(self.bubble_y.min(), self.block_origins[:, 1].min()) - margin
+        x1 = max((self.bubble_x + self.bubble_w).max(), block_ends[:, 0].max()) + margin
+        y1 = max((self.bubble_y + self.bubble_h).max(), block_ends[:, 1].max()) + margin
+        return (
+            int(max(x0, 0)),
+            int(max(y0, 0)),
+            int(min(x1, page_width)),
+            int(min(y1, page_height)),
+        )
+
+    @property
+    def bubbles_count(self):
+        return len(self.bubble_x)
+
+    @property
+    def fields_count(self):
+        return len(self.field_labels)
+
+    def get_shifted_bubble_x(self, block_shifts):
+        return self.bubble_x + np.asarray(block_shifts)[self.bubble_block_index]
+
+    def split_by_field(self, bubble_array):
+        """Splits a per-bubble array (last axis) into a list of per-field arrays"""
+        return np.split(bubble_array, self.field_offsets[1:-1], axis=-1)
+
+    def get_scaled_bubble_boxes(self, scale_x, scale_y):
+        """Bubble boxes (x, y, w, h) on a page resized by the given factors"""
+        return (
+            np.round(self.bubble_x * scale_x).astype(np.int64),
+            np.round(self.bubble_y * scale_y).astype(np.int64),
+            np.maximum(np.round(self.bubble_w * scale_x), 1).astype(np.int64),
+            np.maximum(np.round(self.bubble_h * scale_y), 1).astype(np.int64),
+        )
+
+    def pad_by_field(self, bubble_array, fill_value=np.inf):
+        """Lays out a per-bubble array (last axis) as padded (..., fields, max_length)"""
+        return np.where(
+            self.field_padding_mask,
+            bubble_array[..., self.field_padded_indices],
+            fill_value,
+        )
+
+    def get_field_confidences(self, bubble_means, field_thresholds):
+        """Gap between each field threshold and the bubble mean nearest to it"""
+        gaps = np.abs(
+            self.pad_by_field(bubble_means) - field_thresholds[..., np.newaxis]
+        )
+        return np.min(gaps, axis=-1)
+
+    def get_field_std_devs(self, bubble_means):
+        # Note: uniform field blocks are reshaped to 2D so that np.std reduces
+        # exactly like it would on each field separately
+        field_std_devs = []
+        for (start, end), block_shape in zip(
+            zip(self.block_bubble_offsets[:-1], self.block_bubble_offsets[1:]),
+            self.block_shapes,
+        ):
+            block_means = bubble_means[..., start:end].reshape(
+                bubble_means.shape[:-1] + block_shape
+            )
+            field_std_devs.append(np.round(np.std(block_means, axis=-1), 2))
+        return np.concatenate(field_std_devs, axis=-1)
+
+    def get_field_responses(self, bubbles_marked):
+        """Concatenates the marked bubble values of each field, or its empty value"""
+        marked_counts = np.add.reduceat(
+            bubbles_marked.astype(np.int64), self.field_offsets[:-1]
+        )
+        field_responses = [
+            "".join(field_values[field_marked]) if marked_count > 0 else empty_val
+            for field_values, field_marked, marked_count, empty_val in zip(
+                self.split_by_field(self.bubble_values),
+                self.split_by_field(bubbles_marked),
+                marked_counts,
+                self.field_empty_values,
+            )
+        ]
+        return field_responses, marked_counts
+
+    def get_concatenated_response(self, field_responses):
+        # Multi-column/multi-row questions which need to be concatenated
+        concatenated_response = {
+            custom_label: "".join([field_responses[i] for i in field_indices])
+            for custom_label, field_indices in self.custom_label_field_indices.items()
+        }
+        for field_label, field_index in self.non_custom_field_indices:
+            concatenated_response[field_label] = field_responses[field_index]
+        return concatenated_response
+
+
 class FieldBlock:
     def __init__(self, block_name, field_block_object):
         self.name = block_name
-        self.shift = 0
         self.setup_field_block(field_block_object)
 
     def setup_field_block(self, field_block_object):
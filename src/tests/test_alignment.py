@@ -0,0 +1,223 @@
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+
+from src.core import ImageInstanceOps
+
+from src.processors.manager import PROCESSOR_MANAGER
+from src.tests.utils import (
+    SAMPLE2_PATH,
+    load_sample2_template,
+    load_template_and_image,
+    setup_mocker_patches,
+)
+
+
+def test_phase_correlation_recovers_shift_and_rotation(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    aligner = PROCESSOR_MANAGER.get_processor("PhaseCorrelationAlignment")(
+        options={"reference": "sample.jpg", "rotation": True, "downscale": 2},
+        relative_dir=SAMPLE2_PATH,
+        image_instance_ops=template.image_instance_ops,
+    )
+    ref_img = aligner.ref_img
+    height, width = ref_img.shape
+    sheet_transform = cv2.getRotationMatrix2D((width / 2, height / 2), 2.0, 1.0)
+    sheet_transform[:, 2] += (15, -10)
+    sheet = cv2.warpAffine(ref_img, sheet_transform, (width, height), borderValue=255)
+
+    transform, dimensions = aligner.get_transform(sheet, "sheet.jpg", None)
+
+    assert dimensions == (width, height)
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    expected = cv2.transform(corners[None], cv2.invertAffineTransform(sheet_transform))
+    aligned = cv2.perspectiveTransform(corners[None], transform)
+    assert np.abs(aligned - expected).max() < 2
+
+
+def test_phase_correlation_rejects_unrelated_images(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    options = {"reference": "sample.jpg", "rotation": True}
+    aligner = PROCESSOR_MANAGER.get_processor("PhaseCorrelationAlignment")(
+        options=options,
+        relative_dir=SAMPLE2_PATH,
+        image_instance_ops=template.image_instance_ops,
+    )
+    height, width = aligner.ref_img.shape
+    noise = np.random.default_rng(0).integers(0, 256, (height, width), np.uint8)
+
+    assert aligner.get_transform(noise, "noise.jpg", None) is None
+    assert aligner.apply_filter(noise, "noise.jpg", None) is None
+
+    lenient_aligner = PROCESSOR_MANAGER.get_processor("PhaseCorrelationAlignment")(
+        options={**options, "minResponse": 0},
+        relative_dir=SAMPLE2_PATH,
+        image_instance_ops=template.image_instance_ops,
+    )
+    assert lenient_aligner.get_transform(noise, "noise.jpg", None) is not None
+
+
+def load_feature_aligner(template, **options):
+    return PROCESSOR_MANAGER.get_processor("FeatureBasedAlignment")(
+        options={"reference": "sample.jpg", **options},
+        relative_dir=SAMPLE2_PATH,
+        image_instance_ops=template.image_instance_ops,
+    )
+
+
+@pytest.mark.parametrize("orb_downscale", [1, 2])
+def test_feature_alignment_recovers_homography(mocker, tmp_path, orb_downscale):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    aligner = load_feature_aligner(
+        template, maxFeatures=2000, orbDownscale=orb_downscale
+    )
+    ref_img = aligner.ref_img
+    height, width = ref_img.shape
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    # A slightly rotated, scaled and tilted sheet
+    sheet_corners = corners + np.float32([[20, 12], [-8, 25], [-25, -10], [10, -18]])
+    sheet_transform = cv2.getPerspectiveTransform(corners, sheet_corners)
+    sheet = cv2.warpPerspective(
+        ref_img, sheet_transform, (width, height), borderValue=255
+    )
+
+    transform, dimensions = aligner.get_transform(sheet, "sheet.jpg", None)
+
+    assert dimensions == (width, height)
+    aligned = cv2.perspectiveTransform(sheet_corners[None], transform)
+    assert np.abs(aligned - corners).max() < 3
+
+
+@pytest.mark.parametrize("transform_2_d", [False, True])
+def test_feature_alignment_rejects_images_without_features(
+    mocker, tmp_path, transform_2_d
+):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    aligner = load_feature_aligner(template, **{"2d": transform_2_d})
+    height, width = aligner.ref_img.shape
+    blank = np.full((height, width), 255, np.uint8)
+    rng = np.random.default_rng(0)
+    noises = [rng.integers(0, 256, (height, width), np.uint8) for _ in range(3)]
+
+    for image in [blank, *noises]:
+        assert aligner.get_transform(image, "sheet.jpg", None) is None
+        assert aligner.apply_filter(image, "sheet.jpg", None) is None
+
+
+def loop_field_block_shifts(template, morph_v, alignment_params, roi_origin=(0, 0)):
+    # The np.mean probing loop the prefix sums replaced
+    match_col, max_steps, align_stride, thk = map(
+        alignment_params.get, ["match_col", "max_steps", "stride", "thickness"]
+    )
+    block_shifts = []
+    for field_block in template.field_blocks:
+        s = np.array(field_block.origin) - roi_origin
+        d = field_block.dimensions
+        shift, steps = 0, 0
+        while steps < max_steps:
+            left_mean = np.mean(
+                morph_v[
+                    s[1] : s[1] + d[1],
+                    s[0] + shift - thk : -thk + s[0] + shift + match_col,
+                ]
+            )
+            right_mean = np.mean(
+                morph_v[
+                    s[1] : s[1] + d[1],
+                    s[0] + shift - match_col + d[0] + thk : thk + s[0] + shift + d[0],
+                ]
+            )
+            left_shift, right_shift = left_mean > 100, right_mean > 100
+            if left_shift:
+                if right_shift:
+                    break
+                else:
+                    shift -= align_stride
+            else:
+                if right_shift:
+                    shift += align_stride
+                else:
+                    break
+            steps += 1
+        block_shifts.append(shift)
+    return block_shifts
+
+
+def assert_same_shifts(template, morph_v, roi_origin=(0, 0)):
+    image_instance_ops = template.image_instance_ops
+    alignment_params = image_instance_ops.tuning_config.alignment_params
+    with warnings.catch_warnings():
+        # Note: np.mean of the empty windows past the edges warns
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expected = loop_field_block_shifts(
+            template, morph_v, alignment_params, np.array(roi_origin)
+        )
+    shifts = image_instance_ops.get_field_block_shifts(
+        template, morph_v, np.array(roi_origin)
+    )
+    assert shifts == expected
+    return shifts
+
+
+@pytest.mark.parametrize("morph_downscale", [1, 2, 3])
+def test_field_block_shifts_match_probing_loop(mocker, tmp_path, morph_downscale):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    image_instance_ops.tuning_config.alignment_params.morph_downscale = morph_downscale
+    page_width, page_height = template.page_dimensions
+    in_omr = cv2.resize(in_omr, (page_width, page_height))
+    # Shift the sheet so that the blocks have columns to walk to
+    in_omr = np.roll(in_omr, 7, axis=1)
+
+    morph_v = image_instance_ops.get_vertical_morph(in_omr)
+    assert morph_v.shape == in_omr.shape
+    assert_same_shifts(template, morph_v)
+
+
+def test_field_block_shifts_match_probing_loop_at_edges(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template = load_sample2_template(tmp_path)
+    alignment_params = template.image_instance_ops.tuning_config.alignment_params
+    page_width, page_height = template.page_dimensions
+    rng = np.random.default_rng(0)
+    first_origin = np.array(template.field_blocks[0].origin)
+    walked = False
+    for stride, max_steps in ((1, 20), (2, 7), (3, 30)):
+        alignment_params.stride, alignment_params.max_steps = stride, max_steps
+        for _ in range(20):
+            # Random bright columns, the walks stop at different shifts
+            columns = (rng.random(page_width) < rng.uniform(0.1, 0.6)) * 255
+            morph_v = np.tile(columns.astype(np.uint8), (page_height, 1))
+            walked |= any(assert_same_shifts(template, morph_v))
+            # Windows before the left edge of the ROI and past its right edge
+            assert_same_shifts(template, morph_v[:, : page_width // 2])
+            assert_same_shifts(template, morph_v, roi_origin=first_origin)
+            assert_same_shifts(template, morph_v, roi_origin=first_origin + (2, 0))
+    assert walked
+
+
+def test_column_window_means_match_np_mean():
+    rng = np.random.default_rng(0)
+    block_rows = rng.integers(0, 256, (9, 40))
+    column_sums = np.zeros(block_rows.shape[1] + 1, dtype=np.int64)
+    np.cumsum(block_rows.sum(axis=0), out=column_sums[1:])
+    starts = rng.integers(-50, 50, 500)
+    ends = starts + rng.integers(-5, 20, 500)
+
+    means = ImageInstanceOps.get_column_window_means(
+        column_sums, block_rows.shape[0], starts, ends
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expected = [
+            np.mean(block_rows[:, start:end]) for start, end in zip(starts, ends)
+        ]
+    np.testing.assert_allclose(means, expected, rtol=1e-12)
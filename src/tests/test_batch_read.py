@@ -0,0 +1,29 @@
+import numpy as np
+
+from src.tests.utils import load_template_and_image, setup_mocker_patches
+
+
+def test_batch_read_matches_single_reads(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+
+    # A second, blank sheet in the same stack
+    blank_omr = np.full_like(in_omr, 255)
+    single_responses, single_multi_marked = [], []
+    for image in [in_omr, blank_omr]:
+        response_dict, _, multi_marked, _ = image_instance_ops.read_omr_response(
+            template, image=image, name="sample.jpg", save_dir=None
+        )
+        single_responses.append(response_dict)
+        single_multi_marked.append(bool(multi_marked))
+
+    (
+        omr_responses,
+        field_thresholds,
+        multi_marked,
+    ) = image_instance_ops.read_omr_response_batch(template, [in_omr, blank_omr])
+
+    assert omr_responses == single_responses
+    assert multi_marked.tolist() == single_multi_marked
+    assert field_thresholds.shape == (2, template.compiled.fields_count)
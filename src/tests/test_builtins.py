@@ -0,0 +1,32 @@
+from src.processors.builtins import fuse_pointwise_pre_processors
+from src.processors.manager import PROCESSOR_MANAGER
+from src.tests.utils import SAMPLE2_PATH, load_template_and_image, setup_mocker_patches
+
+
+def test_fused_lookup_tables_match_sequential_filters(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(tmp_path)
+    processor_options = [
+        ("Levels", {"low": 0.1, "high": 0.9, "gamma": 0.5}),
+        ("Levels", {"gamma": 1.7}),
+        ("MedianBlur", {"kSize": 3}),
+        ("Levels", {"low": 0.2}),
+    ]
+    pre_processors = [
+        PROCESSOR_MANAGER.get_processor(name)(
+            options=options,
+            relative_dir=SAMPLE2_PATH,
+            image_instance_ops=template.image_instance_ops,
+        )
+        for name, options in processor_options
+    ]
+    fused_pre_processors = fuse_pointwise_pre_processors(pre_processors)
+
+    sequential_omr, fused_omr = in_omr.copy(), in_omr.copy()
+    for pre_processor in pre_processors:
+        sequential_omr = pre_processor.apply_filter(sequential_omr, None, None)
+    for pre_processor in fused_pre_processors:
+        fused_omr = pre_processor.apply_filter(fused_omr, None, None)
+
+    assert len(fused_pre_processors) == 3
+    assert (fused_omr == sequential_omr).all()
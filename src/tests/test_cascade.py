@@ -0,0 +1,24 @@
+from src.core import ProcessingContext
+from src.tests.utils import load_template_and_image, setup_mocker_patches
+
+
+def test_cascade_matches_full_read(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    tuning_config = image_instance_ops.tuning_config
+
+    full_response, _, full_bubble_stats = image_instance_ops.read_omr_response_headless(
+        template, in_omr, ProcessingContext()
+    )
+    tuning_config.cascade_params.enabled = True
+    tuning_config.cascade_params.min_confidence = 0
+    reduced_response, _, bubble_stats = image_instance_ops.read_omr_response_headless(
+        template, in_omr, ProcessingContext()
+    )
+
+    assert reduced_response == full_response
+    assert full_bubble_stats.field_confidences.shape == (
+        template.compiled.fields_count,
+    )
+    assert bubble_stats.field_confidences.min() > 0
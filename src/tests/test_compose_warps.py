@@ -0,0 +1,30 @@
+import cv2
+
+from src.core import ProcessingContext
+from src.tests.utils import (
+    SAMPLE2_IMAGE_PATH,
+    load_template_and_image,
+    setup_mocker_patches,
+)
+
+
+def test_composed_warps_match_sequential_warps(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    raw_omr = cv2.imread(str(SAMPLE2_IMAGE_PATH), cv2.IMREAD_GRAYSCALE)
+
+    image_instance_ops.tuning_config.preprocessing_params.compose_warps = True
+    composed_omr = image_instance_ops.apply_preprocessors(
+        SAMPLE2_IMAGE_PATH, raw_omr, template, ProcessingContext()
+    )
+    composed_response, _, _ = image_instance_ops.read_omr_response_headless(
+        template, composed_omr, ProcessingContext()
+    )
+    sequential_response, _, _ = image_instance_ops.read_omr_response_headless(
+        template, in_omr, ProcessingContext()
+    )
+
+    page_width, page_height = template.page_dimensions
+    assert composed_omr.shape == (page_height, page_width)
+    assert composed_response == sequential_response
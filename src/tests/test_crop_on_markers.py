@@ -0,0 +1,236 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.core import ProcessingContext
+from src.processors.CropOnMarkers import (
+    CORNER_WINDOW_WARMUP,
+    WARM_START_TOLERANCE,
+    CropOnMarkers,
+    get_quad_executor,
+)
+from src.tests.test_samples.sample2.boilerplate import TEMPLATE_BOILERPLATE
+from src.tests.utils import (
+    SAMPLE2_IMAGE_PATH,
+    load_sample2_template,
+    setup_mocker_patches,
+)
+from src.utils.image import ImageUtils
+
+
+@pytest.fixture
+def load_crop_on_markers(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+
+    def load_crop_on_markers(**options):
+        (pre_processor,) = TEMPLATE_BOILERPLATE["preProcessors"]
+        template = load_sample2_template(
+            tmp_path,
+            template_boilerplate={
+                **TEMPLATE_BOILERPLATE,
+                "preProcessors": [
+                    {
+                        **pre_processor,
+                        "options": {**pre_processor["options"], **options},
+                    }
+                ],
+            },
+        )
+        (crop_on_markers,) = template.pre_processors
+        return crop_on_markers
+
+    return load_crop_on_markers
+
+
+def get_sheet(crop_on_markers):
+    dimensions = crop_on_markers.tuning_config.dimensions
+    return ImageUtils.resize_util(
+        cv2.imread(str(SAMPLE2_IMAGE_PATH), cv2.IMREAD_GRAYSCALE),
+        dimensions.processing_width,
+        dimensions.processing_height,
+    )
+
+
+def locate_centres(crop_on_markers, sheet):
+    # Note: the markers are drawn on the searched image, search a copy
+    located = crop_on_markers.locate_markers(
+        sheet.copy(), "sheet.jpg", ProcessingContext()
+    )
+    assert located is not None
+    return np.array(located[1])
+
+
+def record_searches(mocker, crop_on_markers):
+    # Names of the searches run, with whether each found the markers
+    searches = []
+    find_markers = crop_on_markers.find_markers
+
+    def recorded_find_markers(image, file_path, search):
+        found = find_markers(image, file_path, search)
+        searches.append((search.name, found is not None))
+        return found
+
+    mocker.patch.object(crop_on_markers, "find_markers", recorded_find_markers)
+    return searches
+
+
+def test_warm_start_reuses_the_last_scale(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers(marker_warm_start=True)
+    sheet = get_sheet(crop_on_markers)
+    centres = locate_centres(crop_on_markers, sheet)
+    assert crop_on_markers.last_best_index is not None
+
+    match_scales = mocker.spy(crop_on_markers, "match_scales")
+    assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+
+    # Only the last best scale and its neighbours were matched
+    (call,) = match_scales.call_args_list
+    assert len(call.args[2]) <= 3
+
+
+def test_warm_start_is_opt_in(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers()
+    sheet = get_sheet(crop_on_markers)
+    centres = locate_centres(crop_on_markers, sheet)
+
+    # Every sheet sweeps all scales, whatever was read before it
+    match_scales = mocker.spy(crop_on_markers, "match_scales")
+    assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+    (call,) = match_scales.call_args_list
+    assert list(call.args[2]) == list(range(len(crop_on_markers.rescaled_markers)))
+
+
+def test_warm_start_is_dropped_below_the_learned_norm(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers(marker_warm_start=True)
+    sheet = get_sheet(crop_on_markers)
+    centres = locate_centres(crop_on_markers, sheet)
+    match_norm = crop_on_markers.match_norm
+    match_scales = mocker.spy(crop_on_markers, "match_scales")
+
+    # Within the tolerance of the learned norm, the warm start is kept
+    crop_on_markers.match_norm = match_norm + WARM_START_TOLERANCE - 0.01
+    assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+    assert len(match_scales.call_args_list) == 1
+
+    # Beyond it, every scale is swept again
+    match_scales.reset_mock()
+    crop_on_markers.match_norm = match_norm + WARM_START_TOLERANCE + 0.01
+    assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+    warm_call, sweep_call = match_scales.call_args_list
+    assert list(sweep_call.args[2]) == list(
+        range(len(crop_on_markers.rescaled_markers))
+    )
+
+
+@pytest.mark.parametrize("pyramid_downscale", [2, 4])
+def test_pyramid_search_matches_full_resolution_search(
+    mocker, load_crop_on_markers, pyramid_downscale
+):
+    crop_on_markers = load_crop_on_markers()
+    sheet = get_sheet(crop_on_markers)
+    centres = locate_centres(crop_on_markers, sheet)
+
+    pyramid_crop_on_markers = load_crop_on_markers(
+        marker_pyramid_downscale=pyramid_downscale
+    )
+    searches = record_searches(mocker, pyramid_crop_on_markers)
+    pyramid_centres = locate_centres(pyramid_crop_on_markers, sheet)
+
+    # Found by the pyramid itself, not by a fallback search
+    assert searches == [("narrow", True)]
+    assert np.abs(pyramid_centres - centres).max() <= 1
+
+
+def test_marker_searches_share_one_thread_pool(load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers()
+    quad_executor = get_quad_executor()
+    locate_centres(crop_on_markers, get_sheet(crop_on_markers))
+    locate_centres(load_crop_on_markers(), get_sheet(crop_on_markers))
+    assert get_quad_executor() is quad_executor
+    assert not hasattr(crop_on_markers, "quad_executor")
+
+
+def test_learned_corner_windows_after_warmup(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers(learn_corner_windows=True)
+    sheet = get_sheet(crop_on_markers)
+    _, quads = CropOnMarkers.get_eroded_sub_and_quads(sheet.copy(), True)
+    find_marker = mocker.spy(crop_on_markers, "find_marker")
+
+    centres = locate_centres(crop_on_markers, sheet)
+    for _ in range(CORNER_WINDOW_WARMUP - 1):
+        assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+    # Whole quads are searched until enough sheets were seen
+    assert {call.args[1] for call in find_marker.call_args_list} == set(quads)
+
+    find_marker.reset_mock()
+    assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+    regions = [call.args[1] for call in find_marker.call_args_list]
+    assert len(regions) == 4
+    for (x0, y0, x1, y1), (quad_x0, quad_y0, quad_x1, quad_y1) in zip(regions, quads):
+        assert (x1 - x0) * (y1 - y0) < (quad_x1 - quad_x0) * (quad_y1 - quad_y0) / 4
+
+
+def test_declared_corner_window(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers()
+    sheet = get_sheet(crop_on_markers)
+    centres = locate_centres(crop_on_markers, sheet)
+
+    window_crop_on_markers = load_crop_on_markers(marker_corner_window=0.3)
+    find_marker = mocker.spy(window_crop_on_markers, "find_marker")
+    assert np.array_equal(locate_centres(window_crop_on_markers, sheet), centres)
+    _, quads = CropOnMarkers.get_eroded_sub_and_quads(sheet.copy(), True)
+    regions = [call.args[1] for call in find_marker.call_args_list]
+    assert len(regions) == 4 and not set(regions) & set(quads)
+
+
+def test_fallback_ladder_finds_a_scaled_sheet(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers(
+        fallback_ladder=["wider_scales", "toggle_erode_subtract", "crop_page"]
+    )
+    sheet = get_sheet(crop_on_markers)
+    centres = locate_centres(crop_on_markers, sheet)
+
+    # The sheet at 55% of its size in the middle of a blank page, its markers are
+    # smaller than the configured marker_rescale_range
+    scale, (height, width) = 0.55, sheet.shape
+    offset = np.array([width * (1 - scale) / 2, height * (1 - scale) / 2])
+    sheet_transform = np.hstack([np.eye(2) * scale, offset[:, np.newaxis]])
+    scaled_sheet = cv2.warpAffine(
+        sheet, sheet_transform, (width, height), borderValue=255
+    )
+
+    searches = record_searches(mocker, crop_on_markers)
+    scaled_centres = locate_centres(crop_on_markers, scaled_sheet)
+
+    assert searches == [("narrow", False), ("wider_scales", True)]
+    assert np.abs(scaled_centres - (centres * scale + offset)).max() < 3
+
+
+def test_fallback_ladder_is_opt_in(load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers()
+
+    assert [search.name for search in crop_on_markers.marker_searches] == ["narrow"]
+
+
+def test_fixed_geometry_falls_back_to_a_full_search(mocker, load_crop_on_markers):
+    crop_on_markers = load_crop_on_markers(fixed_geometry=True)
+    sheet = get_sheet(crop_on_markers)
+    searches = record_searches(mocker, crop_on_markers)
+
+    centres = locate_centres(crop_on_markers, sheet)
+    assert searches == [("narrow", True)]
+    # Same sheet again: matched at the cached positions only
+    assert np.array_equal(locate_centres(crop_on_markers, sheet), centres)
+    assert searches == [("narrow", True)]
+
+    # Moved further than the cached windows reach
+    shift = np.array([30, 20])
+    moved_sheet = cv2.warpAffine(
+        sheet,
+        np.float32([[1, 0, shift[0]], [0, 1, shift[1]]]),
+        sheet.shape[::-1],
+        borderValue=255,
+    )
+    moved_centres = locate_centres(crop_on_markers, moved_sheet)
+    assert searches == [("narrow", True), ("narrow", True)]
+    assert np.abs(moved_centres - (centres + shift)).max() <= 1
@@ -0,0 +1,64 @@
+from copy import deepcopy
+
+import cv2
+import numpy as np
+import pytest
+
+from src.core import ImageInstanceOps
+from src.defaults import CONFIG_DEFAULTS
+from src.processors.manager import PROCESSOR_MANAGER
+from src.utils.image import ImageUtils
+
+
+def get_rotated_page(width=2400, height=3000, angle=4):
+    """Returns a scan of a page rotated on a dark background, and its corners"""
+    page_w, page_h = int(width * 0.75), int(height * 0.75)
+    image = np.full((height, width), 60, dtype=np.uint8)
+    x0, y0 = (width - page_w) // 2, (height - page_h) // 2
+    image[y0 : y0 + page_h, x0 : x0 + page_w] = 235
+    # Lines of text, away from the page edges
+    for y in range(y0 + 150, y0 + page_h - 150, 90):
+        image[y : y + 12, x0 + 150 : x0 + page_w - 150] = 30
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    image = cv2.warpAffine(image, rotation, (width, height), borderValue=60)
+    corners = np.float32(
+        [[x0, y0], [x0 + page_w, y0], [x0 + page_w, y0 + page_h], [x0, y0 + page_h]]
+    )
+    return image, cv2.transform(corners[None], rotation)[0]
+
+
+def find_page_corners(image, detection_downscale):
+    crop_page = PROCESSOR_MANAGER.get_processor("CropPage")(
+        options={"detectionDownscale": detection_downscale},
+        relative_dir=None,
+        image_instance_ops=ImageInstanceOps(deepcopy(CONFIG_DEFAULTS)),
+    )
+    assert crop_page.get_detection_downscale(image) == detection_downscale
+    sheet = crop_page.find_page(image, "page.jpg")
+    assert len(sheet) == 4
+    return ImageUtils.order_points(np.float32(sheet))
+
+
+@pytest.mark.parametrize("angle", [-3, 4])
+def test_reduced_detection_finds_the_same_corners(angle):
+    image, corners = get_rotated_page(angle=angle)
+
+    full_corners = find_page_corners(image, 1)
+    reduced_corners = find_page_corners(image, 4)
+
+    corners = ImageUtils.order_points(corners)
+    # Note: the refined corners are sub-pixel, the full size contour's are not
+    assert np.abs(full_corners - corners).max() < 1.5
+    assert np.abs(reduced_corners - corners).max() < 1
+    assert np.abs(reduced_corners - full_corners).max() < 2
+
+
+def test_detection_is_not_reduced_below_the_minimum_width():
+    crop_page = PROCESSOR_MANAGER.get_processor("CropPage")(
+        options={"detectionDownscale": 4},
+        relative_dir=None,
+        image_instance_ops=ImageInstanceOps(deepcopy(CONFIG_DEFAULTS)),
+    )
+    processing_width = CONFIG_DEFAULTS.dimensions.processing_width
+    assert crop_page.get_detection_downscale(np.zeros((10, processing_width))) == 1
+    assert crop_page.get_detection_downscale(np.zeros((10, 1600))) == 3
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.core import ProcessingContext
+from src.tests.test_samples.sample2.boilerplate import CONFIG_BOILERPLATE
+from src.tests.utils import load_template_and_image, setup_mocker_patches
+
+
+def read_both_paths(template, image):
+    """Returns the (omr_response, multi_marked, field_block_shifts) of the annotated
+    read and of the headless read of the template ROI"""
+    image_instance_ops = template.image_instance_ops
+    image_instance_ops.tuning_config.outputs.save_detections = True
+    assert not image_instance_ops.headless
+    context = ProcessingContext()
+    omr_response, _, multi_marked, _ = image_instance_ops.read_omr_response(
+        template, image, "sheet.jpg", save_dir=None, context=context
+    )
+    annotated = omr_response, multi_marked, context.field_block_shifts
+
+    headless_context = ProcessingContext()
+    omr_response, multi_marked, _ = image_instance_ops.read_omr_response_headless(
+        template, image, headless_context
+    )
+    return annotated, (omr_response, multi_marked, headless_context.field_block_shifts)
+
+
+@pytest.mark.parametrize(
+    "alignment_params",
+    [
+        {"auto_align": False},
+        {"auto_align": True},
+        {"auto_align": True, "morph_downscale": 2},
+    ],
+)
+def test_headless_read_matches_annotated_read(mocker, tmp_path, alignment_params):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(
+        tmp_path,
+        config_boilerplate={**CONFIG_BOILERPLATE, "alignment_params": alignment_params},
+    )
+    assert template.compiled.roi != (0, 0, *template.page_dimensions)
+    page_width, page_height = template.page_dimensions
+
+    # The preprocessed sheet, and the sheet already at the page dimensions
+    for image in (in_omr, cv2.resize(in_omr, (page_width, page_height))):
+        annotated, headless = read_both_paths(template, image)
+        assert headless == annotated
+
+
+def test_headless_read_matches_annotated_read_near_roi_margin(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(
+        tmp_path,
+        config_boilerplate={
+            **CONFIG_BOILERPLATE,
+            "alignment_params": {"auto_align": True},
+        },
+    )
+    alignment_params = template.image_instance_ops.tuning_config.alignment_params
+    max_shift = alignment_params.max_steps * alignment_params.stride
+    page_width, page_height = template.page_dimensions
+    page = cv2.resize(in_omr, (page_width, page_height))
+
+    # Columns moved close to the reach of the alignment, i.e. to the ROI margin
+    for shift in (-max_shift + 4, max_shift - 4):
+        moved_page = cv2.warpAffine(
+            page,
+            np.float32([[1, 0, shift], [0, 1, 0]]),
+            (page_width, page_height),
+            borderValue=255,
+        )
+        annotated, headless = read_both_paths(template, moved_page)
+        assert headless == annotated
+        block_shifts = annotated[2]
+        assert max(abs(block_shift) for block_shift in block_shifts) >= max_shift // 2
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+
+from src.utils.image import ImageUtils
+
+
+def clipped_box_mean(img, x, y, box_w, box_h):
+    h, w = img.shape
+    y1, y2 = np.clip([y, y + box_h], 0, h)
+    x1, x2 = np.clip([x, x + box_w], 0, w)
+    return cv2.mean(img[y1:y2, x1:x2])[0]
+
+
+def test_box_means_match_cv2_mean():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (60, 80), dtype=np.uint8)
+    integral = ImageUtils.get_integral_image(img)
+    # Boxes inside the image, partly or fully outside of it
+    xs, ys = rng.integers(-20, 100, 2000), rng.integers(-20, 80, 2000)
+
+    for box_w, box_h in ((1, 1), (7, 5), (32, 32), (0, 5), (5, 0)):
+        means = ImageUtils.get_box_means(integral, xs, ys, box_w, box_h)
+        expected = [clipped_box_mean(img, x, y, box_w, box_h) for x, y in zip(xs, ys)]
+        assert means.tolist() == expected
+
+    # Within the image, same as slicing the box directly
+    means = ImageUtils.get_box_means(
+        integral, np.array([0, 48]), np.array([0, 28]), 32, 32
+    )
+    assert means.tolist() == [cv2.mean(img[0:32, 0:32])[0], cv2.mean(img[28:, 48:])[0]]
+
+
+def test_box_means_of_a_stack_match_each_image():
+    rng = np.random.default_rng(1)
+    stack = rng.integers(0, 256, (3, 40, 50), dtype=np.uint8)
+    xs, ys = rng.integers(-5, 50, 100), rng.integers(-5, 40, 100)
+
+    stack_means = ImageUtils.get_box_means(
+        ImageUtils.get_integral_image(stack), xs, ys, 9, 6
+    )
+
+    assert stack_means.shape == (3, 100)
+    for img, means in zip(stack, stack_means):
+        integral = ImageUtils.get_integral_image(img)
+        assert (
+            means.tolist() == ImageUtils.get_box_means(integral, xs, ys, 9, 6).tolist()
+        )
@@ -0,0 +1,72 @@
+from importlib.metadata import EntryPoint
+
+import pytest
+
+from src.processors.builtins import MedianBlur
+from src.processors.interfaces.ImagePreprocessor import ImagePreprocessor
+from src.processors.manager import (
+    PROCESSOR_ENTRY_POINT_GROUP,
+    PROCESSOR_MANAGER,
+    ProcessorManager,
+)
+from src.tests.test_samples.sample2.boilerplate import TEMPLATE_BOILERPLATE
+from src.tests.utils import load_sample2_template, setup_mocker_patches
+
+
+class PluginProcessor(ImagePreprocessor):
+    def apply_filter(self, image, _file_path, _context=None):
+        return image
+
+
+PLUGIN_ENTRY_POINTS = [
+    EntryPoint(
+        name="PluginProcessor",
+        value=f"{__name__}:PluginProcessor",
+        group=PROCESSOR_ENTRY_POINT_GROUP,
+    )
+]
+
+
+def patch_entry_points(mocker):
+    def entry_points(group, name=None):
+        return [
+            entry_point
+            for entry_point in PLUGIN_ENTRY_POINTS
+            if entry_point.group == group and name in (None, entry_point.name)
+        ]
+
+    mocker.patch("src.processors.manager.entry_points", side_effect=entry_points)
+
+
+def test_processors_are_loaded_once_asked_for():
+    processor_manager = ProcessorManager({"MedianBlur": "src.processors.builtins"})
+    assert processor_manager.processors == {}
+    assert "MedianBlur" in processor_manager.get_processor_names()
+
+    assert processor_manager.get_processor("MedianBlur") is MedianBlur
+    assert processor_manager.processors == {"MedianBlur": MedianBlur}
+
+
+def test_unknown_processor_is_not_loaded(mocker):
+    patch_entry_points(mocker)
+    processor_manager = ProcessorManager({})
+    with pytest.raises(Exception, match="Unknown processor 'Missing'"):
+        processor_manager.get_processor("Missing")
+    assert processor_manager.processors == {}
+
+
+def test_entry_point_processor_is_used_by_template(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    patch_entry_points(mocker)
+    mocker.patch.object(PROCESSOR_MANAGER, "processors", {})
+    assert "PluginProcessor" in PROCESSOR_MANAGER.get_processor_names()
+
+    template = load_sample2_template(
+        tmp_path,
+        template_boilerplate={
+            **TEMPLATE_BOILERPLATE,
+            "preProcessors": [{"name": "PluginProcessor", "options": {}}],
+        },
+    )
+    (pre_processor,) = template.pre_processors
+    assert isinstance(pre_processor, PluginProcessor)
@@ -0,0 +1,55 @@
+import cv2
+
+from src.core import ProcessingContext
+from src.tests.utils import (
+    SAMPLE2_IMAGE_PATH,
+    load_template_and_image,
+    setup_mocker_patches,
+)
+from src.utils.image import get_jpeg_size
+
+
+def test_reduced_decode_matches_full_decode(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    preprocessing_params = image_instance_ops.tuning_config.preprocessing_params
+    # A scan big enough to be decoded at half its size
+    big_image_path = str(tmp_path.joinpath("big.jpg"))
+    raw_omr = cv2.imread(str(SAMPLE2_IMAGE_PATH), cv2.IMREAD_GRAYSCALE)
+    cv2.imwrite(big_image_path, cv2.resize(raw_omr, None, fx=4.2, fy=4.2))
+    big_height, big_width = cv2.imread(big_image_path, cv2.IMREAD_GRAYSCALE).shape
+    assert get_jpeg_size(big_image_path) == (big_width, big_height)
+
+    responses = []
+    for reduced_decode in (False, True):
+        preprocessing_params.reduced_decode = reduced_decode
+        in_omr = image_instance_ops.read_image(big_image_path, template)
+        assert in_omr.shape[1] == big_width // (2 if reduced_decode else 1)
+        in_omr = image_instance_ops.apply_preprocessors(
+            big_image_path, in_omr, template, ProcessingContext()
+        )
+        response, _, _ = image_instance_ops.read_omr_response_headless(
+            template, in_omr, ProcessingContext()
+        )
+        responses.append(response)
+
+    assert responses[1] == responses[0]
+
+
+def test_unreadable_files_have_no_jpeg_size(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    missing_path = tmp_path.joinpath("missing.jpg")
+    assert get_jpeg_size(missing_path) is None
+    assert get_jpeg_size(tmp_path) is None
+    assert image_instance_ops.read_image(missing_path, template) is None
+
+    # Cut off before the frame header
+    jpeg_bytes = SAMPLE2_IMAGE_PATH.read_bytes()
+    truncated_path = tmp_path.joinpath("truncated.jpg")
+    for length in (0, 1, 3, 20):
+        truncated_path.write_bytes(jpeg_bytes[:length])
+        assert get_jpeg_size(truncated_path) is None
+        assert image_instance_ops.read_image(truncated_path, template) is None
@@ -0,0 +1,85 @@
+import json
+from csv import QUOTE_NONNUMERIC
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from src.utils.sinks import ResultSinks, get_unused_path
+
+COLUMNS = ["file_id", "input_path", "output_path", "score", "q1", "q2"]
+ROWS = [
+    ["a.jpg", Path("inputs/a.jpg"), Path("outputs/a.jpg"), 0, "A", ""],
+    ["b.jpg", Path("inputs/b.jpg"), Path("outputs/b.jpg"), 2.5, 'say "hi"', "C,D"],
+    ["c.jpg", Path("inputs/c.jpg"), Path("outputs/c.jpg"), "NA", None, "B"],
+]
+
+
+def write_rows(base_path, output_formats, batch_size=2):
+    result_sinks = ResultSinks(base_path, COLUMNS, output_formats)
+    for sink in result_sinks.sinks:
+        sink.batch_size = batch_size
+    for row in ROWS:
+        result_sinks.write_row(row)
+    result_sinks.close()
+
+
+def test_csv_sink_matches_pandas_rows(tmp_path):
+    pandas_path = tmp_path.joinpath("pandas.csv")
+    for row in [COLUMNS] + ROWS:
+        pd.DataFrame(row, dtype=str).T.to_csv(
+            pandas_path, mode="a", quoting=QUOTE_NONNUMERIC, header=False, index=False
+        )
+
+    write_rows(tmp_path.joinpath("sink"), ["csv"])
+    # Appends to an existing file without repeating the header
+    write_rows(tmp_path.joinpath("sink"), ["csv"])
+
+    pandas_rows = pandas_path.read_bytes()
+    header_length = len(pandas_rows.splitlines(keepends=True)[0])
+    assert (
+        tmp_path.joinpath("sink.csv").read_bytes()
+        == pandas_rows + pandas_rows[header_length:]
+    )
+
+
+def test_jsonl_sink_writes_a_row_per_line(tmp_path):
+    write_rows(tmp_path.joinpath("sink"), ["jsonl"])
+
+    with open(tmp_path.joinpath("sink.jsonl")) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["file_id"] for row in rows] == ["a.jpg", "b.jpg", "c.jpg"]
+    assert rows[1]["score"] == 2.5
+    assert rows[1]["input_path"] == str(Path("inputs/b.jpg"))
+
+
+def test_parquet_sink_matches_csv_sink(tmp_path):
+    pytest.importorskip("pyarrow")
+    write_rows(tmp_path.joinpath("sink"), ["csv", "parquet"])
+
+    csv_rows = pd.read_csv(
+        tmp_path.joinpath("sink.csv"), dtype=str, keep_default_na=False
+    )
+    parquet_rows = pd.read_parquet(tmp_path.joinpath("sink.parquet"))
+    pd.testing.assert_frame_equal(parquet_rows, csv_rows, check_dtype=False)
+
+
+def test_parquet_sink_keeps_existing_files(tmp_path):
+    pytest.importorskip("pyarrow")
+    write_rows(tmp_path.joinpath("sink"), ["parquet"])
+    # Parquet cannot append, the second run writes a numbered file
+    write_rows(tmp_path.joinpath("sink"), ["parquet"])
+
+    first_rows = pd.read_parquet(tmp_path.joinpath("sink.parquet"))
+    second_rows = pd.read_parquet(tmp_path.joinpath("sink_1.parquet"))
+    assert list(first_rows["file_id"]) == ["a.jpg", "b.jpg", "c.jpg"]
+    pd.testing.assert_frame_equal(second_rows, first_rows)
+
+
+def test_unused_path_numbers_taken_paths(tmp_path):
+    path = str(tmp_path.joinpath("Results.parquet"))
+    assert get_unused_path(path) == path
+
+    tmp_path.joinpath("Results.parquet").touch()
+    tmp_path.joinpath("Results_1.parquet").touch()
+    assert get_unused_path(path) == str(tmp_path.joinpath("Results_2.parquet"))
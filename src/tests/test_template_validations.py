@@ -68,6 +68,17 @@ def test_invalid_field_type(mocker):
     )
 
 
+def test_unknown_pre_processor(mocker):
+    def modify_template(template):
+        template["preProcessors"] = [{"name": "CropOnMarker", "options": {}}]
+
+    exception = write_jsons_and_run(mocker, modify_template=modify_template)
+    assert (
+        str(exception)
+        == f"Provided Template JSON is Invalid: '{BASE_SAMPLE_TEMPLATE_PATH}'"
+    )
+
+
 def test_overflow_labels(mocker):
     def modify_template(template):
         template["fieldBlocks"]["MCQ_Block_1"]["fieldLabels"] = ["q1..100"]
@@ -0,0 +1,173 @@
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from main import entry_point_for_args
+from src.tests.test_samples.sample2.boilerplate import (
+    CONFIG_BOILERPLATE,
+    TEMPLATE_BOILERPLATE,
+)
+from src.core import ProcessingContext
+from src.tests.utils import load_template_and_image, setup_mocker_patches
+
+BASE_SAMPLE_PATH = Path("src/tests/test_samples/sample2")
+
+
+def read_results(output_dir):
+    (results_path,) = output_dir.joinpath("Results").glob("Results_*.csv")
+    # Paths differ by output directory, compare the read responses
+    return pd.read_csv(results_path).drop(columns=["input_path", "output_path"])
+
+
+def run_with_threads(input_dir, output_dir, threads, workers=1, pipeline=False):
+    entry_point_for_args(
+        {
+            "autoAlign": False,
+            "debug": False,
+            "input_paths": [str(input_dir)],
+            "output_dir": str(output_dir),
+            "setLayout": False,
+            "threads": threads,
+            "workers": workers,
+            "pipeline": pipeline,
+        }
+    )
+    return read_results(output_dir)
+
+
+def setup_inputs(tmp_path):
+    input_dir = tmp_path.joinpath("inputs")
+    input_dir.mkdir()
+    shutil.copy(BASE_SAMPLE_PATH.joinpath("omr_marker.jpg"), input_dir)
+    for i in range(4):
+        shutil.copy(
+            BASE_SAMPLE_PATH.joinpath("sample.jpg"), input_dir.joinpath(f"{i}.jpg")
+        )
+    config = dict(CONFIG_BOILERPLATE, alignment_params={"auto_align": True})
+    with open(input_dir.joinpath("template.json"), "w") as f:
+        json.dump(TEMPLATE_BOILERPLATE, f)
+    with open(input_dir.joinpath("config.json"), "w") as f:
+        json.dump(config, f)
+    return input_dir
+
+
+def test_threads_match_serial_run(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    input_dir = setup_inputs(tmp_path)
+
+    serial_results = run_with_threads(input_dir, tmp_path.joinpath("serial"), 1)
+    threaded_results = run_with_threads(input_dir, tmp_path.joinpath("threaded"), 3)
+
+    assert len(serial_results) == 4
+    pd.testing.assert_frame_equal(threaded_results, serial_results)
+
+
+def assert_same_csv_files(serial_dir, workers_dir):
+    # Rows must be written in input order, byte for byte except the output paths
+    serial_csv_paths = sorted(serial_dir.glob("**/*.csv"))
+    assert serial_csv_paths
+    for serial_csv_path in serial_csv_paths:
+        workers_csv_path = workers_dir.joinpath(serial_csv_path.relative_to(serial_dir))
+        assert workers_csv_path.read_text().replace(
+            str(workers_dir), "OUTPUT_DIR"
+        ) == serial_csv_path.read_text().replace(str(serial_dir), "OUTPUT_DIR")
+
+
+def test_workers_match_serial_run(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    input_dir = setup_inputs(tmp_path)
+
+    serial_dir, workers_dir = tmp_path.joinpath("serial"), tmp_path.joinpath("workers")
+    run_with_threads(input_dir, serial_dir, 1)
+    run_with_threads(input_dir, workers_dir, 1, workers=2)
+
+    assert_same_csv_files(serial_dir, workers_dir)
+
+
+def test_workers_keep_the_config_of_an_inherited_template(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    input_dir = setup_inputs(tmp_path)
+    sub_dir = input_dir.joinpath("sub")
+    sub_dir.mkdir()
+    for i in range(3):
+        shutil.copy(
+            BASE_SAMPLE_PATH.joinpath("sample.jpg"), sub_dir.joinpath(f"{i}.jpg")
+        )
+    # The inherited template reads with the parent config, not this one
+    sub_config = dict(
+        CONFIG_BOILERPLATE, threshold_params={"MIN_JUMP": 100, "MIN_GAP": 100}
+    )
+    with open(sub_dir.joinpath("config.json"), "w") as f:
+        json.dump(sub_config, f)
+
+    serial_dir, workers_dir = tmp_path.joinpath("serial"), tmp_path.joinpath("workers")
+    run_with_threads(input_dir, serial_dir, 1)
+    run_with_threads(input_dir, workers_dir, 1, workers=2)
+
+    assert serial_dir.joinpath("sub", "Results").exists()
+    assert_same_csv_files(serial_dir, workers_dir)
+
+
+def test_pipeline_matches_serial_run(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    input_dir = setup_inputs(tmp_path)
+
+    serial_results = run_with_threads(input_dir, tmp_path.joinpath("serial"), 1)
+    pipelined_results = run_with_threads(
+        input_dir, tmp_path.joinpath("pipelined"), 2, pipeline=True
+    )
+
+    pd.testing.assert_frame_equal(pipelined_results, serial_results)
+    for image_path in tmp_path.joinpath("serial", "CheckedOMRs").glob("*.jpg"):
+        pipelined_image_path = tmp_path.joinpath(
+            "pipelined", "CheckedOMRs", image_path.name
+        )
+        assert pipelined_image_path.read_bytes() == image_path.read_bytes()
+
+
+def test_reads_without_a_context_share_no_state(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, in_omr = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    context = ProcessingContext()
+    assert image_instance_ops.get_context(context) is context
+    assert image_instance_ops.get_context() is not image_instance_ops.get_context()
+
+    def read_response(_):
+        response, _, bubble_stats = image_instance_ops.read_omr_response_headless(
+            template, in_omr
+        )
+        return response, bubble_stats.field_thresholds.tolist()
+
+    expected = read_response(None)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(read_response, range(8))) == [expected] * 8
+
+
+def test_pipeline_fails_on_a_decode_error(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    input_dir = setup_inputs(tmp_path)
+    mocker.patch(
+        "src.core.ImageInstanceOps.read_image", side_effect=OSError("Corrupt scan")
+    )
+
+    errors = []
+
+    def run_pipeline():
+        try:
+            run_with_threads(
+                input_dir, tmp_path.joinpath("pipelined"), 2, pipeline=True
+            )
+        except OSError as e:
+            errors.append(e)
+
+    # Note: a lost reader error would leave the run waiting for more sheets
+    run = threading.Thread(target=run_pipeline, daemon=True)
+    run.start()
+    run.join(timeout=60)
+    assert not run.is_alive()
+    assert [str(e) for e in errors] == ["Corrupt scan"]
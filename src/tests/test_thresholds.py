@@ -0,0 +1,126 @@
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+from src import constants
+from src.core import ImageInstanceOps
+from src.defaults import CONFIG_DEFAULTS
+
+
+@pytest.fixture
+def image_instance_ops():
+    return ImageInstanceOps(deepcopy(CONFIG_DEFAULTS))
+
+
+# The per-strip Python scans the vectorized kernels replaced
+def loop_global_threshold(threshold_params, q_vals_orig, looseness=1):
+    global_default_threshold = (
+        constants.GLOBAL_PAGE_THRESHOLD_WHITE
+        if threshold_params.PAGE_TYPE_FOR_THRESHOLD == "white"
+        else constants.GLOBAL_PAGE_THRESHOLD_BLACK
+    )
+    q_vals = sorted(q_vals_orig)
+    ls = (looseness + 1) // 2
+    l = len(q_vals) - ls
+    max1, thr1 = threshold_params.MIN_JUMP, global_default_threshold
+    for i in range(ls, l):
+        jump = q_vals[i + ls] - q_vals[i - ls]
+        if jump > max1:
+            max1 = jump
+            thr1 = q_vals[i - ls] + jump / 2
+
+    max2, thr2 = threshold_params.MIN_JUMP, global_default_threshold
+    for i in range(ls, l):
+        jump = q_vals[i + ls] - q_vals[i - ls]
+        new_thr = q_vals[i - ls] + jump / 2
+        if jump > max2 and abs(thr1 - new_thr) > threshold_params.JUMP_DELTA:
+            max2 = jump
+            thr2 = new_thr
+    return thr1, thr1 - max1 // 2, thr1 + max1 // 2, thr2
+
+
+def loop_local_threshold(threshold_params, q_vals, global_thr, no_outliers):
+    q_vals = sorted(q_vals)
+    if len(q_vals) < 3:
+        return (
+            global_thr
+            if np.max(q_vals) - np.min(q_vals) < threshold_params.MIN_GAP
+            else np.mean(q_vals)
+        )
+    l = len(q_vals) - 1
+    max1, thr1 = threshold_params.MIN_JUMP, 255
+    for i in range(1, l):
+        jump = q_vals[i + 1] - q_vals[i - 1]
+        if jump > max1:
+            max1 = jump
+            thr1 = q_vals[i - 1] + jump / 2
+    confident_jump = threshold_params.MIN_JUMP + threshold_params.CONFIDENT_SURPLUS
+    if max1 < confident_jump and no_outliers:
+        thr1 = global_thr
+    return thr1
+
+
+def get_test_strips(rng):
+    strips = [rng.uniform(0, 255, size) for size in rng.integers(1, 12, 200)]
+    # Ties: few distinct values give equal jumps at several positions
+    strips += [rng.choice([40.0, 90.0, 200.0], size) for size in range(1, 12)]
+    strips += [rng.integers(0, 8, size) * 30.0 for size in rng.integers(1, 12, 50)]
+    # All-equal values, and fewer than 3 values
+    strips += [np.full(size, 120.0) for size in range(1, 6)]
+    strips += [np.array([20.0]), np.array([20.0, 40.0]), np.array([20.0, 200.0])]
+    return strips
+
+
+@pytest.mark.parametrize("looseness", [1, 2, 4])
+def test_global_thresholds_match_loop(image_instance_ops, looseness):
+    threshold_params = image_instance_ops.tuning_config.threshold_params
+    rng = np.random.default_rng(0)
+    for q_vals in get_test_strips(rng) + [np.array([])]:
+        expected = loop_global_threshold(threshold_params, q_vals, looseness)
+        actual = image_instance_ops.get_global_thresholds(q_vals, looseness)
+        assert [float(value) for value in actual] == list(expected)
+
+    # Over leading axes, each row gives the same as on its own
+    q_vals = rng.integers(0, 6, (7, 30)) * 45.0
+    thresholds = image_instance_ops.get_global_thresholds(q_vals, looseness)
+    for row, row_q_vals in enumerate(q_vals):
+        expected = loop_global_threshold(threshold_params, row_q_vals, looseness)
+        assert [float(values[row]) for values in thresholds] == list(expected)
+
+
+def test_local_thresholds_match_loop(image_instance_ops):
+    threshold_params = image_instance_ops.tuning_config.threshold_params
+    rng = np.random.default_rng(1)
+    strips = get_test_strips(rng)
+    q_lengths = np.array([len(strip) for strip in strips])
+    padded_q_vals = np.full((len(strips), q_lengths.max()), np.inf)
+    for strip_index, strip in enumerate(strips):
+        padded_q_vals[strip_index, : len(strip)] = strip
+
+    for global_thr in (0.0, 127.5, 255.0):
+        for no_outliers in (
+            np.zeros(len(strips), dtype=bool),
+            np.ones(len(strips), dtype=bool),
+            rng.random(len(strips)) < 0.5,
+        ):
+            thresholds = image_instance_ops.get_local_thresholds(
+                padded_q_vals, q_lengths, global_thr, no_outliers
+            )
+            expected = [
+                loop_local_threshold(
+                    threshold_params, strip, global_thr, strip_no_outliers
+                )
+                for strip, strip_no_outliers in zip(strips, no_outliers)
+            ]
+            assert thresholds.tolist() == expected
+
+
+def test_first_largest_jumps_pick_the_first_tie():
+    jumps = np.array([[10.0, 50.0, 50.0, 20.0], [5.0, 5.0, 5.0, 5.0]])
+    lower_vals = np.array([[0.0, 10.0, 60.0, 110.0], [0.0, 1.0, 2.0, 3.0]])
+    max_jumps, thresholds = ImageInstanceOps.get_first_largest_jumps(
+        jumps, lower_vals, min_jump=25, default_threshold=255
+    )
+    assert max_jumps.tolist() == [50.0, 25.0]
+    assert thresholds.tolist() == [35.0, 255.0]
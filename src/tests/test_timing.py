@@ -0,0 +1,76 @@
+from copy import deepcopy
+from time import perf_counter
+
+import cv2
+
+from src.core import ProcessingContext
+from src.defaults import CONFIG_DEFAULTS
+from src.entry import print_stats
+from src.tests.utils import (
+    SAMPLE2_IMAGE_PATH,
+    load_template_and_image,
+    setup_mocker_patches,
+)
+from src.utils.timing import timed_stage
+
+
+def test_stage_timings_are_recorded(mocker, tmp_path):
+    setup_mocker_patches(mocker)
+    template, _ = load_template_and_image(tmp_path)
+    image_instance_ops = template.image_instance_ops
+    raw_omr = cv2.imread(str(SAMPLE2_IMAGE_PATH), cv2.IMREAD_GRAYSCALE)
+
+    context = ProcessingContext(SAMPLE2_IMAGE_PATH)
+    in_omr = image_instance_ops.apply_preprocessors(
+        SAMPLE2_IMAGE_PATH, raw_omr, template, context
+    )
+    image_instance_ops.read_omr_response_headless(template, in_omr, context)
+
+    stage_timings = context.stage_timings
+    for stage in ("preprocess.CropOnMarkers", "sampling", "thresholding"):
+        assert stage_timings[stage] > 0
+    assert not context.running_stages
+
+
+class InnerProcessor:
+    @timed_stage
+    def apply_filter(self, image, file_path, context):
+        return image
+
+
+class OuterProcessor:
+    def __init__(self):
+        self.inner = InnerProcessor()
+
+    @timed_stage
+    def apply_filter(self, image, file_path, context):
+        return self.inner.apply_filter(image, file_path, context)
+
+
+def test_nested_processor_is_timed_in_the_outer_stage():
+    context = ProcessingContext()
+    OuterProcessor().apply_filter(None, None, context)
+    # Note: the inner call is counted in the outer stage only
+    assert set(context.stage_timings) == {"preprocess.OuterProcessor"}
+
+    InnerProcessor().apply_filter(None, None, context=context)
+    assert set(context.stage_timings) == {
+        "preprocess.OuterProcessor",
+        "preprocess.InnerProcessor",
+    }
+    assert not context.running_stages
+
+
+def test_stats_of_a_fast_run_are_not_clamped(mocker):
+    log = mocker.patch("src.entry.logger.info")
+    tuning_config = deepcopy(CONFIG_DEFAULTS)
+    tuning_config.outputs.show_image_level = 0
+
+    print_stats(perf_counter() - 0.5, 10, tuning_config)
+
+    logs = "\n".join(str(call.args[0]) for call in log.call_args_list)
+    assert "in 0.5 seconds" in logs
+    assert "~ 0.05 seconds/OMR" in logs
+
+    log.reset_mock()
+    print_stats(perf_counter(), 0, tuning_config)
@@ -1,12 +1,24 @@
 import json
 import os
+import shutil
 from copy import deepcopy
+from pathlib import Path
 
+import cv2
 from freezegun import freeze_time
 
 from main import entry_point_for_args
+from src.core import ProcessingContext
+from src.template import Template
+from src.tests.test_samples.sample2.boilerplate import (
+    CONFIG_BOILERPLATE,
+    TEMPLATE_BOILERPLATE,
+)
+from src.utils.parsing import open_config_with_defaults
 
 FROZEN_TIMESTAMP = "1970-01-01"
+SAMPLE2_PATH = Path("src/tests/test_samples/sample2")
+SAMPLE2_IMAGE_PATH = SAMPLE2_PATH.joinpath("sample.jpg")
 
 
 def setup_mocker_patches(mocker):
@@ -20,6 +32,30 @@ def setup_mocker_patches(mocker):
     mock_wait_key.return_value = ord("q")
 
 
+def load_sample2_template(
+    tmp_path, template_boilerplate=TEMPLATE_BOILERPLATE, config_boilerplate=None
+):
+    """Builds the sample2 Template from json files written into tmp_path"""
+    shutil.copy(SAMPLE2_PATH.joinpath("omr_marker.jpg"), tmp_path)
+    template_path = tmp_path.joinpath("template.json")
+    config_path = tmp_path.joinpath("config.json")
+    with open(template_path, "w") as f:
+        json.dump(template_boilerplate, f)
+    with open(config_path, "w") as f:
+        json.dump(config_boilerplate or CONFIG_BOILERPLATE, f)
+    return Template(template_path, open_config_with_defaults(config_path))
+
+
+def load_template_and_image(tmp_path, **boilerplates):
+    """Returns the sample2 Template and its sample sheet, preprocessed"""
+    template = load_sample2_template(tmp_path, **boilerplates)
+    in_omr = cv2.imread(str(SAMPLE2_IMAGE_PATH), cv2.IMREAD_GRAYSCALE)
+    in_omr = template.image_instance_ops.apply_preprocessors(
+        SAMPLE2_IMAGE_PATH, in_omr, template, ProcessingContext()
+    )
+    return template, in_omr
+
+
 def run_entry_point(input_path, output_dir):
     args = {
         "autoAlign": False,
@@ -1,12 +1,10 @@
 import argparse
 import json
 import os
-from csv import QUOTE_NONNUMERIC
 from time import localtime, strftime
 
-import pandas as pd
-
 from src.logger import logger
+from src.utils.sinks import ResultSinks
 
 
 def load_json(path, **rest):
@@ -51,7 +49,7 @@ def setup_dirs_for_paths(paths):
             os.makedirs(save_output_dir)
 
 
-def setup_outputs_for_template(paths, template):
+def setup_outputs_for_template(paths, template, output_formats=("csv",)):
     # TODO: consider moving this into a class instance
     ns = argparse.Namespace()
     logger.info("Checking Files...")
@@ -67,29 +65,22 @@ def setup_outputs_for_template(paths, template):
         "score",
     ] + template.output_columns
     ns.OUTPUT_SET = []
-    ns.files_obj = {}
     TIME_NOW_HRS = strftime("%I%p", localtime())
+    # Paths without the extension of each output format
     ns.filesMap = {
-        "Results": os.path.join(paths.results_dir, f"Results_{TIME_NOW_HRS}.csv"),
-        "MultiMarked": os.path.join(paths.manual_dir, "MultiMarkedFiles.csv"),
-        "Errors": os.path.join(paths.manual_dir, "ErrorFiles.csv"),
+        "Results": os.path.join(paths.results_dir, f"Results_{TIME_NOW_HRS}"),
+        "MultiMarked": os.path.join(paths.manual_dir, "MultiMarkedFiles"),
+        "Errors": os.path.join(paths.manual_dir, "ErrorFiles"),
+    }
+    ns.result_sinks = {
+        file_key: ResultSinks(file_path, ns.sheetCols, output_formats)
+        for file_key, file_path in ns.filesMap.items()
     }
-
-    for file_key, file_name in ns.filesMap.items():
-        if not os.path.exists(file_name):
-            logger.info(f"Created new file: '{file_name}'")
-            # moved handling of files to pandas csv writer
-            ns.files_obj[file_key] = file_name
-            # Create Header Columns
-            pd.DataFrame([ns.sheetCols], dtype=str).to_csv(
-                ns.files_obj[file_key],
-                mode="a",
-                quoting=QUOTE_NONNUMERIC,
-                header=False,
-                index=False,
-            )
-        else:
-            logger.info(f"Present : appending to '{file_name}'")
-            ns.files_obj[file_key] = open(file_name, "a")
 
     return ns
+
+
+def close_outputs_for_template(ns):
+    # Writes out the rows still buffered by the result sinks
+    for result_sinks in ns.result_sinks.values():
+        result_sinks.close()
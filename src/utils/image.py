@@ -6,6 +6,9 @@
  Github: https://github.com/Udayraj123
 
 """
+import threading
+from functools import lru_cache
+
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
@@ -13,7 +16,71 @@ import numpy as np
 from src.logger import logger
 
 plt.rcParams["figure.figsize"] = (10.0, 8.0)
-CLAHE_HELPER = cv2.createCLAHE(clipLimit=5.0, tileGridSize=(8, 8))
+THREAD_LOCAL = threading.local()
+# cv2.imread flags decoding at 1/downscale the size, JPEGs are scaled in the DCT
+REDUCED_GRAYSCALE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+# JPEG markers without a length field, and the start of frame markers (SOFn)
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD9)}
+JPEG_FRAME_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def get_clahe_helper():
+    # Note: cv2.CLAHE keeps working buffers between calls, so each thread gets its own
+    if not hasattr(THREAD_LOCAL, "clahe_helper"):
+        THREAD_LOCAL.clahe_helper = cv2.createCLAHE(clipLimit=5.0, tileGridSize=(8, 8))
+    return THREAD_LOCAL.clahe_helper
+
+
+def get_jpeg_size(path):
+    """Returns (width, height) from the frame header of a JPEG file, None otherwise"""
+    try:
+        with open(path, "rb") as f:
+            return read_jpeg_frame_size(f)
+    except OSError:
+        # Note: left for cv2.imread to report
+        return None
+
+
+def read_jpeg_frame_size(f):
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        if f.read(1) != b"\xff":
+            return None
+        marker = f.read(1)
+        # Note: markers may be preceded by any number of 0xFF fill bytes
+        while marker == b"\xff":
+            marker = f.read(1)
+        if len(marker) == 0:
+            return None
+        code = marker[0]
+        if code in JPEG_STANDALONE_MARKERS:
+            continue
+        segment_length = int.from_bytes(f.read(2), "big")
+        if code in JPEG_FRAME_MARKERS:
+            frame_header = f.read(5)
+            if len(frame_header) < 5:
+                return None
+            height = int.from_bytes(frame_header[1:3], "big")
+            width = int.from_bytes(frame_header[3:5], "big")
+            return width, height
+        if segment_length < 2:
+            return None
+        f.seek(segment_length - 2, 1)
+
+
+@lru_cache(maxsize=None)
+def get_gamma_table(gamma):
+    # build a lookup table mapping the pixel values [0, 255] to
+    # their adjusted gamma values
+    inv_gamma = 1.0 / gamma
+    return np.array(
+        [((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]
+    ).astype("uint8")
 
 
 class ImageUtils:
@@ -24,6 +91,23 @@ class ImageUtils:
         logger.info(f"Saving Image to '{path}'")
         cv2.imwrite(path, final_marked)
 
+    @staticmethod
+    def get_decode_downscale(image_size, target_sizes, min_oversampling):
+        """
+        Returns the largest reduced decode downscale (8, 4 or 2, else 1) leaving at
+        least min_oversampling pixels per pixel of each (width, height) target size
+        """
+        # Note: sides are compared sorted, the EXIF orientation may swap them
+        image_sides = sorted(image_size)
+        for downscale in sorted(REDUCED_GRAYSCALE_FLAGS, reverse=True):
+            if all(
+                side / downscale >= min_oversampling * target_side
+                for target_size in target_sizes
+                for side, target_side in zip(image_sides, sorted(target_size))
+            ):
+                return downscale
+        return 1
+
     @staticmethod
     def resize_util(img, u_width, u_height=None):
         if u_height is None:
@@ -72,6 +156,44 @@ class ImageUtils:
     def normalize_util(img, alpha=0, beta=255):
         return cv2.normalize(img, alpha, beta, norm_type=cv2.NORM_MINMAX)
 
+    @staticmethod
+    def get_integral_image(img):
+        # Summed-area table of shape (..., h + 1, w + 1), first row and column are zeros
+        # float64 keeps the sums exact for any realistic page size
+        if img.ndim == 2:
+            return cv2.integral(img, sdepth=cv2.CV_64F)
+        # Stack of images
+        h, w = img.shape[-2:]
+        integral = np.zeros(img.shape[:-2] + (h + 1, w + 1), dtype=np.float64)
+        table = integral[..., 1:, 1:]
+        np.cumsum(img, axis=-2, dtype=np.float64, out=table)
+        np.cumsum(table, axis=-1, out=table)
+        return integral
+
+    @staticmethod
+    def get_box_means(integral, xs, ys, box_w, box_h):
+        """
+        Mean intensity of every box (x, y, box_w, box_h) read from a summed-area table.
+        Same result as cv2.mean(img[y : y + box_h, x : x + box_w]) for each box,
+        boxes are clipped to the image bounds (also on the left and top, where the
+        slicing would wrap around instead) and empty boxes have a mean of 0.
+        Leading axes of the integral (e.g. a stack of sheets) are kept in the result.
+        """
+        h, w = integral.shape[-2] - 1, integral.shape[-1] - 1
+        x1, x2 = np.clip(xs, 0, w), np.clip(xs + box_w, 0, w)
+        y1, y2 = np.clip(ys, 0, h), np.clip(ys + box_h, 0, h)
+        sums = (
+            integral[..., y2, x2]
+            - integral[..., y1, x2]
+            - integral[..., y2, x1]
+            + integral[..., y1, x1]
+        )
+        areas = (x2 - x1) * (y2 - y1)
+        # Note: multiply by the reciprocal like cv2.mean does, for identical values
+        with np.errstate(divide="ignore"):
+            scale = np.where(areas > 0, 1.0 / areas, 0.0)
+        return sums * scale
+
     @staticmethod
     def auto_canny(image, sigma=0.93):
         # compute the median of the single channel pixel intensities
@@ -87,18 +209,41 @@ class ImageUtils:
 
     @staticmethod
     def adjust_gamma(image, gamma=1.0):
-        # build a lookup table mapping the pixel values [0, 255] to
-        # their adjusted gamma values
-        inv_gamma = 1.0 / gamma
-        table = np.array(
-            [((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]
-        ).astype("uint8")
-
         # apply gamma correction using the lookup table
-        return cv2.LUT(image, table)
+        return cv2.LUT(image, get_gamma_table(gamma))
+
+    @staticmethod
+    def normalize_lut(image, table, invert=False):
+        """
+        Same as normalize_util(cv2.LUT(image, table)), inverted if asked, in a single
+        pass over the image. The table must be non-decreasing.
+        """
+        min_value, max_value, _, _ = cv2.minMaxLoc(image)
+        low, high = int(min_value), int(max_value)
+        fused_table = table.copy()
+        # Note: the table keeps the order of the values, the extremes of the image
+        # map to the extremes of its reachable entries
+        fused_table[low : high + 1] = ImageUtils.normalize_util(
+            table[low : high + 1]
+        ).ravel()
+        if invert:
+            fused_table = 255 - fused_table
+        return cv2.LUT(image, fused_table)
 
     @staticmethod
     def four_point_transform(image, pts):
+        transform_matrix, dimensions = ImageUtils.get_four_point_transform(pts)
+        warped = cv2.warpPerspective(image, transform_matrix, dimensions)
+
+        # return the warped image
+        return warped
+
+    @staticmethod
+    def get_four_point_transform(pts):
+        """
+        The perspective transform of four_point_transform and the (width, height)
+        of the image it warps to
+        """
         # obtain a consistent order of the points and unpack them
         # individually
         rect = ImageUtils.order_points(pts)
@@ -133,10 +278,22 @@ class ImageUtils:
         )
 
         transform_matrix = cv2.getPerspectiveTransform(rect, dst)
-        warped = cv2.warpPerspective(image, transform_matrix, (max_width, max_height))
+        return transform_matrix, (max_width, max_height)
 
-        # return the warped image
-        return warped
+    @staticmethod
+    def get_resize_transform(from_size, to_size):
+        """
+        The 3x3 transform taking pixels of an image of from_size (width, height) to
+        where cv2.resize to to_size samples them
+        """
+        scale_x, scale_y = to_size[0] / from_size[0], to_size[1] / from_size[1]
+        return np.array(
+            [
+                [scale_x, 0, 0.5 * scale_x - 0.5],
+                [0, scale_y, 0.5 * scale_y - 0.5],
+                [0, 0, 1],
+            ]
+        )
 
     @staticmethod
     def order_points(pts):
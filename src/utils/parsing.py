@@ -33,16 +33,9 @@ OVERRIDE_MERGER = Merger(
 
 
 def get_concatenated_response(omr_response, template):
-    # Multi-column/multi-row questions which need to be concatenated
-    concatenated_response = {}
-    for field_label, concatenate_keys in template.custom_labels.items():
-        custom_label = "".join([omr_response[k] for k in concatenate_keys])
-        concatenated_response[field_label] = custom_label
-
-    for field_label in template.non_custom_labels:
-        concatenated_response[field_label] = omr_response[field_label]
-
-    return concatenated_response
+    compiled = template.compiled
+    field_responses = [omr_response[label] for label in compiled.field_labels]
+    return compiled.get_concatenated_response(field_responses)
 
 
 def open_config_with_defaults(config_path):
@@ -0,0 +1,188 @@
+import json
+import math
+import os
+from csv import QUOTE_NONNUMERIC, writer
+
+import numpy as np
+
+from src.logger import logger
+
+# Rows buffered by a sink before they are written out together
+DEFAULT_BATCH_SIZE = 64
+
+
+def to_csv_value(value):
+    # Same text as pd.DataFrame(row, dtype=str).to_csv gives for the value
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
+
+
+def to_json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (str, int, float)) or value is None:
+        return value
+    return str(value)
+
+
+def get_unused_path(path):
+    # path itself if free, else the first free of path_1, path_2, ...
+    root, extension = os.path.splitext(path)
+    number = 0
+    while os.path.exists(path):
+        number += 1
+        path = f"{root}_{number}{extension}"
+    return path
+
+
+class ResultSink:
+    """
+    Base class of the writers of result rows. Rows are buffered and written out in
+    batches of batch_size, the file stays open until close()
+    """
+
+    extension = None
+
+    def __init__(self, path, columns, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.write_rows(self.rows)
+            self.rows = []
+
+    def write_rows(self, rows):
+        """Writes out a batch of rows"""
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class CsvResultSink(ResultSink):
+    """Appends quoted rows to a csv file, writing the header when creating it"""
+
+    extension = ".csv"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        file_exists = os.path.exists(self.path)
+        # Note: same dialect as DataFrame.to_csv(quoting=QUOTE_NONNUMERIC)
+        self.file = open(self.path, "a", newline="")
+        self.writer = writer(
+            self.file, quoting=QUOTE_NONNUMERIC, lineterminator=os.linesep
+        )
+        if file_exists:
+            logger.info(f"Present : appending to '{self.path}'")
+        else:
+            logger.info(f"Created new file: '{self.path}'")
+            self.write_rows([self.columns])
+
+    def write_rows(self, rows):
+        self.writer.writerows([to_csv_value(value) for value in row] for row in rows)
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class JsonLinesResultSink(ResultSink):
+    """Appends one json object per row, keyed by the columns"""
+
+    extension = ".jsonl"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file = open(self.path, "a")
+
+    def write_rows(self, rows):
+        self.file.writelines(
+            json.dumps(dict(zip(self.columns, map(to_json_value, row)))) + "\n"
+            for row in rows
+        )
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetResultSink(ResultSink):
+    """
+    Writes each batch of rows as a row group of string columns (needs pyarrow).
+    Parquet files cannot be appended to, an existing file is kept and the rows go
+    to a new numbered file next to it
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception(
+                "Parquet outputs need pyarrow: pip install omrchecker[parquet]"
+            )
+        path = get_unused_path(self.path)
+        if path != self.path:
+            logger.info(f"Present : '{self.path}', writing to '{path}'")
+        else:
+            logger.info(f"Created new file: '{path}'")
+        self.path = path
+        self.pa = pa
+        self.schema = pa.schema([(column, pa.string()) for column in self.columns])
+        self.parquet_writer = pq.ParquetWriter(self.path, self.schema)
+
+    def write_rows(self, rows):
+        columns = zip(*([to_csv_value(value) for value in row] for row in rows))
+        self.parquet_writer.write_table(
+            self.pa.Table.from_arrays(
+                [self.pa.array(column, self.pa.string()) for column in columns],
+                schema=self.schema,
+            )
+        )
+
+    def close(self):
+        super().close()
+        self.parquet_writer.close()
+
+
+RESULT_SINKS = {
+    "csv": CsvResultSink,
+    "jsonl": JsonLinesResultSink,
+    "parquet": ParquetResultSink,
+}
+
+
+class ResultSinks:
+    """Writes every row to one sink per selected output format"""
+
+    def __init__(self, base_path, columns, output_formats):
+        self.sinks = [
+            RESULT_SINKS[output_format](
+                f"{base_path}{RESULT_SINKS[output_format].extension}", columns
+            )
+            for output_format in output_formats
+        ]
+
+    def write_row(self, row):
+        for sink in self.sinks:
+            sink.write_row(row)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
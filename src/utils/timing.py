@@ -0,0 +1,87 @@
+"""
+
+ OMRChecker
+
+ Author: Udayraj Deshmukh
+ Github: https://github.com/Udayraj123
+
+"""
+import json
+from functools import wraps
+
+import numpy as np
+from rich.table import Table
+
+from src.logger import console
+
+PREPROCESS_STAGE_PREFIX = "preprocess."
+
+
+def timed_stage(method):
+    """
+    Wraps a processor method(image, file_path, context) to add its running time to
+    the stage of the processor class in the ProcessingContext, when one is given.
+    Processors run by another processor are counted in the stage of the outer one.
+    """
+
+    @wraps(method)
+    def timed_method(self, *args, **kwargs):
+        context = args[2] if len(args) > 2 else kwargs.get("context")
+        if context is None or any(
+            stage.startswith(PREPROCESS_STAGE_PREFIX)
+            for stage in context.running_stages
+        ):
+            return method(self, *args, **kwargs)
+        with context.time_stage(f"{PREPROCESS_STAGE_PREFIX}{type(self).__name__}"):
+            return method(self, *args, **kwargs)
+
+    return timed_method
+
+
+class TimingReport:
+    """
+    Collects the stage timings of every sheet of a run. Prints p50/p95/max of each
+    stage and, given a jsonl_path, appends one line of timings per sheet to it.
+    """
+
+    def __init__(self, jsonl_path=None):
+        # Seconds of each sheet per stage, stages in the order they were first seen
+        self.stage_timings = {}
+        self.jsonl_file = None if jsonl_path is None else open(jsonl_path, "a")
+
+    def add(self, file_path, stage_timings):
+        for stage, seconds in stage_timings.items():
+            self.stage_timings.setdefault(stage, []).append(seconds)
+        if self.jsonl_file is not None:
+            timings_ms = {
+                stage: round(seconds * 1000, 3)
+                for stage, seconds in stage_timings.items()
+            }
+            self.jsonl_file.write(
+                json.dumps({"file_path": str(file_path), "timings_ms": timings_ms})
+                + "\n"
+            )
+
+    def close(self):
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+            self.jsonl_file = None
+
+    def print_summary(self):
+        if not self.stage_timings:
+            return
+        table = Table(title="Stage Timings (ms)", show_lines=False)
+        table.add_column("Stage", style="cyan", no_wrap=True)
+        for column in ("Sheets", "p50", "p95", "max"):
+            table.add_column(column, style="magenta", justify="right")
+        for stage, timings in self.stage_timings.items():
+            timings_ms = np.array(timings) * 1000
+            p50, p95 = np.percentile(timings_ms, [50, 95])
+            table.add_row(
+                stage,
+                str(len(timings_ms)),
+                f"{p50:.1f}",
+                f"{p95:.1f}",
+                f"{timings_ms.max():.1f}",
+            )
+        console.print(table, justify="center")
@@ -13,6 +13,7 @@ from jsonschema import validate
 from rich.table import Table
 
 from src.logger import console, logger
+from src.processors.manager import PROCESSOR_MANAGER
 from src.schemas import SCHEMA_JSONS, SCHEMA_VALIDATORS
 
 
@@ -79,6 +80,25 @@ def validate_template_json(json_data, template_path):
             f"Provided Template JSON is Invalid: '{template_path}'"
         ) from None
 
+    # Note: processors are imported once used, their names are checked up front
+    processor_names = PROCESSOR_MANAGER.get_processor_names()
+    unknown_names = [
+        pre_processor["name"]
+        for pre_processor in json_data["preProcessors"]
+        if pre_processor["name"] not in processor_names
+    ]
+    if unknown_names:
+        table = Table(show_lines=True)
+        table.add_column("Key", style="cyan", no_wrap=True)
+        table.add_column("Error", style="magenta")
+        for name in unknown_names:
+            table.add_row(
+                f"preProcessors.{name}",
+                f"Unknown processor '{name}', available processors: {processor_names}",
+            )
+        console.print(table, justify="center")
+        raise Exception(f"Provided Template JSON is Invalid: '{template_path}'")
+
 
 def validate_config_json(json_data, config_path):
     logger.info(f"Loading config.json: {config_path}")